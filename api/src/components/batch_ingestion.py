@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from components.ollama_prompt_creator import product_discovery_workflow
+from driver.neo4j import Neo4jDatabase
+from utils.job_store import chunk_hash, job_progress_callback
+from utils.llm_budget import use_llm_budget
+
+# LLM calls in flight for the whole batch, shared by all its documents
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "16"))
+# Documents extracted at the same time, enough to keep the LLM budget busy between the reduce steps
+BATCH_DOCUMENT_CONCURRENCY = int(os.getenv("BATCH_DOCUMENT_CONCURRENCY", "8"))
+# Product reports buffered before one batched graph write
+BATCH_WRITE_SIZE = int(os.getenv("BATCH_WRITE_SIZE", "50"))
+
+NEO4J_WRITE_URL = os.getenv("NEO4J_WRITE_URL", "bolt://kg:7688")
+
+BACKUP_FOLDER = "./backup"
+
+
+def build_product_report(finalized_information: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    The product report of a patent, as shown in the frontend and stored in the knowledge graph.
+    :param finalized_information: The output of product_discovery_workflow.
+    """
+    return {
+        "type": "cosmetic_product_patent",
+        "patent_no": finalized_information.get("patent_no",""),
+        "inventor_names": finalized_information.get("inventor_names",""),
+        "cpcc_codes": finalized_information.get("cpcc_codes",""),
+        "assignee":finalized_information.get("assignee_information",""),
+        "task_type": "product discover workflow",
+        "properties": {
+            "product_name": finalized_information.get("product_name", ""),
+            "description":finalized_information.get("description", ""),
+            "functional_roles": finalized_information.get("functional_roles", [])
+        }
+    }
+
+
+def backup_product_report(response_object: Dict[str, Any], folder_path: str = BACKUP_FOLDER) -> str:
+    """
+    Save the report to a JSON file using patent_no as the filename.
+    :return: The path of the backup.
+    """
+    patent_no = (response_object["patent_no"] or "unknown").replace(" ", "_").replace("/", "_")  # Replace unsafe characters
+    os.makedirs(folder_path, exist_ok=True)  # Ensure the folder exists
+    filepath = os.path.join(folder_path, f"{patent_no}.json")
+
+    with open(filepath, "w") as json_file:
+        json.dump(response_object, json_file, indent=4)
+
+    print(f"Backup saved: {filepath}")
+    return filepath
+
+
+def graph_writer() -> Neo4jDatabase:
+    # One driver for the whole batch
+    return Neo4jDatabase(
+        host=NEO4J_WRITE_URL,
+        user=os.environ.get("NEO4J_USER", "neo4j"),
+        password=os.environ.get("NEO4J_PASS", "your12345"),
+        read_only=False,
+    )
+
+
+async def ingest_documents(
+    documents: List[Tuple[str, str]],
+    provider: str = "openai",
+    llm_concurrency: int = BATCH_LLM_CONCURRENCY,
+    document_concurrency: int = BATCH_DOCUMENT_CONCURRENCY,
+    write_size: int = BATCH_WRITE_SIZE,
+    db: Optional[Neo4jDatabase] = None,
+) -> Dict[str, Any]:
+    """
+    Run the product discovery workflow on many patents and store their reports in the knowledge graph.
+    Chunks of all the documents share one budget of llm_concurrency LLM calls, and reports are written
+    write_size at a time with batched graph writes.
+    :param documents: (name, text) of every patent. Every document is a job keyed by its name and content,
+                      so a batch run again resumes every document from its checkpoints.
+    :param provider: The provider name (e.g., "ollama", "openai", "groq").
+    :param db: Graph to write to, a new connection to NEO4J_WRITE_URL by default.
+    :return: Throughput report of the batch.
+    """
+    started = time.perf_counter()
+    db = db or graph_writer()
+    totals = {"chunks_done": 0, "chunks_failed": 0, "prompt_tokens": 0}
+    outer_callback = job_progress_callback.get()
+
+    def count(stage: Optional[str], chunks_done: int, chunks_failed: int, prompt_tokens: int) -> None:
+        totals["chunks_done"] += chunks_done
+        totals["chunks_failed"] += chunks_failed
+        totals["prompt_tokens"] += prompt_tokens
+        # A batch run as a background job still reports its progress
+        if outer_callback is not None:
+            outer_callback(stage=stage, chunks_done=chunks_done, chunks_failed=chunks_failed, prompt_tokens=prompt_tokens)
+
+    # (document name, product report) of the reports not written yet
+    pending_reports: List[Tuple[str, Dict[str, Any]]] = []
+    writes = {"patents": 0, "chemicals": 0, "skipped": [], "batches": 0}
+    failed: List[Dict[str, str]] = []
+    write_lock = asyncio.Lock()
+
+    async def flush(force: bool = False) -> None:
+        async with write_lock:
+            if not pending_reports or (len(pending_reports) < write_size and not force):
+                return
+            batch = pending_reports[:]
+            pending_reports.clear()
+            try:
+                # The driver is blocking, the other documents keep extracting meanwhile
+                written = await asyncio.to_thread(db.insert_patent_data_batch, [report for _, report in batch])
+            except Exception as e:
+                # The reports are backed up, the documents of the batch are reported failed and the batch goes on
+                logging.error(f"Graph write of {len(batch)} reports failed: {e}")
+                failed.extend({"document": name, "error": f"Graph write failed: {e}"} for name, _ in batch)
+                return
+            writes["patents"] += written["patents"]
+            writes["chemicals"] += written["chemicals"]
+            writes["skipped"].extend(written["skipped"])
+            writes["batches"] += 1
+
+    semaphore = asyncio.Semaphore(max(1, document_concurrency))
+
+    async def ingest(name: str, text: str) -> None:
+        async with semaphore:
+            print(f"Ingesting {name}")
+            try:
+                finalized_information = await product_discovery_workflow(
+                    data=text, provider=provider, job_id=f"batch-{name}-{chunk_hash(text)[:16]}"
+                )
+            except Exception as e:
+                logging.error(f"Document {name} failed: {e}")
+                failed.append({"document": name, "error": str(e)})
+                return
+            report = build_product_report(finalized_information)
+            backup_product_report(report)
+            pending_reports.append((name, report))
+        await flush()
+
+    token = job_progress_callback.set(count)
+    try:
+        with use_llm_budget(llm_concurrency):
+            await asyncio.gather(*(ingest(name, text) for name, text in documents))
+        await flush(force=True)
+    finally:
+        job_progress_callback.reset(token)
+
+    seconds = time.perf_counter() - started
+    report = {
+        "documents": len(documents),
+        "succeeded": len(documents) - len(failed),
+        "failed": failed,
+        "chunks_done": totals["chunks_done"],
+        "chunks_failed": totals["chunks_failed"],
+        "prompt_tokens": totals["prompt_tokens"],
+        "graph_writes": writes,
+        "seconds": round(seconds, 2),
+        "documents_per_hour": round(len(documents) / seconds * 3600, 1) if seconds else None,
+        "chunks_per_second": round(totals["chunks_done"] / seconds, 2) if seconds else None,
+        "prompt_tokens_per_second": round(totals["prompt_tokens"] / seconds, 1) if seconds else None,
+    }
+    print("Batch ingestion report:", report)
+    return report
+
+
+def read_documents(folder: str, extension: str = ".txt") -> List[Tuple[str, str]]:
+    """
+    (name, text) of the patent text files of a folder, the name is the file name without extension.
+    """
+    documents = []
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(extension):
+            with open(os.path.join(folder, filename)) as f:
+                documents.append((os.path.splitext(filename)[0], f.read()))
+    return documents
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest a folder of patent text files into the knowledge graph.")
+    parser.add_argument("folder", help="Folder of .txt patents")
+    parser.add_argument("--provider", default="openai")
+    parser.add_argument("--llm-concurrency", type=int, default=BATCH_LLM_CONCURRENCY)
+    parser.add_argument("--document-concurrency", type=int, default=BATCH_DOCUMENT_CONCURRENCY)
+    parser.add_argument("--write-size", type=int, default=BATCH_WRITE_SIZE)
+    parser.add_argument("--report", help="Write the throughput report to this JSON file")
+    args = parser.parse_args()
+
+    db = graph_writer()
+    db.ensure_chemical_keys()
+    batch_report = asyncio.run(
+        ingest_documents(
+            read_documents(args.folder),
+            provider=args.provider,
+            llm_concurrency=args.llm_concurrency,
+            document_concurrency=args.document_concurrency,
+            write_size=args.write_size,
+            db=db,
+        )
+    )
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(batch_report, f, indent=4)
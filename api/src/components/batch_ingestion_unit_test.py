@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from components.unit_test_helpers import FakeNeo4jDriver, import_prompt_creator
+
+import_prompt_creator()
+
+from components import batch_ingestion  # noqa: E402
+from driver.neo4j import Neo4jDatabase  # noqa: E402
+
+
+def finalized_information(patent_no, **fields):
+    return {
+        "patent_no": patent_no,
+        "product_name": f"Cream {patent_no}",
+        "description": "A moisturizing cream",
+        "functional_roles": {"Humectant": [{"chemical": "Glycerin", "weight": "5%"}]},
+        **fields,
+    }
+
+
+class FakeGraphWriter:
+    """
+    Stand-in for Neo4jDatabase whose first batched write fails.
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def insert_patent_data_batch(self, reports):
+        self.batches.append(reports)
+        if len(self.batches) == 1:
+            raise RuntimeError("Neo4j unavailable")
+        return {"patents": len(reports), "chemicals": len(reports), "skipped": []}
+
+
+class TestBatchIngestion(unittest.TestCase):
+
+    def test_report_without_assignee_or_inventors_is_written(self):
+        report = batch_ingestion.build_product_report(
+            finalized_information("US1", assignee_information=None, inventor_names=None, cpcc_codes=None)
+        )
+        driver = FakeNeo4jDriver()
+        with patch("driver.neo4j.GraphDatabase.driver", return_value=driver), \
+                patch.object(Neo4jDatabase, "refresh_schema"), patch("driver.neo4j.GRAPH_ENTITY_RESOLUTION", False):
+            written = Neo4jDatabase(read_only=False).insert_patent_data_batch([report])
+
+        self.assertEqual((written["patents"], written["skipped"]), (1, []))
+        query, params = next((query, params) for query, params in driver.queries if "MERGE (patent:patent" in query)
+        # Merged on the patent number only, a null property can't be merged on
+        self.assertIn("MERGE (patent:patent {aa_patent_no: row.patent_no})", query)
+        self.assertIsNone(params["rows"][0]["assignee"])
+
+    def test_report_without_patent_number_is_skipped(self):
+        report = batch_ingestion.build_product_report(finalized_information(None))
+        with patch("driver.neo4j.GraphDatabase.driver", return_value=FakeNeo4jDriver()), \
+                patch.object(Neo4jDatabase, "refresh_schema"), patch("driver.neo4j.GRAPH_ENTITY_RESOLUTION", False):
+            written = Neo4jDatabase(read_only=False).insert_patent_data_batch([report])
+
+        self.assertEqual(written["skipped"], [{"patent_no": None, "missing": ["patent_no"]}])
+
+    def test_failed_graph_write_fails_its_documents_only(self):
+        async def discover(data, provider, job_id):
+            return finalized_information(data)
+
+        db = FakeGraphWriter()
+        with patch.object(batch_ingestion, "product_discovery_workflow", discover), \
+                patch.object(batch_ingestion, "backup_product_report"), self.assertLogs(level="ERROR"):
+            report = asyncio.run(batch_ingestion.ingest_documents(
+                [("first", "US1"), ("second", "US2")], document_concurrency=1, write_size=1, db=db
+            ))
+
+        self.assertEqual(len(db.batches), 2)
+        self.assertEqual([failure["document"] for failure in report["failed"]], ["first"])
+        self.assertEqual(report["succeeded"], 1)
+        self.assertEqual((report["graph_writes"]["patents"], report["graph_writes"]["batches"]), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
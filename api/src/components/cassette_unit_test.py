@@ -0,0 +1,102 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from llm.basellm import BaseLLM
+from llm.cassette import CassetteLLM, CassetteMiss, latency_model, with_cassette
+
+
+class CountingLLM(BaseLLM):
+    model = "fake"
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate(self, messages):
+        self.calls += 1
+        if messages[-1]["content"] == "fail":
+            return "Error: unavailable"
+        return f"answer {self.calls}"
+
+    def generate_json(self, messages, schema=None):
+        self.calls += 1
+        return {"name": "Cream"}
+
+    async def generateStreaming(self, messages, onTokenCallback):
+        self.calls += 1
+        for token in ["Hel", "lo"]:
+            await onTokenCallback(token)
+        return ["Hel", "lo"]
+
+    def num_tokens_from_string(self, string):
+        return len(string.split())
+
+    def max_allowed_token_length(self):
+        return 1000
+
+
+def user(content):
+    return [{"role": "user", "content": content}]
+
+
+class TestCassette(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def cassette(self, llm, mode, latency="none"):
+        return CassetteLLM(llm, "test", mode=mode, directory=self.directory.name, latency=latency)
+
+    def test_replays_recorded_answers_without_the_llm(self):
+        llm = CountingLLM()
+        recorder = self.cassette(llm, "record")
+        self.assertEqual(recorder.generate(user("a")), "answer 1")
+        self.assertEqual(asyncio.run(recorder.agenerate(user("b"))), "answer 2")
+        self.assertEqual(recorder.generate_json(user("a")), {"name": "Cream"})
+        # Failed calls are not recorded
+        recorder.generate(user("fail"))
+
+        player = self.cassette(CountingLLM(), "replay")
+        self.assertEqual(player.generate(user("a")), "answer 1")
+        self.assertEqual(asyncio.run(player.agenerate(user("b"))), "answer 2")
+        # The same messages asked for JSON are another request
+        self.assertEqual(asyncio.run(player.agenerate_json(user("a"))), {"name": "Cream"})
+        self.assertEqual(player.llm.calls, 0)
+        with self.assertRaises(CassetteMiss):
+            player.generate(user("fail"))
+
+    def test_streams_are_replayed_token_by_token(self):
+        tokens = []
+
+        async def on_token(token):
+            tokens.append(token)
+
+        asyncio.run(self.cassette(CountingLLM(), "record").generateStreaming(user("a"), on_token))
+        result = asyncio.run(self.cassette(CountingLLM(), "replay").generateStreaming(user("a"), on_token))
+
+        self.assertEqual(result, ["Hel", "lo"])
+        self.assertEqual(tokens, ["Hel", "lo", "Hel", "lo"])
+
+    def test_latency_models(self):
+        self.assertEqual(latency_model("none")(2.0), 0.0)
+        self.assertEqual(latency_model("recorded")(2.0), 2.0)
+        self.assertEqual(latency_model("0.5")(None), 0.5)
+        uniform = latency_model("uniform:1,2", seed=3)
+        self.assertTrue(all(1 <= uniform(None) <= 2 for _ in range(10)))
+        # Seeded: replays are repeatable
+        self.assertEqual(latency_model("lognormal:1,0.5", seed=3)(None), latency_model("lognormal:1,0.5", seed=3)(None))
+        with self.assertRaises(ValueError):
+            latency_model("sometimes")
+
+    def test_disabled_without_mode(self):
+        llm = CountingLLM()
+        with patch("llm.cassette.LLM_CASSETTE_MODE", ""):
+            self.assertIs(with_cassette(llm, "test"), llm)
+        with self.assertRaises(ValueError):
+            self.cassette(llm, "rewind")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+
+from utils.chunk_cache import ChunkCache, provider_model
+
+
+class TestChunkCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ChunkCache(os.path.join(self.directory.name, "cache.sqlite3"))
+        self.calls = 0
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def compute(self):
+        self.calls += 1
+        return {"nodes": [{"name": "glycerin", "label": "Chemical", "properties": {}}], "relationships": []}
+
+    def test_repeated_chunk_is_computed_once(self):
+        first = asyncio.run(self.cache.get_or_compute("Glycerin  is a\nhumectant.", "graph-v1", "openai:gpt-4o-mini", self.compute))
+        second = asyncio.run(self.cache.get_or_compute("Glycerin is a humectant.", "graph-v1", "openai:gpt-4o-mini", self.compute))
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+    def test_template_and_model_are_part_of_the_key(self):
+        asyncio.run(self.cache.get_or_compute("Glycerin", "graph-v1", "openai:gpt-4o-mini", self.compute))
+        asyncio.run(self.cache.get_or_compute("Glycerin", "graph-v2", "openai:gpt-4o-mini", self.compute))
+        asyncio.run(self.cache.get_or_compute("Glycerin", "graph-v1", "ollama:llama3.1", self.compute))
+
+        self.assertEqual(self.calls, 3)
+
+    def test_every_provider_is_keyed_with_its_model(self):
+        # Both workflows key their results with provider_model, Ollama results included
+        self.assertEqual(provider_model("openai"), "openai:gpt-4o-mini")
+        self.assertEqual(provider_model("ollama"), "ollama:llama3.1")
+
+    def test_errors_are_not_cached(self):
+        async def failing():
+            self.calls += 1
+            return "Error: timeout"
+
+        asyncio.run(self.cache.get_or_compute("Glycerin", "graph-v1", "openai", failing))
+        asyncio.run(self.cache.get_or_compute("Glycerin", "graph-v1", "openai", failing))
+
+        self.assertEqual(self.calls, 2)
+
+    def test_sqlite_runs_off_the_event_loop(self):
+        threads = []
+        get, set = self.cache.get, self.cache.set
+
+        def recording_get(key):
+            threads.append(threading.current_thread())
+            return get(key)
+
+        def recording_set(*args):
+            threads.append(threading.current_thread())
+            return set(*args)
+
+        self.cache.get, self.cache.set = recording_get, recording_set
+        asyncio.run(self.cache.get_or_compute("Glycerin", "graph-v1", "openai", self.compute))
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
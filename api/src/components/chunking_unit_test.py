@@ -0,0 +1,40 @@
+import unittest
+
+from components.unit_test_helpers import WordEncoding
+from utils.chunking import chunk_text, split_text_to_token_budget
+
+
+class TestChunkText(unittest.TestCase):
+
+    def setUp(self):
+        self.encoding = WordEncoding()
+
+    def test_chunks_respect_budget_and_cover_text(self):
+        text = " ".join(f"word{i}" for i in range(25))
+        chunks = chunk_text(text, 10, encoding=self.encoding)
+
+        self.assertEqual([chunk.token_count for chunk in chunks], [10, 10, 5])
+        self.assertEqual("".join(chunk.text for chunk in chunks), text)
+        for chunk in chunks:
+            self.assertEqual(text[chunk.start:chunk.end], chunk.text)
+
+    def test_overlap_repeats_tokens(self):
+        text = " ".join(f"word{i}" for i in range(12))
+        chunks = chunk_text(text, 6, overlap_tokens=2, encoding=self.encoding)
+
+        self.assertTrue(chunks[1].text.startswith("word4 word5"))
+        self.assertTrue(chunks[-1].text.endswith("word11"))
+
+    def test_snaps_to_sentence_boundary(self):
+        text = "Glycerin is a humectant. Dimethicone 15% is an emollient used at low weight"
+        chunks = split_text_to_token_budget(text, 8, snap_to_sentences=True, encoding=self.encoding)
+
+        self.assertEqual(chunks[0], "Glycerin is a humectant.")
+        self.assertTrue(chunks[1].startswith("Dimethicone 15%"))
+
+    def test_empty_text(self):
+        self.assertEqual(chunk_text("", 10, encoding=self.encoding), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
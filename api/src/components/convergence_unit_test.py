@@ -0,0 +1,46 @@
+import unittest
+
+from utils.convergence import ConvergencePolicy, SaturationPolicy, make_convergence_policy
+
+TASKS = ["name_description", "composition"]
+
+
+class TestConvergence(unittest.TestCase):
+
+    def test_saturation_stops_every_prompt_then_the_workflow(self):
+        policy = SaturationPolicy(TASKS, patience=2, required_facts={"composition": 5}, token_budget=0)
+
+        # Nothing found yet: the prompts go on whatever the number of empty chunks
+        for _ in range(3):
+            policy.observe({"name_description": 0, "composition": 0})
+        self.assertTrue(policy.active("name_description"))
+
+        policy.observe({"name_description": 3, "composition": 6})
+        # The composition is filled, one chunk without new facts stops it
+        policy.observe({"name_description": 0, "composition": 0})
+        self.assertFalse(policy.active("composition"))
+        self.assertTrue(policy.active("name_description"))
+        self.assertFalse(policy.stopped)
+
+        # Prompts not sent for a chunk don't count it
+        policy.observe({})
+        self.assertTrue(policy.active("name_description"))
+        policy.observe({"name_description": 0})
+        self.assertTrue(policy.stopped)
+        self.assertEqual(policy.report()["stopped_after_chunk"], {"composition": 5, "name_description": 7})
+        self.assertEqual(policy.report()["calls_skipped"], {"composition": 1})
+
+    def test_token_budget(self):
+        policy = ConvergencePolicy(TASKS, token_budget=1000)
+        policy.observe({"name_description": 0, "composition": 0}, tokens=600)
+        self.assertFalse(policy.stopped)
+        policy.observe({"name_description": 0, "composition": 0}, tokens=600)
+        self.assertTrue(policy.stopped)
+        self.assertFalse(policy.active("name_description"))
+
+        with self.assertRaises(ValueError):
+            make_convergence_policy(TASKS, "unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -257,6 +257,42 @@ class TestRunDisambiguation(unittest.TestCase):
     #         global_relationships_registry,
     #     )
 
+class TestRunDisambiguationResult(unittest.TestCase):
+    def setUp(self):
+        global_nodes_registry.clear()
+        global_relationships_registry.clear()
+
+    @patch("components.data_disambiguation_ollama.process")
+    def test_returns_only_the_entities_of_the_input(self, mock_process):
+        mock_process.side_effect = lambda x: x
+
+        run_disambiguation({
+            "nodes": [
+                {"name": "alice", "label": "Person", "properties": {"age": 30}},
+                {"name": "bob", "label": "Person", "properties": {}},
+            ],
+            "relationships": [{"start": "alice", "type": "friend", "end": "bob", "properties": {}}],
+        })
+        result = run_disambiguation({
+            "nodes": [
+                {"name": "alice", "label": "Person", "properties": {"age": 31}},
+                {"name": "carol", "label": "Person", "properties": {}},
+            ],
+            "relationships": [{"start": "alice", "type": "knows", "end": "carol", "properties": {}}],
+        })
+
+        # alice as registered by the first input, bob and the first relationship are not part of this one
+        self.assertEqual(
+            result["nodes"],
+            [
+                {"name": "alice", "label": "Person", "properties": {"age": 30}},
+                {"name": "carol", "label": "Person", "properties": {}},
+            ],
+        )
+        self.assertEqual(result["relationships"], [{"start": "alice", "type": "knows", "end": "carol", "properties": {}}])
+        self.assertEqual(len(global_nodes_registry), 3)
+        self.assertEqual(len(global_relationships_registry), 2)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,19 +1,23 @@
 import json
-import re
 import os
+from concurrent.futures import ThreadPoolExecutor
 from itertools import groupby
 from llm.openai import OpenAIChat
 import logging
 from components.base_component import BaseComponent
-from utils.unstructured_data_utils import (
-    nodesTextToListOfDict,
-    relationshipTextToListOfDict,
-)
+from utils.llm_output_parser import parse_nodes, parse_relationships
+from utils.entity_resolution import get_entity_embedder, resolve_entities
+from utils.entity_registry import relationship_tuple
+from utils.relationship_windows import RelationshipWindow, relationship_prompt_data, relationship_windows
+from utils.unstructured_data_utils import getNodesAndRelationshipsFromResult
 
 
 
 api_key = "api_key"  # <<<<----- REPLACE WITH YOUR ACTUAL API KEY
 
+# Label groups disambiguated by the LLM at the same time
+DISAMBIGUATION_CONCURRENCY = int(os.getenv("DISAMBIGUATION_CONCURRENCY", "4"))
+
 
 
 
@@ -52,12 +56,52 @@ def generate_prompt(data) -> str:
 """
 
 
-internalRegex = "\[(.*?)\]"
-
-
 class DataDisambiguation(BaseComponent):
-    def __init__(self, llm) -> None:
+    def __init__(self, llm, embed=None) -> None:
+        """
+        :param embed: Embeds a list of names for the entity resolution, the ENTITY_EMBEDDING_MODEL by default.
+        """
         self.llm = llm
+        self.embed = embed or get_entity_embedder()
+
+    def disambiguate_node_group(self, i: int, disString: str, system_message: str):
+        """
+        The LLM call of one label group.
+        :return: The raw response and the nodes parsed from it.
+        """
+        messages = [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": generate_prompt(disString)},
+        ]
+        rawNodes = self.llm.generate(messages)
+        print(f"Raw response for group {i}:\n{rawNodes}")
+
+        # Transform raw response into node dicts
+        transformed_nodes = parse_nodes(rawNodes)
+        print(f"Transformed nodes for group {i}:\n{transformed_nodes}")
+        return rawNodes, transformed_nodes
+
+    def disambiguate_relationship_window(self, window: RelationshipWindow, system_message: str):
+        """
+        The LLM call of one window of relationships.
+        :return: The relationship data sent, the raw response and the relationships parsed from it.
+        """
+        relationship_data = relationship_prompt_data(window)
+        print(f"Final relationship data with valid nodes:\n{relationship_data}")
+        messages = [
+            {
+                "role": "system",
+                "content": system_message,
+            },
+            {"role": "user", "content": generate_prompt(relationship_data)},
+        ]
+        rawRelationships = self.llm.generate(messages)
+        print(f"Raw response for relationships:\n{rawRelationships}")
+
+        # Transform raw response into relationship dicts
+        transformed_relationships = parse_relationships(rawRelationships)
+        print(f"Transformed relationships:\n{transformed_relationships}")
+        return relationship_data, rawRelationships, transformed_relationships
 
     def run(self, data: dict) -> dict:
         print("=== Process Started: Node and Relationship Processing ===")
@@ -73,9 +117,13 @@ class DataDisambiguation(BaseComponent):
         relationships = data["relationships"]
         print(f"Relationships retained as-is: {len(relationships)} relationships.")
 
-        new_nodes = []
         new_relationships = []
         chunks = []  # To store chunk metadata
+        aliases = {}  # Name of every duplicate merged by the entity resolution -> name kept
+        nodes_sent = 0
+        # Nodes of every group, in group order, and the groups left to the LLM (group number, position, disString)
+        group_nodes = []
+        llm_groups = []
 
         print("\n--- Starting Node Processing ---")
         node_groups = groupby(nodes, lambda x: x["label"])
@@ -86,41 +134,50 @@ class DataDisambiguation(BaseComponent):
 
             if len(nodes_in_group) == 1:
                 print(f"Single node group. Adding node: {nodes_in_group[0]}")
-                new_nodes.extend(nodes_in_group)
+                group_nodes.append(nodes_in_group)
                 continue
 
-            # Prepare disString for group
-            for node in nodes_in_group:
-                disString += (
-                    '["'
-                    + node["name"]
-                    + '", "'
-                    + node["label"]
-                    + '", '
-                    + json.dumps(node["properties"])
-                    + "]\n"
-                )
-            print(f"Constructed disString for group {i}:\n{disString}")
-
-            system_message = generate_system_message_for_nodes()
-            messages = [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": generate_prompt(disString)},
-            ]
-            print(f"System message for group {i}:\n{system_message}")
-
-            rawNodes = self.llm.generate(messages)
-            print(f"Raw response for group {i}:\n{rawNodes}")
-
-            n = re.findall(internalRegex, rawNodes)
-            print(f"Extracted node information for group {i}:\n{n}")
+            # Exact duplicates are merged and clearly distinct nodes kept as they are, only the clusters of
+            # similar names are left to the LLM
+            resolution = resolve_entities(nodes_in_group, embed=self.embed)
+            group_nodes.append(list(resolution.nodes))
+            aliases.update(resolution.aliases)
+            print(
+                f"Entity resolution for group {i}: {len(resolution.aliases)} duplicates merged, "
+                f"{len(resolution.ambiguous)} ambiguous clusters"
+            )
+            if not resolution.ambiguous:
+                continue
 
-            # Transform raw response into node dicts
-            transformed_nodes = nodesTextToListOfDict(n)
-            print(f"Transformed nodes for group {i}:\n{transformed_nodes}")
-            new_nodes.extend(transformed_nodes)
+            # Prepare disString for group, one paragraph per cluster
+            for cluster in resolution.ambiguous:
+                for node in cluster:
+                    disString += (
+                        '["'
+                        + node["name"]
+                        + '", "'
+                        + node["label"]
+                        + '", '
+                        + json.dumps(node["properties"])
+                        + "]\n"
+                    )
+                disString += "\n"
+                nodes_sent += len(cluster)
+            print(f"Constructed disString for group {i}:\n{disString}")
+            llm_groups.append((i, len(group_nodes) - 1, disString))
+
+        # The groups are independent: their LLM calls run concurrently, the results are kept in group order
+        system_message = generate_system_message_for_nodes()
+        print(f"System message for node groups:\n{system_message}")
+        responses = []
+        if llm_groups:
+            with ThreadPoolExecutor(max_workers=max(1, min(DISAMBIGUATION_CONCURRENCY, len(llm_groups)))) as executor:
+                responses = list(executor.map(
+                    lambda group: self.disambiguate_node_group(group[0], group[2], system_message), llm_groups
+                ))
+        for (i, position, disString), (rawNodes, transformed_nodes) in zip(llm_groups, responses):
+            group_nodes[position].extend(transformed_nodes)
 
-            # Append chunk metadata with both raw and transformed responses
             # Append chunk metadata with both raw and transformed nodes
             chunks.append({
                 "chunk_number": len(chunks) + 1,
@@ -136,62 +193,54 @@ class DataDisambiguation(BaseComponent):
                 }
             })
 
+        new_nodes = [node for nodes_of_group in group_nodes for node in nodes_of_group]
+        print(f"\nNodes sent to the LLM: {nodes_sent} of {len(nodes)}")
+
         print("\n--- Starting Relationship Processing ---")
-        relationship_data = "Relationships:\n"
+        # Relationships of the merged duplicates point to the node kept, which makes some of them identical
+        unique_relationships = {}
         for relation in relationships:
-            relation_string = (
-                '["'
-                + relation["start"]
-                + '", "'
-                + relation["type"]
-                + '", "'
-                + relation["end"]
-                + '", '
-                + json.dumps(relation["properties"])
-                + "]\n"
+            relation = dict(
+                relation, start=aliases.get(relation["start"], relation["start"]), end=aliases.get(relation["end"], relation["end"])
             )
-            relationship_data += relation_string
-        print(f"Constructed relationship data:\n{relationship_data}")
+            unique_relationships.setdefault(relationship_tuple(relation), relation)
+        relationships = list(unique_relationships.values())
 
+        # Windows of connected relationships within the token budget, disambiguated concurrently then merged
+        windows = relationship_windows(relationships, {node["name"] for node in new_nodes}, [node["name"] for node in new_nodes])
+        print(f"Relationships split into {len(windows)} windows")
         system_message = generate_system_message_for_relationships()
-        node_labels = [node["name"] for node in new_nodes]
-        relationship_data += "Valid Nodes:\n" + "\n".join(node_labels)
-        print(f"Final relationship data with valid nodes:\n{relationship_data}")
-
-        messages = [
-            {
-                "role": "system",
-                "content": system_message,
-            },
-            {"role": "user", "content": generate_prompt(relationship_data)},
-        ]
         print(f"System message for relationships:\n{system_message}")
-
-        rawRelationships = self.llm.generate(messages)
-        print(f"Raw response for relationships:\n{rawRelationships}")
-
-        rels = re.findall(internalRegex, rawRelationships)
-        print(f"Extracted relationship information:\n{rels}")
-
-        # Transform raw response into relationship dicts
-        transformed_relationships = relationshipTextToListOfDict(rels)
-        print(f"Transformed relationships:\n{transformed_relationships}")
-        new_relationships.extend(transformed_relationships)
-
-        # Append chunk metadata for relationships with both raw and transformed responses
-        chunks.append({
-            "chunk_number": len(chunks) + 1,
-            "system_prompt": system_message,
-            "input_chunk_text": relationship_data,
-            "nodes": {
-                "raw": None,  # No nodes for relationship processing
-                "transformed": None
-            },
-            "relationships": {
-                "raw": json.dumps(rawRelationships),
-                "transformed": json.dumps(transformed_relationships)
-            }
-        })
+        responses = []
+        if windows:
+            with ThreadPoolExecutor(max_workers=max(1, min(DISAMBIGUATION_CONCURRENCY, len(windows)))) as executor:
+                responses = list(executor.map(
+                    lambda window: self.disambiguate_relationship_window(window, system_message), windows
+                ))
+
+        # A relationship kept by two windows is only returned once
+        seen_relationships = set()
+        for relationship_data, rawRelationships, transformed_relationships in responses:
+            for relation in transformed_relationships:
+                identity = relationship_tuple(relation)
+                if identity not in seen_relationships:
+                    seen_relationships.add(identity)
+                    new_relationships.append(relation)
+
+            # Append chunk metadata for relationships with both raw and transformed responses
+            chunks.append({
+                "chunk_number": len(chunks) + 1,
+                "system_prompt": system_message,
+                "input_chunk_text": relationship_data,
+                "nodes": {
+                    "raw": None,  # No nodes for relationship processing
+                    "transformed": None
+                },
+                "relationships": {
+                    "raw": json.dumps(rawRelationships),
+                    "transformed": json.dumps(transformed_relationships)
+                }
+            })
 
         print("\n=== Process Completed ===")
         print(f"Total nodes processed: {len(new_nodes)}")
@@ -200,62 +249,6 @@ class DataDisambiguation(BaseComponent):
 
         return {"nodes": new_nodes, "relationships": new_relationships, "chunks": chunks}
 
-def getNodesAndRelationshipsFromResult(result):
-    regex = "Nodes:\s+(.*?)\s?\s?Relationships:\s?\s?(.*)"
-    internalRegex = "\[(.*?)\]"
-    nodes = []
-    relationships = []
-
-    print("Starting to parse :" , result, len(result))
-    
-    for row in result:
-        print(f"Processing row: {row}")
-        
-        # Match using regex
-        parsing = re.match(regex, row, flags=re.S)
-        if parsing is None:
-            print(f"No match found for row: {row}")
-            continue
-        
-        print("Regex match found. Extracting nodes and relationships.")
-        
-        # Extract raw nodes and relationships
-        rawNodes = str(parsing.group(1))
-        rawRelationships = parsing.group(2)
-        
-        print(f"Extracted rawNodes: {rawNodes}")
-        print(f"Extracted rawRelationships: {rawRelationships}")
-        
-        # Find individual elements using internal regex
-        nodes.extend(re.findall(internalRegex, rawNodes))
-        relationships.extend(re.findall(internalRegex, rawRelationships))
-        
-        print(f"Current list of nodes: {nodes}")
-        print(f"Current list of relationships: {relationships}")
-
-    # Validate extracted nodes and relationships before inserting them
-    nodes = [node for node in nodes if len(node.split(",")) >= 2]  # Ensure each node has at least name and label
-    relationships = [rel for rel in relationships if len(rel.split(",")) >= 3]  # Ensure valid relationship structure
-    
-    if not nodes:
-        print("Warning: No valid nodes found.")
-    if not relationships:
-        print("Warning: No valid relationships found.")
-
-    # Convert raw text data to structured dictionaries
-    print("Converting extracted nodes and relationships to structured dictionaries.")
-    try:
-        result = dict()
-        result["nodes"] = nodesTextToListOfDict(nodes)
-        result["relationships"] = relationshipTextToListOfDict(relationships)
-    except Exception as e:
-        logging.error(f"Error during conversion of nodes or relationships: {e}")
-        raise
-    
-    print("Inside the function nodes are : ", result["nodes"])
-
-    logging.info("Successfully parsed nodes and relationships.")
-    return result
 
 def data_to_cypher(data):
     """
@@ -1,16 +1,15 @@
 import json
-import re
+from concurrent.futures import ThreadPoolExecutor
 from itertools import groupby
-from utils.unstructured_data_utils import (
-    nodesTextToListOfDict,
-    relationshipTextToListOfDict,
-)
+from components.data_disambiguation import DISAMBIGUATION_CONCURRENCY
+from utils.llm_output_parser import parse_nodes, parse_relationships
+from utils.entity_registry import get_entity_registry, relationship_tuple
+from utils.relationship_windows import relationship_prompt_data, relationship_windows
 
-internalRegex = r"\[(.*?)\]"
-
-# Global registries for unique nodes and relationships
-global_nodes_registry = {} # Dictionaries in python are unique by default w.r.t. their keys.
-global_relationships_registry = set() # So is a set.
+# Global registries for unique nodes and relationships, shared by the workers and kept across restarts in
+# ENTITY_REGISTRY_PATH (in memory when it is empty). A dict of the nodes by name, and a set of the relationship tuples.
+global_nodes_registry = get_entity_registry().nodes
+global_relationships_registry = get_entity_registry().relationships
 
 
 def generate_system_message_for_nodes() -> str:
@@ -64,19 +63,11 @@ def add_to_global_registry(nodes, relationships):
     Add new nodes and relationships to the global registry if they are not already present.
     """
     # print("The recieved nodes are : ", nodes)
-    for node in nodes:
-        if node["name"] not in global_nodes_registry:
-            global_nodes_registry[node["name"]] = node
+    # Existing entries are kept, in one transaction per call
+    global_nodes_registry.add_new(nodes)
 
-    for relationship in relationships:
-        # Use a tuple to ensure relationships are stored uniquely
-        rel_tuple = (
-            relationship["start"],
-            relationship["type"],
-            relationship["end"],
-            json.dumps(relationship["properties"]),
-        )
-        global_relationships_registry.add(rel_tuple)
+    # Use a tuple to ensure relationships are stored uniquely
+    global_relationships_registry.add_new(relationship_tuple(relationship) for relationship in relationships)
 
 
 # This function removes nodes and relationships that are already present in the global registry , retuning only unique items for further processing.N
@@ -88,16 +79,12 @@ def filter_existing_entries(nodes, relationships):
         node for node in nodes if node["name"] not in global_nodes_registry
     ]
 
-    unique_relationships = []
-    for relationship in relationships:
-        rel_tuple = (
-            relationship["start"],
-            relationship["type"],
-            relationship["end"],
-            json.dumps(relationship["properties"]),
-        )
-        if rel_tuple not in global_relationships_registry:
-            unique_relationships.append(relationship)
+    # The registry puts the properties in canonical form for the lookup, once
+    unique_relationships = [
+        relationship for relationship in relationships
+        if (relationship["start"], relationship["type"], relationship["end"], relationship.get("properties") or {})
+        not in global_relationships_registry
+    ]
 
     return unique_nodes, unique_relationships
 
@@ -105,6 +92,8 @@ def filter_existing_entries(nodes, relationships):
 def run_disambiguation(data):
     """
     Main function to perform data disambiguation on nodes and relationships.
+    The registry deduplicates across calls, but only the nodes and relationships of this input are returned:
+    a node registered before is returned as registered.
     """
     print("I have come inside the function :",data)
 
@@ -116,6 +105,8 @@ def run_disambiguation(data):
     print("\033[32mThe sorted nodes are :\033[0m", nodes)  # Green text
 
     relationships = data["relationships"]
+    # Names of the disambiguated nodes of this input, registered before or not
+    input_node_names = []
     new_nodes = []
     new_relationships = []
 
@@ -130,6 +121,7 @@ def run_disambiguation(data):
         print("nodes_in_group :" , nodes_in_group)
         if len(nodes_in_group) == 1:
             new_nodes.extend(nodes_in_group)
+            input_node_names.extend(node["name"] for node in nodes_in_group)
             continue
 
         for node in nodes_in_group:
@@ -147,9 +139,8 @@ def run_disambiguation(data):
 
         # Call the process function (API call or other disambiguation logic)
         processed_nodes = process(disString)
-        processed_nodes = nodesTextToListOfDict(
-            re.findall(internalRegex, processed_nodes)
-        )
+        processed_nodes = parse_nodes(processed_nodes)
+        input_node_names.extend(node["name"] for node in processed_nodes)
 
         # Filter and add unique nodes to the list
         unique_nodes, _ = filter_existing_entries(processed_nodes, [])
@@ -158,41 +149,28 @@ def run_disambiguation(data):
     # Update global nodes registry
     add_to_global_registry(new_nodes, [])
 
-    # Process relationships
-    relationship_data = "Relationships:\n"
-    for relation in relationships:
-        relationship_data += (
-            '["'
-            + relation["start"]
-            + '", "'
-            + relation["type"]
-            + '", "'
-            + relation["end"]
-            + '", '
-            + json.dumps(relation["properties"])
-            + "]\n"
-        )
-
-    # Add valid node labels to relationship data
-    node_labels = [node["name"] for node in global_nodes_registry.values()]
-    relationship_data += "Valid Nodes:\n" + "\n".join(node_labels)
-
-    # Call the process function (API call or other disambiguation logic)
-    processed_relationships = process(relationship_data)
-    processed_relationships = relationshipTextToListOfDict(
-        re.findall(internalRegex, processed_relationships)
-    )
+    # Process relationships, in windows of connected relationships that fit the context, concurrently. A window
+    # lists the registered nodes its relationships refer to, not the whole registry.
+    windows = relationship_windows(relationships, global_nodes_registry, dict.fromkeys(input_node_names))
+    with ThreadPoolExecutor(max_workers=max(1, min(DISAMBIGUATION_CONCURRENCY, len(windows) or 1))) as executor:
+        # Call the process function (API call or other disambiguation logic)
+        responses = list(executor.map(lambda window: process(relationship_prompt_data(window)), windows))
+    # A relationship kept by two windows is only returned once
+    processed_relationships = {}
+    for response in responses:
+        for relation in parse_relationships(response):
+            processed_relationships.setdefault(relationship_tuple(relation), relation)
 
     # Filter and add unique relationships
-    _, unique_relationships = filter_existing_entries([], processed_relationships)
+    _, unique_relationships = filter_existing_entries([], list(processed_relationships.values()))
     new_relationships.extend(unique_relationships)
 
     # Update global relationships registry
     add_to_global_registry([], new_relationships)
 
-    # Return global results
+    # The results of this input, as registered: a node registered before keeps its first version
     return {
-        "nodes": list(global_nodes_registry.values()),
+        "nodes": [global_nodes_registry[name] for name in dict.fromkeys(input_node_names)],
         "relationships": [
             {
                 "start": rel[0],
@@ -200,6 +178,6 @@ def run_disambiguation(data):
                 "end": rel[2],
                 "properties": json.loads(rel[3]),
             }
-            for rel in global_relationships_registry
+            for rel in processed_relationships
         ],
     }
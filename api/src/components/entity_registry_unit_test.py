@@ -0,0 +1,47 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from utils.entity_registry import EntityRegistry
+
+
+class TestEntityRegistry(unittest.TestCase):
+
+    def test_shared_and_persistent(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "registry.sqlite3")
+            # Two workers on the same file
+            first, second = EntityRegistry(path), EntityRegistry(path)
+            self.assertEqual(first.nodes.add_new([{"name": "alice", "label": "Person", "properties": {"age": 30}}]), 1)
+            self.assertEqual(
+                second.nodes.add_new([
+                    {"name": "alice", "label": "Person", "properties": {"age": 35}},
+                    {"name": "bob", "label": "Person", "properties": {}},
+                ]),
+                1,
+            )
+            first.relationships.add(("alice", "friend", "bob", json.dumps({"since": "2020", "at": "work"})))
+
+            # Restarted
+            registry = EntityRegistry(path)
+            self.assertEqual(registry.nodes["alice"]["properties"]["age"], 30)
+            self.assertEqual(sorted(registry.nodes), ["alice", "bob"])
+            # Relationship identity doesn't depend on the order of the properties
+            self.assertIn(("alice", "friend", "bob", json.dumps({"at": "work", "since": "2020"})), registry.relationships)
+            self.assertNotIn(("alice", "friend", "bob", "{}"), registry.relationships)
+
+    def test_iteration_in_batches(self):
+        registry = EntityRegistry("")
+        registry.nodes.add_new({"name": f"node {i}", "label": "Thing", "properties": {}} for i in range(25))
+
+        with patch("utils.entity_registry.ITERATION_BATCH", 10):
+            self.assertEqual(len(list(registry.nodes.values())), 25)
+            self.assertEqual(len(set(registry.nodes)), 25)
+        registry.nodes.clear()
+        self.assertEqual(len(registry.nodes), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import time
+import unittest
+
+from components.data_disambiguation import DataDisambiguation
+from utils.entity_resolution import (
+    jaro_winkler,
+    name_similarity,
+    name_tokens,
+    normalized_key,
+    resolve_entities,
+    resolve_existing_names,
+    variant_key,
+)
+
+
+def node(name, properties=None):
+    return {"name": name, "label": "Chemical", "properties": properties or {}}
+
+
+class FakeLLM:
+    def __init__(self, delay=0.0):
+        self.prompts = []
+        self.delay = delay
+
+    def generate(self, messages):
+        self.prompts.append(messages[1]["content"])
+        time.sleep(self.delay)
+        # Echoes the nodes or relationships it was given
+        return messages[1]["content"].split("data:\n", 1)[1].split("Valid Nodes:")[0]
+
+
+class TestEntityResolution(unittest.TestCase):
+
+    def test_similarities(self):
+        self.assertAlmostEqual(jaro_winkler("martha", "marhta"), 0.9611, places=4)
+        self.assertEqual(name_tokens("L'Oréal Paris"), ("l", "oreal", "paris"))
+        self.assertEqual(name_similarity(name_tokens("L'Oreal"), name_tokens("L'Oreal Paris")), 1.0)
+        # Different numbers are different entities
+        self.assertEqual(name_similarity(name_tokens("Example 1"), name_tokens("Example 2")), 0.0)
+
+    def test_merges_duplicates_and_isolates_ambiguous_clusters(self):
+        resolution = resolve_entities([
+            node("Glycerin", {"weight": "5%"}),
+            node("GLYCERIN.", {"role": "Humectant"}),
+            node("Varale; Aditya"),
+            node("Aditya Varale"),
+            node("Glycerine"),
+            node("Dimethicone"),
+            node("Mica"),
+        ])
+
+        self.assertEqual(resolution.aliases, {"GLYCERIN.": "Glycerin"})
+        # Reordered names are asked to the LLM, not merged
+        self.assertEqual(
+            [[n["name"] for n in cluster] for cluster in resolution.ambiguous],
+            [["Glycerin", "Glycerine"], ["Varale; Aditya", "Aditya Varale"]],
+        )
+        self.assertEqual(resolution.ambiguous[0][0]["properties"], {"weight": "5%", "role": "Humectant"})
+        self.assertEqual([n["name"] for n in resolution.nodes], ["Dimethicone", "Mica"])
+
+    def test_word_order_is_kept(self):
+        for a, b in [("oil-in-water emulsion", "water-in-oil emulsion"), ("2-chloro-4-nitrophenol", "4-chloro-2-nitrophenol")]:
+            self.assertNotEqual(normalized_key(a), normalized_key(b))
+            self.assertNotEqual(variant_key(a), variant_key(b))
+            self.assertEqual(resolve_entities([node(a), node(b)]).aliases, {})
+            self.assertEqual(resolve_existing_names([a, b], lambda keys: {}), {a: a, b: b})
+        self.assertEqual(variant_key("Oil-in-Water Emulsions"), variant_key("oil in water emulsion"))
+
+    def test_resolves_new_names_against_existing_ones(self):
+        self.assertEqual(variant_key("Glycerine"), variant_key("glycerin"))
+        self.assertEqual(variant_key("Parabens"), variant_key("paraben"))
+        self.assertNotEqual(variant_key("sodium chloride"), variant_key("sodium chlorite"))
+        lookups = []
+
+        def find_existing(keys):
+            lookups.append(keys)
+            return {"glycerin": "glycerin"}
+
+        resolved = resolve_existing_names(["glycerine", "mica", "Mica", "glycerin"], find_existing)
+
+        # One lookup for all the names
+        self.assertEqual(lookups, [["glycerin", "mica"]])
+        self.assertEqual(resolved, {"glycerine": "glycerin", "mica": "mica", "Mica": "mica", "glycerin": "glycerin"})
+        self.assertEqual(resolve_existing_names([], find_existing), {})
+        self.assertEqual(len(lookups), 1)
+
+    def test_disambiguation_only_sends_ambiguous_nodes(self):
+        llm = FakeLLM()
+        result = DataDisambiguation(llm).run({
+            "nodes": [node("Glycerin"), node("glycerin"), node("Mica"), node("Dimethicone")],
+            "relationships": [
+                {"start": "Glycerin", "type": "IN", "end": "Mica", "properties": {}},
+                {"start": "glycerin", "type": "IN", "end": "Mica", "properties": {}},
+            ],
+        })
+
+        # No ambiguous cluster: only the relationship call, with the duplicate relationship merged
+        self.assertEqual(len(llm.prompts), 1)
+        self.assertEqual(sorted(n["name"] for n in result["nodes"]), ["Dimethicone", "Glycerin", "Mica"])
+        self.assertEqual(len(result["relationships"]), 1)
+
+    def test_label_groups_run_concurrently(self):
+        labels = ["Chemical", "Company", "Inventor", "Product"]
+        nodes = [{"name": name, "label": label, "properties": {}} for label in labels for name in ("Glycerin", "Glycerine")]
+        llm = FakeLLM(delay=0.2)
+
+        start = time.perf_counter()
+        result = DataDisambiguation(llm).run({"nodes": nodes, "relationships": []})
+
+        # 4 group calls that overlap, no relationship to disambiguate
+        self.assertEqual(len(llm.prompts), 4)
+        self.assertLess(time.perf_counter() - start, 0.2 * 4)
+        self.assertEqual([n["label"] for n in result["nodes"]], [label for label in labels for _ in range(2)])
+        self.assertEqual([chunk["chunk_number"] for chunk in result["chunks"]], [1, 2, 3, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from utils.extraction_accumulator import CompositionAccumulator, KeywordAccumulator
+
+
+class TestCompositionAccumulator(unittest.TestCase):
+
+    def test_dedups_roles_chemicals_and_weights(self):
+        composition = CompositionAccumulator()
+        added = composition.add_text(
+            """
+            Functional Role: Humectant
+            - Chemical: Glycerin, Weight: 5%
+            - Chemical: Butylene Glycol, Weight: Not specified
+
+            **Functional Role:** Emollient
+            - Chemical: Dimethicone, Weight: 1-3%
+            """
+        )
+        self.assertEqual(added, 3)
+
+        added = composition.add_text(
+            """
+            Functional Role: humectant
+            - Chemical: glycerin, Weight: 5%
+            - Chemical: Glycerin, Weight: 2-10%
+            """
+        )
+        self.assertEqual(added, 1)
+        self.assertEqual(
+            composition.to_report(),
+            {
+                "functional_roles": {
+                    "Humectant": [
+                        {"chemical": "Glycerin", "weight": "5%; 2-10%"},
+                        {"chemical": "Butylene Glycol", "weight": None},
+                    ],
+                    "Emollient": [{"chemical": "Dimethicone", "weight": "1-3%"}],
+                }
+            },
+        )
+
+    def test_render_is_compact_and_capped(self):
+        composition = CompositionAccumulator()
+        for i in range(10):
+            composition.add("Emollient", f"Oil {i}", f"{i}%")
+
+        self.assertEqual(composition.render(limit=2), "Emollient: Oil 8 (8%), Oil 9 (9%)")
+        self.assertEqual(composition.render(weights=False, limit=1), "Emollient: Oil 9")
+
+
+class TestKeywordAccumulator(unittest.TestCase):
+
+    def test_keeps_first_occurrence_order(self):
+        keywords = KeywordAccumulator()
+        keywords.add("Hydrating face cream")
+        self.assertEqual(keywords.add("Cream, hydrating serum"), ["serum"])
+        self.assertEqual(keywords.render(), "hydrating face cream serum")
+        self.assertEqual(keywords.render(limit=2), "cream serum")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import asyncio
+import time
+import unittest
+
+from llm.basellm import BaseLLM, ClientErrorResponse, error_response
+from llm.hedged import CircuitBreaker, HedgedLLM
+
+
+class FakeLLM(BaseLLM):
+    def __init__(self, answer, delay=0.0):
+        self.answer = answer
+        self.delay = delay
+        self.calls = 0
+
+    def generate(self, messages):
+        self.calls += 1
+        time.sleep(self.delay)
+        return self.answer
+
+    async def agenerate(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.answer
+
+    async def generateStreaming(self, messages, onTokenCallback):
+        return [self.answer]
+
+    def num_tokens_from_string(self, string):
+        return len(string.split())
+
+    def max_allowed_token_length(self):
+        return 1000
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_state_changes(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, "half-open")
+        # One trial call only
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        self.assertFalse(breaker.available())
+
+        # A failed trial opens the breaker again
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, "closed")
+        self.assertTrue(breaker.allow() and breaker.allow())
+
+    def test_abandoned_trial_is_released(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.release()
+        self.assertTrue(breaker.allow())
+
+
+class TestHedgedLLM(unittest.TestCase):
+
+    def test_hedges_slow_primary(self):
+        slow, fast = FakeLLM("slow", delay=0.5), FakeLLM("fast")
+        llm = HedgedLLM([slow, fast], initial_deadline=0.05)
+
+        start = time.perf_counter()
+        self.assertEqual(llm.generate(["hi"]), "fast")
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual(asyncio.run(llm.agenerate(["hi"])), "fast")
+        # Latencies are kept per provider
+        self.assertEqual(len(llm.latencies[1].samples), 2)
+        self.assertEqual(len(llm.latencies[0].samples), 0)
+
+    def test_falls_back_and_skips_failing_provider(self):
+        failing, fallback = FakeLLM("Error: unavailable"), FakeLLM("ok")
+        llm = HedgedLLM([failing, fallback], failure_threshold=2, reset_timeout=60)
+
+        for _ in range(4):
+            self.assertEqual(llm.generate(["hi"]), "ok")
+        # The breaker opened after two failures, the provider is no longer called
+        self.assertEqual(failing.calls, 2)
+        self.assertEqual(llm.breakers[0].state, "open")
+        self.assertEqual(fallback.calls, 4)
+
+    def test_rejected_requests_do_not_open_the_breaker(self):
+        rejected, fallback = FakeLLM(ClientErrorResponse("Error: maximum context length exceeded")), FakeLLM("ok")
+        llm = HedgedLLM([rejected, fallback], failure_threshold=2, reset_timeout=60)
+
+        for _ in range(3):
+            self.assertEqual(llm.generate(["hi"]), "ok")
+            self.assertEqual(asyncio.run(llm.agenerate(["hi"])), "ok")
+        self.assertEqual(rejected.calls, 6)
+        self.assertEqual(llm.breakers[0].state, "closed")
+        self.assertEqual(len(llm.latencies[0].samples), 0)
+
+    def test_only_rate_limits_and_server_errors_are_failures(self):
+        error = Exception("HTTP error")
+        self.assertIsInstance(error_response(error, 400), ClientErrorResponse)
+        self.assertIsInstance(error_response(error, 404), ClientErrorResponse)
+        for status_code in (429, 500, 503, None):
+            self.assertNotIsInstance(error_response(error, status_code), ClientErrorResponse)
+            self.assertEqual(error_response(error, status_code), "Error: HTTP error")
+
+    def test_all_providers_failing(self):
+        llm = HedgedLLM([FakeLLM("Error: down")], failure_threshold=1, reset_timeout=60)
+
+        self.assertEqual(llm.generate(["hi"]), "Error: down")
+        with self.assertRaises(Exception):
+            llm.generate(["hi"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import tempfile
+import unittest
+
+from utils.ingredient_matcher import IngredientMatcher, read_ingredient_dictionary
+
+
+class TestIngredientMatcher(unittest.TestCase):
+
+    def test_finds_ingredients_in_order(self):
+        matcher = IngredientMatcher(
+            ["Glycerin", "Sodium Hyaluronate", "Hyaluronate", "Caprylic/Capric Triglyceride", "1,2-Hexanediol", "Water"]
+        )
+        chunk = (
+            "Example 1: caprylic / capric triglyceride 10%, sodium hyaluronate 0.1%, 1,2-hexanediol 1%, "
+            "water qs, and glycerin 5%. Glycerin may be replaced."
+        )
+
+        # The longer name hides the one it contains, common terms like water are not in the dictionary
+        self.assertEqual(
+            matcher.find(chunk), ["Caprylic/Capric Triglyceride", "Sodium Hyaluronate", "1,2-Hexanediol", "Glycerin"]
+        )
+        self.assertEqual(matcher.find("The background of nail polishes."), [])
+        self.assertEqual(matcher.find(chunk, limit=2), ["Caprylic/Capric Triglyceride", "Sodium Hyaluronate"])
+
+    def test_dictionary_from_product_catalog(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "products.csv")
+            with open(path, "w") as f:
+                f.write("name,brand_name,ingredients\n")
+                f.write('a,Acme,"Glycerin, Citric Acid, Acid, Acme, YesStyle is an authorized retailer"\n')
+                f.write('b,Acme,"[#01 Pink] Glycerin, Hyaluronic Acid, Lactic Acid"\n')
+
+            names = read_ingredient_dictionary(path)
+
+        self.assertEqual(set(names), {"Glycerin", "Citric Acid", "Hyaluronic Acid", "Lactic Acid"})
+
+
+if __name__ == "__main__":
+    unittest.main()
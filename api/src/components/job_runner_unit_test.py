@@ -0,0 +1,162 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from utils.job_runner import JobManager
+from utils.job_store import JobCheckpoints, JobStore, report_progress
+
+
+async def extract(params, job_id):
+    report_progress(stage="map")
+    for _ in range(3):
+        await asyncio.sleep(0)
+        report_progress(chunks_done=1, prompt_tokens=100)
+    if params.get("fail"):
+        raise RuntimeError("upstream down")
+    return {"patent_no": params["input"]}
+
+
+class TestJobManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = JobStore(os.path.join(self.directory.name, "jobs.sqlite3"))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def run_jobs(self):
+        manager = JobManager(self.store, workers=2)
+        manager.register("product_report", extract)
+        manager.start()
+        done = await manager.submit("product_report", {"input": "US1"})
+        failed = await manager.submit("product_report", {"input": "US2", "fail": True})
+        events = [event async for event in manager.subscribe(done)]
+        while manager.status(failed)["status"] != "failed":
+            await asyncio.sleep(0.01)
+        await manager.stop()
+        return events, manager.status(done), manager.status(failed)
+
+    def test_jobs_report_progress_and_result(self):
+        events, done, failed = asyncio.run(self.run_jobs())
+
+        self.assertEqual([event["chunks_done"] for event in events if event["type"] == "progress"][-1], 3)
+        self.assertEqual((events[-1]["status"], events[-1]["result"]), ("done", {"patent_no": "US1"}))
+        self.assertEqual(done["progress"], {"stage": "map", "chunks_done": 3, "chunks_failed": 0, "prompt_tokens": 300})
+        self.assertEqual((failed["status"], failed["error"]), ("failed", "upstream down"))
+
+    async def run_in_two_processes(self, runs):
+        async def count_runs(params, job_id):
+            runs.append(job_id)
+            await asyncio.sleep(0.05)
+            return {"patent_no": params["input"]}
+
+        job_id = self.store.create_job("product_report", {"input": "US1"})
+        # Two API processes sharing the job store both queue the pending job at startup
+        managers = [JobManager(JobStore(self.store.path), workers=2) for _ in range(2)]
+        for manager in managers:
+            manager.register("product_report", count_runs)
+            manager.start()
+        while self.store.get_job(job_id)["status"] != "done":
+            await asyncio.sleep(0.01)
+        for manager in managers:
+            await manager.stop()
+
+    def test_job_runs_once_across_processes(self):
+        runs = []
+        asyncio.run(self.run_in_two_processes(runs))
+
+        self.assertEqual(len(runs), 1)
+
+    async def stop_while_running(self):
+        started = asyncio.Event()
+
+        async def hang(params, job_id):
+            started.set()
+            await asyncio.sleep(60)
+
+        manager = JobManager(self.store, workers=1)
+        manager.register("product_report", hang)
+        manager.start()
+        job_id = await manager.submit("product_report", {"input": "US1"})
+        await started.wait()
+        running = self.store.get_job(job_id)
+        await manager.stop()
+        return running, self.store.get_job(job_id)
+
+    def test_stopped_job_goes_back_to_pending(self):
+        running, stopped = asyncio.run(self.stop_while_running())
+
+        self.assertEqual(running["status"], "running")
+        self.assertIsNotNone(running["owner"])
+        self.assertEqual((stopped["status"], stopped["owner"]), ("pending", None))
+
+    async def lose_lease(self):
+        cancelled = asyncio.Event()
+
+        async def hang(params, job_id):
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        manager = JobManager(self.store, workers=1, lease_seconds=0.06)
+        manager.register("product_report", hang)
+        manager.start()
+        job_id = await manager.submit("product_report", {"input": "US1"})
+        while self.store.get_job(job_id)["owner"] is None:
+            await asyncio.sleep(0.01)
+        # Another worker took over the job
+        self.store.renew_lease(job_id, manager.owner, lease_seconds=-1)
+        self.store.claim_job(job_id, "other-worker")
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await manager.stop()
+        return self.store.get_job(job_id)
+
+    def test_job_stops_when_its_lease_is_lost(self):
+        job = asyncio.run(self.lose_lease())
+
+        self.assertEqual((job["status"], job["owner"]), ("running", "other-worker"))
+
+    async def run_workflow_job(self, failed_chunks):
+        saved = []
+
+        async def workflow(params, job_id):
+            checkpoints = await JobCheckpoints.load(job_id)
+            await checkpoints.stage("map")
+            await checkpoints.save(1, "Glycerin is a humectant.", {"summary": "humectant"})
+            for chunk_index in failed_chunks:
+                checkpoints.fail(chunk_index)
+            await checkpoints.complete({"patent_no": "US1"})
+            # Still owned: a lease renewal after the workflow completed keeps the job running
+            self.assertTrue(self.store.renew_lease(job_id, manager.owner))
+            await asyncio.sleep(0.05)
+            saved.append(job_id)
+            return {"patent_no": "US1"}
+
+        manager = JobManager(self.store, workers=1, lease_seconds=0.03)
+        manager.register("product_report", workflow)
+        manager.start()
+        job_id = await manager.submit("product_report", {"input": "US1"})
+        while manager.status(job_id)["status"] not in ("done", "failed"):
+            await asyncio.sleep(0.01)
+        await manager.stop()
+        return saved, self.store.get_job(job_id)
+
+    def test_runner_alone_finalizes_workflow_jobs(self):
+        with patch("utils.job_store.get_job_store", return_value=self.store):
+            saved, job = asyncio.run(self.run_workflow_job([]))
+            self.assertEqual(len(saved), 1)
+            self.assertEqual((job["status"], job["result"], job["owner"]), ("done", {"patent_no": "US1"}, None))
+
+            saved, job = asyncio.run(self.run_workflow_job([2]))
+            self.assertEqual(len(saved), 1)
+            self.assertEqual(job["status"], "failed")
+            self.assertIn("Chunks [2] failed", job["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+from utils.job_store import JobStore
+
+
+class TestJobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "jobs.sqlite3")
+        self.store = JobStore(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_checkpoints_survive_a_restart(self):
+        job_id = self.store.create_job("product_discovery", {"provider": "openai"})
+        self.store.set_stage(job_id, "map")
+        self.store.save_chunk(job_id, 1, "Glycerin is a  humectant.", {"summary": "humectant"})
+
+        # A new process opens the same database
+        store = JobStore(self.path)
+        job = store.get_job(job_id)
+        self.assertEqual((job["status"], job["stage"], job["params"]), ("running", "map", {"provider": "openai"}))
+        outputs = store.chunk_outputs(job_id)
+        self.assertEqual(list(outputs), [1])
+        self.assertEqual(outputs[1][1], {"summary": "humectant"})
+
+    def test_complete_and_fail(self):
+        job_id = self.store.create_job("product_discovery", job_id="patent-1")
+        self.store.fail_job(job_id, "upstream down")
+        self.assertEqual(self.store.list_jobs("failed")[0]["error"], "upstream down")
+
+        self.store.complete_job(job_id, {"patent_no": "US1"})
+        job = self.store.get_job(job_id)
+        self.assertEqual((job["status"], job["result"]), ("done", {"patent_no": "US1"}))
+
+    def test_a_job_is_claimed_once(self):
+        job_id = self.store.create_job("product_discovery")
+        other_process = JobStore(self.path)
+
+        self.assertTrue(self.store.claim_job(job_id, "worker-1"))
+        self.assertFalse(other_process.claim_job(job_id, "worker-2"))
+        self.assertTrue(self.store.renew_lease(job_id, "worker-1"))
+        self.assertEqual(other_process.claimable_jobs(), [])
+
+        # The lease of a worker that died expires
+        self.assertTrue(self.store.renew_lease(job_id, "worker-1", lease_seconds=-1))
+        self.assertEqual([job["job_id"] for job in other_process.claimable_jobs()], [job_id])
+        self.assertTrue(other_process.claim_job(job_id, "worker-2"))
+        self.assertFalse(self.store.renew_lease(job_id, "worker-1"))
+
+        other_process.complete_job(job_id, {"patent_no": "US1"})
+        self.assertFalse(self.store.claim_job(job_id, "worker-1"))
+        self.assertIsNone(self.store.get_job(job_id)["owner"])
+
+    def test_released_job_is_claimable(self):
+        job_id = self.store.create_job("product_discovery")
+        self.store.claim_job(job_id, "worker-1")
+        self.store.release_job(job_id, "worker-2")
+        self.assertEqual(self.store.get_job(job_id)["status"], "running")
+
+        self.store.release_job(job_id, "worker-1")
+        self.assertEqual(self.store.get_job(job_id)["status"], "pending")
+        self.assertTrue(self.store.claim_job(job_id, "worker-2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from utils.llm_output_parser import parse_graph_output, parse_nodes
+from utils.unstructured_data_utils import getNodesAndRelationshipsFromResult
+
+
+class TestLlmOutputParser(unittest.TestCase):
+
+    def test_names_with_separators(self):
+        result = parse_graph_output(
+            'Nodes: ["Varale; Aditya", "Inventor", {}], '
+            '["caprylic/capric triglyceride, C8-10", "Chemical", {"weight": "2%, w/w"}]\n'
+            'Relationships: ["Varale; Aditya", "INVENTED", "caprylic/capric triglyceride, C8-10", {}]'
+        )
+        self.assertEqual(
+            result["nodes"],
+            [
+                {"name": "Varale; Aditya", "label": "Inventor", "properties": {}},
+                {"name": "caprylic/capric triglyceride, C8-10", "label": "Chemical", "properties": {"weight": "2%, w/w"}},
+            ],
+        )
+        self.assertEqual(result["relationships"][0]["end"], "caprylic/capric triglyceride, C8-10")
+
+    def test_tolerant_formats(self):
+        # Unquoted names, Python literals, nested brackets, bullets and notes
+        result = parse_graph_output(
+            "**Nodes:**\n"
+            "- [Varale; Aditya, Inventor, {active: True, ids: [1, [2]]}]\n"
+            '- ["alice", "Person", {"age": 30}]\n'
+            "Note: names were normalized\n"
+            "**Relationships:**\n"
+            "- [Varale; Aditya, KNOWS, alice, {}]"
+        )
+        self.assertEqual(
+            result["nodes"][0],
+            {"name": "Varale; Aditya", "label": "Inventor", "properties": {"active": True, "ids": [1, [2]]}},
+        )
+        self.assertEqual(result["nodes"][1], {"name": "alice", "label": "Person", "properties": {"age": 30}})
+        self.assertEqual(
+            result["relationships"], [{"start": "Varale; Aditya", "end": "alice", "type": "KNOWS", "properties": {}}]
+        )
+
+    def test_partial_output(self):
+        # The answer was cut off: complete entries are kept, the truncated one is dropped
+        result = getNodesAndRelationshipsFromResult(
+            ['Nodes: ["alice", "Person", {}], ["bob", "Person", {"age": 3',
+             'Nodes: [["carol", "Person", {}]]\nRelationships: [["carol", "KNOWS", "alice", {}], ["carol", "KN']
+        )
+        self.assertEqual([node["name"] for node in result["nodes"]], ["alice", "carol"])
+        self.assertEqual(len(result["relationships"]), 1)
+        self.assertEqual(parse_nodes('["alice"], ["bob", "Person"]'), [{"name": "bob", "label": "Person", "properties": {}}])
+
+
+if __name__ == "__main__":
+    unittest.main()
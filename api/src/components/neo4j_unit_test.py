@@ -0,0 +1,62 @@
+import unittest
+from unittest.mock import patch
+
+from components.unit_test_helpers import FakeNeo4jDriver
+from driver.neo4j import NAME_KEY_VERSION, Neo4jDatabase
+
+
+class TestChemicalResolution(unittest.TestCase):
+
+    def setUp(self):
+        # Written with the key of the first version, which sorted the words
+        self.stale = ["water in oil emulsion"]
+
+        def answer(query, params):
+            if "RETURN DISTINCT c.name" in query:
+                stale, self.stale = self.stale, []
+                return [{"name": name} for name in stale]
+            if "RETURN key, min(c.name)" in query:
+                return [{"key": key, "name": key} for key in params["keys"] if key == "water in oil emulsion"]
+            return []
+
+        self.driver = FakeNeo4jDriver(answer)
+        patches = [
+            patch("driver.neo4j.GraphDatabase.driver", return_value=self.driver),
+            patch.object(Neo4jDatabase, "refresh_schema"),
+            patch("driver.neo4j.GRAPH_ENTITY_RESOLUTION", True),
+            patch("driver.neo4j._chemical_keys_ready", set()),
+        ]
+        for started in patches:
+            started.start()
+            self.addCleanup(started.stop)
+
+    def queries(self, text):
+        return [(query, params) for query, params in self.driver.queries if text in query]
+
+    def test_keys_are_updated_once_per_process(self):
+        # At the startup and by the batch ingestion
+        for _ in range(2):
+            Neo4jDatabase(read_only=False).ensure_chemical_keys()
+
+        self.assertEqual(len(self.queries("CREATE INDEX chemical_name_key")), 1)
+        (_, backfill), = self.queries("SET c.name_key")
+        self.assertEqual(backfill["rows"], [{"name": "water in oil emulsion", "name_key": "water in oil emulsion"}])
+        self.assertEqual(backfill["version"], NAME_KEY_VERSION)
+
+    def test_resolution_only_looks_up_the_keys(self):
+        # A connection per request
+        for _ in range(3):
+            resolved = Neo4jDatabase(read_only=False).resolve_chemical_names(
+                ["water-in-oil emulsion", "oil-in-water emulsion"]
+            )
+
+        self.assertEqual(self.queries("CREATE INDEX"), [])
+        self.assertEqual(self.queries("SET c.name_key"), [])
+        self.assertEqual(len(self.queries("RETURN key, min(c.name)")), 3)
+        self.assertEqual(
+            resolved, {"water-in-oil emulsion": "water in oil emulsion", "oil-in-water emulsion": "oil-in-water emulsion"}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,6 +4,7 @@ from typing import Any, Dict, List, Union
 from components.base_component import BaseComponent
 from driver.neo4j import Neo4jDatabase
 from llm.basellm import BaseLLM
+from llm.ollamaapi import OLLAMA_HOST, OLLAMA_KEEP_ALIVE
 import requests
 
 def remove_relationship_direction(cypher):
@@ -67,7 +68,7 @@ class OllamaText2Cypher(BaseComponent):
         print([el for el in messages if not el["role"] == "system"])
         # cypher = self.llm.generate(messages)
         response = requests.post(
-            "http://host.docker.internal:11434/api/chat",
+            f"{OLLAMA_HOST}/api/chat",
             json={
                 "model": "llama3.1",
                 "messages": [
@@ -80,7 +81,8 @@ class OllamaText2Cypher(BaseComponent):
                         "content": question
                     },
                 ],
-                "stream": False
+                "stream": False,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
             },
         )
         result = response.json()
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import time
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from components.unit_test_helpers import mock_async_client
+from llm.ollamaapi import OllamaChat
+
+
+class TestOllamaChat(unittest.TestCase):
+
+    def setUp(self):
+        with patch("llm.ollamaapi.tiktoken.get_encoding"):
+            self.llm = OllamaChat(host="http://proxy/ollama/chat")
+
+    def test_agenerate_calls_overlap(self):
+        payloads = []
+
+        async def handler(request):
+            payloads.append(json.loads(request.content))
+            await asyncio.sleep(0.2)
+            return httpx.Response(200, json={"generated_text": {"message": {"content": "ok"}}})
+
+        async def run():
+            with patch("llm.ollamaapi.httpx.AsyncClient", mock_async_client(handler)):
+                return await asyncio.gather(*(self.llm.agenerate([f"prompt {i}"]) for i in range(5)))
+
+        start = time.perf_counter()
+        results = asyncio.run(run())
+
+        self.assertEqual(results, ["ok"] * 5)
+        self.assertLess(time.perf_counter() - start, 0.2 * 5)
+        self.assertEqual(payloads[0]["messages"], [{"role": "user", "content": "prompt 0"}])
+        self.assertFalse(payloads[0]["stream"])
+
+    def test_streams_tokens_as_they_arrive(self):
+        lines = [{"message": {"content": token}, "done": False} for token in ["Hel", "lo"]] + [{"done": True}]
+
+        def handler(request):
+            return httpx.Response(200, content="\n".join(json.dumps(line) for line in lines).encode())
+
+        tokens = []
+
+        async def on_token(token):
+            tokens.append(token)
+
+        with patch("llm.ollamaapi.httpx.AsyncClient", mock_async_client(handler)):
+            result = asyncio.run(self.llm.generateStreaming(["hi"], on_token))
+
+        self.assertEqual(result, ["Hel", "lo"])
+        self.assertEqual(tokens, ["Hel", "lo"])
+
+    def test_errors_are_returned(self):
+        def handler(request):
+            return httpx.Response(500, text="model not found")
+
+        with patch("llm.ollamaapi.httpx.AsyncClient", mock_async_client(handler)):
+            self.assertTrue(asyncio.run(self.llm.agenerate(["hi"])).startswith("Error:"))
+
+
+if __name__ == "__main__":
+    unittest.main()
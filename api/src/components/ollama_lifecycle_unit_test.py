@@ -0,0 +1,54 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from components.unit_test_helpers import mock_async_client
+from llm.ollama_lifecycle import OllamaModelManager, model_manager_from_env, parse_keep_alive
+
+
+class TestOllamaModelManager(unittest.TestCase):
+
+    def test_parse_keep_alive(self):
+        self.assertEqual(parse_keep_alive("30m"), 1800)
+        self.assertEqual(parse_keep_alive("300"), 300)
+        self.assertIsNone(parse_keep_alive("-1"))
+        with self.assertRaises(ValueError):
+            parse_keep_alive("soon")
+
+    def test_ready_without_models_to_preload(self):
+        with patch("llm.ollama_lifecycle.OLLAMA_PRELOAD_MODELS", ""):
+            manager = model_manager_from_env()
+
+        self.assertEqual(manager.models, [])
+        # Ready without Ollama, and nothing is started
+        self.assertTrue(manager.ready)
+        manager.start()
+        self.assertIsNone(manager._task)
+
+    def test_preload_states(self):
+        requests = []
+
+        def handler(request):
+            body = json.loads(request.content)
+            requests.append(body)
+            if body["model"] == "missing":
+                return httpx.Response(404, text="model not found")
+            return httpx.Response(200, json={"done": True})
+
+        manager = OllamaModelManager(["llama3.1", "missing"], host="http://ollama", keep_alive="10m")
+        self.assertEqual(manager.ping_interval, 300)
+        with patch("llm.ollama_lifecycle.httpx.AsyncClient", mock_async_client(handler)):
+            asyncio.run(manager.preload())
+
+        self.assertEqual(manager.state["llama3.1"]["status"], "loaded")
+        self.assertIsNotNone(manager.state["llama3.1"]["load_seconds"])
+        self.assertEqual(manager.state["missing"]["status"], "error")
+        self.assertFalse(manager.ready)
+        self.assertEqual(requests[0], {"model": "llama3.1", "keep_alive": "10m"})
+
+
+if __name__ == "__main__":
+    unittest.main()
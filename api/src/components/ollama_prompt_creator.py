@@ -1,16 +1,33 @@
+import asyncio
+import os
 import re
 import logging
 import tiktoken
-from utils.unstructured_data_utils import (
-    nodesTextToListOfDict,
-    relationshipTextToListOfDict,
-)
+from collections import Counter
+from utils.chunking import aiter_token_chunks, split_text_to_token_budget
+from utils.patent_segmenter import FORMULATION_SECTIONS, aiter_patent_chunks
+from utils.chunk_cache import PROVIDER_MODELS, cached_chunk_result, is_cacheable, provider_model
+from utils.extraction_accumulator import CompositionAccumulator, KeywordAccumulator
+from utils.job_store import JobCheckpoints, get_job_store, report_progress, run_by_job_runner
+from utils.llm_budget import within_llm_budget
+from utils.patent_metadata import PATENT_METADATA_CONFIDENCE, extract_patent_metadata
+from utils.ingredient_matcher import INGREDIENT_PREFILTER, get_ingredient_matcher
+from utils.relevance_gate import COMPOSITION_TASK, NAME_DESCRIPTION_TASK, get_relevance_gate, record_outcome
+from utils.convergence import make_convergence_policy
 import httpx
 import psutil
 from typing import Optional
 import json
 from driver.neo4j import Neo4jDatabase
-from typing import Callable, List, Dict, Any
+from typing import AsyncIterator, Callable, List, Dict, Any, Tuple, Type, Union
+from utils.structured_output import (
+    CompositionReport,
+    GraphExtraction,
+    PatentDocument,
+    ProductSummary,
+    json_schema,
+    parse_structured,
+)
 
 
 def generate_system_message() -> str:
@@ -27,6 +44,43 @@ Relationships: ["alice", "roommate", "bob", {"start": 2021}], ["alice", "owns",
 """
 
 
+def generate_json_system_message() -> str:
+    return """
+You are a data scientist working for a company that is building a graph database. Your task is to extract information from data and convert it into a graph database.
+Respond with a JSON object with the keys "nodes" and "relationships". Every node has a "name" (the ENTITY_ID), a "label" (its TYPE) and "properties".
+Every relationship has a "start" and an "end" ENTITY_ID, a "type" and "properties".
+It is important that the start and end exist as nodes with a matching name. If you can't pair a relationship with a pair of nodes don't add it.
+When you find a node or relationship you want to add try to create a generic TYPE for it that  describes the entity you can also think of it as a label.
+
+Example:
+Data: Alice lawyer and is 25 years old and Bob is her roommate since 2001. Bob works as a journalist. Alice owns a the webpage www.alice.com and Bob owns the webpage www.bob.com.
+{"nodes": [{"name": "alice", "label": "Person", "properties": {"age": 25, "occupation": "lawyer", "name": "Alice"}}, {"name": "bob", "label": "Person", "properties": {"occupation": "journalist", "name": "Bob"}}, {"name": "alice.com", "label": "Webpage", "properties": {"url": "www.alice.com"}}, {"name": "bob.com", "label": "Webpage", "properties": {"url": "www.bob.com"}}],
+ "relationships": [{"start": "alice", "type": "roommate", "end": "bob", "properties": {"start": 2021}}, {"start": "alice", "type": "owns", "end": "alice.com", "properties": {}}, {"start": "bob", "type": "owns", "end": "bob.com", "properties": {}}]}
+"""
+
+
+# Prompt template versions, part of the chunk cache key. Bump them when a prompt changes.
+GRAPH_EXTRACTION_TEMPLATE = "graph-extraction-json-v1"
+
+# Chunks extracted in parallel by run_with_chunk_logging
+EXTRACTION_CONCURRENCY = int(os.getenv("EXTRACTION_CONCURRENCY", "4"))
+NAME_DESCRIPTION_TEMPLATE = "name-description-v1"
+COMPOSITION_TEMPLATE = "composition-v1"
+DOCUMENT_DETAILS_TEMPLATE = "document-details-json-v1"
+NAME_DESCRIPTION_MAP_TEMPLATE = "name-description-map-v1"
+COMPOSITION_MAP_TEMPLATE = "composition-map-v2"
+
+# "map_reduce" extracts every chunk of a patent independently and in parallel, "sequential" threads the facts
+# extracted so far through every chunk prompt.
+PRODUCT_DISCOVERY_MODE = os.getenv("PRODUCT_DISCOVERY_MODE", "map_reduce")
+# Token budget of one reduce call. Longer map outputs are reduced group by group, level by level.
+MAP_REDUCE_TOKEN_BUDGET = int(os.getenv("MAP_REDUCE_TOKEN_BUDGET", "3000"))
+MAP_REDUCE_MAX_LEVELS = 3
+# Size of the "till now" context of the sequential prompts, so prompts stay flat as documents get longer
+NAME_DESCRIPTION_CONTEXT_WORDS = 50
+COMPOSITION_CONTEXT_CHEMICALS = 40
+
+
 def num_tokens_from_string(string: str) -> int: 
     """
     Estimate the number of tokens in a string using the LLaMA tokenizer.
@@ -47,40 +101,10 @@ def max_allowed_token_length() -> int:
     return 1024
 
 
-def splitString(string, max_length) -> List[str]:
-    return [string[i : i + max_length] for i in range(0, len(string), max_length)]
-
-
 def splitStringToFitTokenSpace(string: str, token_use_per_string: int) -> List[str]:
     allowed_tokens = max_allowed_token_length() - token_use_per_string
-    chunked_data = splitString(string, 500)  # Split based on approximate length
-    # print("The length of the splitted text array is: ", len(chunked_data))
-
-    # print(chunked_data[0])
-
-    combined_chunks = []
-    current_chunk = ""
-    
-    for chunk in chunked_data:
-        # Calculate token count for the combined chunk
-        current_chunk_tokens = num_tokens_from_string(current_chunk)
-        # print("Length of the current chunk of 500 words based on regex is in tokens is :", current_chunk_tokens)
-        chunk_tokens = num_tokens_from_string(chunk)
-        # print("Length of the chunk token of 500 words based on regex is in tokens is :", current_chunk_tokens)
-
-        if current_chunk_tokens + chunk_tokens <= allowed_tokens:
-            current_chunk += chunk
-        else:
-            # Append the non-empty current chunk and start a new one
-            if current_chunk.strip():
-                combined_chunks.append(current_chunk.strip())
-            current_chunk = chunk
-    
-    # Append any remaining chunk after the loop
-    if current_chunk.strip():
-        combined_chunks.append(current_chunk.strip())
-
-    return combined_chunks
+    # Tokenized once and cut on token boundaries, snapped to sentence ends where possible
+    return split_text_to_token_budget(string, allowed_tokens, snap_to_sentences=True)
 
 
 
@@ -159,131 +183,109 @@ def clean_llm_response(raw_response: str) -> str:
         return "Nodes: []\nRelationships: []"
 
 
-
-
-def getNodesAndRelationshipsFromResult(result):
-    regex = "Nodes:\s+(.*?)\s?\s?Relationships:\s?\s?(.*)"
-    internalRegex = "\[(.*?)\]"
-    nodes = []
-    relationships = []
-
-    print("Starting to parse :" , result, len(result))
-    
-    for row in result:
-        print(f"Processing row: {row}")
-        
-        # Match using regex
-        parsing = re.match(regex, row, flags=re.S)
-        if parsing is None:
-            print(f"No match found for row: {row}")
-            continue
-        
-        print("Regex match found. Extracting nodes and relationships.")
-        
-        # Extract raw nodes and relationships
-        rawNodes = str(parsing.group(1))
-        rawRelationships = parsing.group(2)
-        
-        print(f"Extracted rawNodes: {rawNodes}")
-        print(f"Extracted rawRelationships: {rawRelationships}")
-        
-        # Find individual elements using internal regex
-        nodes.extend(re.findall(internalRegex, rawNodes))
-        relationships.extend(re.findall(internalRegex, rawRelationships))
-        
-        print(f"Current list of nodes: {nodes}")
-        print(f"Current list of relationships: {relationships}")
-
-    # Validate extracted nodes and relationships before inserting them
-    nodes = [node for node in nodes if len(node.split(",")) >= 2]  # Ensure each node has at least name and label
-    relationships = [rel for rel in relationships if len(rel.split(",")) >= 3]  # Ensure valid relationship structure
-    
-    if not nodes:
-        print("Warning: No valid nodes found.")
-    if not relationships:
-        print("Warning: No valid relationships found.")
-
-    # Convert raw text data to structured dictionaries
-    print("Converting extracted nodes and relationships to structured dictionaries.")
-    try:
-        result = dict()
-        result["nodes"] = nodesTextToListOfDict(nodes)
-        result["relationships"] = relationshipTextToListOfDict(relationships)
-    except Exception as e:
-        logging.error(f"Error during conversion of nodes or relationships: {e}")
-        raise
-    
-    print("Inside the function nodes are : ", result["nodes"])
-
-    logging.info("Successfully parsed nodes and relationships.")
-    return result
-
-
-async def run_with_chunk_logging(data: str) -> List[str]:
+async def run_with_chunk_logging(
+    data: Union[str, AsyncIterator[str]], provider: str = "ollama", concurrency: Optional[int] = None
+) -> List[str]:
+        """
+        Extract nodes and relationships chunk by chunk.
+        Chunks are independent, so up to `concurrency` of them are extracted in parallel. Results are merged
+        in chunk order and a failing chunk only loses its own nodes and relationships.
+        :param data: The whole document, or an async stream of text (e.g. an upload) whose chunks are processed as they arrive.
+        :param provider: The provider name (e.g., "ollama", "openai", "groq").
+        :param concurrency: Maximum number of chunks in flight, EXTRACTION_CONCURRENCY by default. 1 is sequential.
+        """
+        concurrency = max(1, concurrency or EXTRACTION_CONCURRENCY)
         print("Process Started with the patent text")
 
-        system_message = generate_system_message() # Currently 324 tokens are only used for the system message or the intruction of the task.
-        prompt_string = generate_prompt(data)
-        print("No. of tokens in the prompt input string :", num_tokens_from_string(prompt_string))
+        system_message = generate_json_system_message() # The instruction of the task, sent with every chunk.
         print("No. of tokens in the system message string :", num_tokens_from_string(system_message) )
-        
-        token_usage_per_prompt = num_tokens_from_string(
-            system_message + prompt_string
-        )
-
-        print("token usage per prompt :",  token_usage_per_prompt)
+        streaming = not isinstance(data, str)
+        if not streaming:
+            prompt_string = generate_prompt(data)
+            print("No. of tokens in the prompt input string :", num_tokens_from_string(prompt_string))
+            print("token usage per prompt :",  num_tokens_from_string(system_message + prompt_string))
 
         # Once we get the total token to be used including the system prompt we split it to fit the token space.
-        chunked_data = splitStringToFitTokenSpace(
-            string=data, token_use_per_string=num_tokens_from_string(system_message)
+        chunked_data = aiter_token_chunks(
+            data,
+            max_allowed_token_length() - num_tokens_from_string(system_message),
+            snap_to_sentences=True,
         )
 
-        print("So number of chunks created from the text are : ",len(chunked_data))
-
-        results = []
-        labels = set()
-        chunks = []  # To store chunk metadata
-        # print ( "Chunks have been created")
-
-        print("Starting chunkwise processing")
-        
-        chunkResult = {} # getNodesAndRelationshipsFromResult returns this -> dict[str, list[dict[str, Any]]]
-
-        for i,chunk in enumerate(chunked_data, start=1):
+        async def extract_chunk(i: int, chunk: str) -> Dict[str, Any]:
             print(f"Chunk number {i} chunk sent: {chunk}")
-            
+
             # Log memory usage before processing the chunk
             memory_info = psutil.virtual_memory()
             print(f"Memory before processing chunk {i}: {memory_info.used / (1024**2):.2f} MB")
 
-            processedChunk = await old_process(chunk)
-            print(f"Chunk number {i} processedChunk : ", processedChunk)
-            cleaned_response = clean_llm_response(processedChunk)
-            print("The cleaned response is : ", cleaned_response)
-            chunkResult = getNodesAndRelationshipsFromResult([cleaned_response])
-            print("chunkResult- nodes and relationships : ", chunkResult.get("nodes", []))
-            newLabels = [node["label"] for node in chunkResult["nodes"]]
-            print("newLabels", newLabels)
-            results.append(cleaned_response) # Why cleaned reponse ? Speculate
-            labels.update(newLabels)
-            # Append chunk metadata and result to chunks array
-            chunks.append({
+            # The answer is constrained to the GraphExtraction schema, so no regex cleanup is needed.
+            # Chunks seen before (boilerplate, re-uploads) are answered from the chunk cache.
+            try:
+                chunkResult = await cached_chunk_result(
+                    chunk, GRAPH_EXTRACTION_TEMPLATE, provider_model(provider), lambda: structured_dict(generate_prompt(chunk), provider, GraphExtraction, system_message)
+                )
+            except Exception as e:
+                logging.error(f"Chunk number {i} failed: {e}")
+                chunkResult = None
+            if chunkResult is None:
+                print(f"Chunk number {i} returned no valid graph extraction")
+                chunkResult = GraphExtraction().dict()
+                report_progress(chunks_failed=1)
+            else:
+                report_progress(chunks_done=1)
+            print("chunkResult- nodes and relationships : ", chunkResult["nodes"])
+
+            # Chunk metadata and result
+            chunk_metadata = {
                 "chunk_number": i,
                 "system_prompt": system_message,
-                "input_chunk_text": chunk,
-                "chunk_result_nodes": chunkResult.get("nodes", []),  
-                # Ensure no KeyError ,by providing a default empty key [] 
-                # The empty brakcets serve as a default value in case the key "nodes" is missing from the dictionary.
-                "chunk_result_relationships": chunkResult.get("relationships", [])
-            })
+                "chunk_result_nodes": chunkResult["nodes"],
+                "chunk_result_relationships": chunkResult["relationships"]
+            }
+            if not streaming:
+                # Streamed documents are not kept in memory, not even chunk by chunk
+                chunk_metadata["input_chunk_text"] = chunk
 
             # Log memory usage after processing the chunk
             memory_info = psutil.virtual_memory()
             print(f"Memory after processing chunk {i}: {memory_info.used / (1024**2):.2f} MB")
+            return chunk_metadata
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded_extract_chunk(i: int, chunk: str) -> Dict[str, Any]:
+            try:
+                return await extract_chunk(i, chunk)
+            finally:
+                semaphore.release()
+
+        print(f"Starting chunkwise processing, {concurrency} chunks at a time")
+        report_progress(stage="extraction")
+
+        tasks = []
+        try:
+            async for chunk in chunked_data:
+                # Waiting for a free slot before reading the next chunk also throttles a streamed upload
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(bounded_extract_chunk(len(tasks) + 1, chunk)))
+            chunks = list(await asyncio.gather(*tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+        print("So number of chunks created from the text are : ", len(chunks))
+
+        # Merge in chunk order
+        nodes = []
+        relationships = []
+        labels = set()
+        for chunk_metadata in chunks:
+            nodes.extend(chunk_metadata["chunk_result_nodes"])
+            relationships.extend(chunk_metadata["chunk_result_relationships"])
+            labels.update(node["label"] for node in chunk_metadata["chunk_result_nodes"])
+        print("labels", labels)
 
-        ## So No matter how many time one runs this "getNodesAndRelationshipsFromResult" function
-        ## it will lead to further refinement of results.
-        final_result = getNodesAndRelationshipsFromResult(results)
+        final_result = {"nodes": nodes, "relationships": relationships}
         return final_result, chunks
 
 #####################################################################################
@@ -291,6 +293,8 @@ async def run_with_chunk_logging(data: str) -> List[str]:
 #####################################################################################
 
 from llm.openai import OpenAIChat
+from llm.ollamaapi import OllamaChat
+from llm.cassette import with_cassette
 import os
 from dotenv import load_dotenv
 from pathlib import Path
@@ -305,10 +309,17 @@ load_dotenv(ROOT_DIR / ".env")
 api_key = "api-key"
 
 
+OPENAI_MODEL = PROVIDER_MODELS["openai"]
+OLLAMA_MODEL = PROVIDER_MODELS["ollama"]
+
 # Initialize LLM 
-llm = OpenAIChat(
-    openai_api_key=api_key, model_name="gpt-4o-mini", max_tokens=4096
+llm = with_cassette(
+    OpenAIChat(openai_api_key=api_key, model_name=OPENAI_MODEL, max_tokens=4096),
+    "product_discovery_openai",
 )
+# Ollama through the /ollama/chat proxy
+ollama_llm = with_cassette(OllamaChat(model_name=OLLAMA_MODEL), "product_discovery_ollama")
+
 
 # Helper Functions - 
 async def openai_generate(prompt: str) -> str:
@@ -323,11 +334,12 @@ async def openai_generate(prompt: str) -> str:
     ]
     print(f"Sending request to OpenAI endpoint with messages: {messages}")
     
-    # Assuming `llm.generate()` is correctly configured to accept the messages
-    output = llm.generate(messages)
+    # The async client, so concurrent calls (e.g. the map stage) do not block the event loop
+    output = await llm.agenerate(messages)
     print("The output is:", output)
     return output
 
+@within_llm_budget
 async def process(chunk: str, provider: str) -> str:
     """
     Process a single chunk by making an asynchronous request to the specified provider's endpoint.
@@ -335,6 +347,7 @@ async def process(chunk: str, provider: str) -> str:
     :param provider: The provider name (e.g., "ollama", "openai", "groq").
     :return: The processed response as a string.
     """
+    report_progress(prompt_tokens=num_tokens_from_string(chunk))
     try:
         # Prepare the request payload with only the chunk (prompt)
         payload = {
@@ -344,12 +357,7 @@ async def process(chunk: str, provider: str) -> str:
         # Route to appropriate provider using a match-case structure
         if provider == "ollama":
             logging.debug(f"Sending request to http://localhost:7860/ollama/chat with payload: {payload}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post("http://localhost:7860/ollama/chat", json=payload)
-            response.raise_for_status()
-            result = response.json()
-            message = result.get('generated_text', {}).get('message', {})
-            content = message.get('content', None)
+            content = await ollama_llm.agenerate([{"role": "user", "content": chunk}])
 
         elif provider == "openai":
             output = await openai_generate(chunk)
@@ -376,6 +384,64 @@ async def process(chunk: str, provider: str) -> str:
         return f"Invalid JSON received: {e}"
 
 
+@within_llm_budget
+async def structured_generate(
+    prompt: str, provider: str, response_model: Type[Any], system_message: Optional[str] = None
+) -> Optional[Any]:
+    """
+    Ask the provider for a JSON answer constrained to the schema of response_model and parse it with a single json.loads.
+    :param prompt: The input prompt.
+    :param provider: The provider name (e.g., "ollama", "openai", "groq").
+    :param response_model: The pydantic model describing the expected answer.
+    :param system_message: Optional system prompt.
+    :return: The parsed model instance, or None if the provider failed or the answer did not match the schema.
+    """
+    schema = json_schema(response_model)
+    messages = [{"role": "user", "content": prompt}]
+    if system_message:
+        messages.insert(0, {"role": "system", "content": system_message})
+    report_progress(prompt_tokens=sum(num_tokens_from_string(message["content"]) for message in messages))
+
+    try:
+        if provider == "openai":
+            return parse_structured(response_model, await llm.agenerate_json(messages, schema))
+
+        elif provider == "ollama":
+            return parse_structured(response_model, await ollama_llm.agenerate_json(messages, schema))
+
+        elif provider == "groq":
+            # The Groq proxy has no JSON mode, the prompt has to ask for JSON
+            async with httpx.AsyncClient() as client:
+                response = await client.post("http://localhost:7860/groq/chat", json={"prompt": prompt})
+            response.raise_for_status()
+            content = response.json().get('response')
+
+        else:
+            raise ValueError(f"Unsupported provider: {provider}")
+
+    except httpx.HTTPError as e:
+        logging.error(f"Error communicating with {provider}: {e}")
+        return None
+    except ValueError as e:
+        logging.error(f"Invalid structured response from {provider}: {e}")
+        return None
+
+    if content is None:
+        logging.error("No content received in the response.")
+        return None
+    return parse_structured(response_model, content)
+
+
+async def structured_dict(
+    prompt: str, provider: str, response_model: Type[Any], system_message: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    structured_generate returning a plain dict, as stored in the chunk cache.
+    """
+    result = await structured_generate(prompt, provider, response_model, system_message)
+    return result.dict() if result else None
+
+
 # # Define the reprocess() function
 # async def reprocess(text: str, provider: str) -> str:
 #     """
@@ -436,32 +502,15 @@ async def process(chunk: str, provider: str) -> str:
 #         return f"Invalid JSON received: {e}"
 
 
-def cleaned_name_and_description(response):
+def cleaned_name_and_description(response) -> Dict[str, Optional[str]]:
     """
-    Extracts the product name and description from the response.
+    Extracts the product name and description from a JSON mode response.
     
-    :param response: The raw response string from the OpenAI API.
+    :param response: The raw JSON string (or decoded object) returned by the LLM.
     :return: A dictionary containing the product name and description.
     """
-    import re
-
-    # Regular expressions to capture the name and description
-    name_pattern = r"\*\*Product Type Name:\*\* (.+)"
-    description_pattern = r"\*\*Description:\*\* (.+)"
-
-    # Extract name and description
-    name_match = re.search(name_pattern, response)
-    description_match = re.search(description_pattern, response)
-
-    # Get the matched content or default to None
-    product_name = name_match.group(1).strip() if name_match else None
-    product_description = description_match.group(1).strip() if description_match else None
-
-    # Return as a dictionary
-    return {
-        "name": product_name,
-        "description": product_description
-    }
+    summary = parse_structured(ProductSummary, response) or ProductSummary()
+    return summary.dict()
 
 
 async def extract_name_description(extracted_info: str, provider: str) -> Optional[Dict[str, str]]:
@@ -471,92 +520,31 @@ async def extract_name_description(extracted_info: str, provider: str) -> Option
         extracted_info: string of extracted information
         provider: provider name (e.g., 'openai', 'groq', 'ollama')
     Output:
-        A final refined string with product name and description
+        A dictionary with the product name and description, or None if no valid answer was received
+    """
+    # Format the prompt
+    prompt = f"""
+    ### Extracted Information:
+    {extracted_info}
+
+    ### Instruction:
+    You are a data scientist working for a company that is building a report for a cosmetic patent document. You are an author and have the capability to provide a very appropriate type of patent products based on gathered description. Provide an appropriate product type name describing very aptly what the product is about in a few words and a 2-sentence description of the product based on the extracted information, which represents a summary of the patent document.
+    Respond with a JSON object with the keys "name" and "description".
     """
-    try:
-        # Format the prompt
-        prompt = f"""
-        ### Extracted Information:
-        {extracted_info}
-
-        ### Instruction:
-        You are a data scientist working for a company that is building a report for a cosmetic patent document. You are an author and have the capability to provide a very appropriate type of patent products based on gathered description. Provide an appropriate product type name describing very aptly what the product is about in a few words and a 2-sentence description of the product based on the extracted information, which represents a summary of the patent document.
-        """
-
-        # Prepare the request payload
-        payload = {
-            "prompt": prompt
-        }
-
-        logging.debug(f"Prepared payload: {payload}")
-
-        # Route to appropriate provider using a match-case structure
-        content = None
-
-        if provider == "ollama":
-            logging.debug(f"Sending request to http://localhost:7860/ollama/chat with payload: {payload}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post("http://localhost:7860/ollama/chat", json=payload)
-            response.raise_for_status()
-            result = response.json()
-            message = result.get('generated_text', {}).get('message', {})
-            content = message.get('content', None)
-
-        elif provider == "openai":
-            output = await openai_generate(prompt)
-            cleaned_output = cleaned_name_and_description(output)
-            return cleaned_output
-
-        elif provider == "groq":
-            logging.debug(f"Sending request to Groq endpoint with payload: {payload}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post("http://localhost:7860/groq/chat", json=payload)
-            response.raise_for_status()
-            result = response.json()
-            content = result.get('response', None)  # Adjust based on Groq's API response structure
-
-        else:
-            raise ValueError(f"Unsupported provider: {provider}")
-
-        if content:
-            return content
-        else:
-            logging.error("No content received in the response.")
-            return None
-
-    except httpx.RequestError as e:
-        logging.error(f"Error communicating with {provider}: {e}")
-        return f"Error: {e}"
-
-    except ValueError as e:  # Handle JSON decoding errors and invalid provider
-        logging.error(f"ValueError: {e}")
-        return f"ValueError: {e}"
 
-    except Exception as e:
-        logging.error(f"Unexpected error: {e}")
-        return f"Unexpected error: {e}"
+    summary = await structured_generate(prompt, provider, ProductSummary)
+    return summary.dict() if summary else None
 
 
 def clean_functional_role_info(received_text: str) -> Optional[Dict]:
     """
     Transforms the received functional role information text into a JSON object.
     
-    :param received_text: The raw string containing functional role information.
+    :param received_text: The raw JSON string (or decoded object) containing functional role information.
     :return: A JSON object with functional roles, or None if parsing fails.
     """
-    try:
-        # Attempt to parse the received text as JSON
-        functional_roles_json = json.loads(received_text)
-
-        # Validate that the required "functional_roles" key exists
-        if "functional_roles" in functional_roles_json:
-            return functional_roles_json  # Return the JSON object if valid
-
-    except json.JSONDecodeError as e:
-        print(f"Failed to parse JSON: {e}")
-
-    # Return None if parsing fails or required key is missing
-    return None
+    report = parse_structured(CompositionReport, received_text)
+    return report.dict() if report else None
 
 async def final_composition_information(extracted_info: str, provider: str) -> Optional[Dict[str, str]]:
     """
@@ -583,152 +571,50 @@ async def final_composition_information(extracted_info: str, provider: str) -> O
         }
         }
     """
-    try:
-        # Format the prompt
-        prompt = f"""
-        ### Extracted Information:
-        {extracted_info}
-
-        ### Instruction:
-        You are a data scientist working for a company that is building a report for a cosmetic patent document. Your job is to provide the final composition report of the product mentioned in the patent. Using the provided extracted functional role information, compile a comprehensive JSON object detailing the product's functional roles, the chemicals belonging to those roles, and their weights in percentages or ranges.Include all the unique extracted functional roles, their chemicals, and weights (or weight ranges). Ensure the JSON is clean, well-structured, and free of duplicates.If no functional roles are found in the complete data, respond with an empty functional_roles JSON object. Dont add comments, notes, or suggestions. Only provide the JSON object in the specified format.
-
-        ### Output Format:
-        Provide the response strictly in the following JSON format:
-        {output_format}
-        """
+    # Format the prompt
+    prompt = f"""
+    ### Extracted Information:
+    {extracted_info}
 
-        # Prepare the request payload
-        payload = {
-            "prompt": prompt
-        }
-
-        logging.debug(f"Prepared payload: {payload}")
-
-        # Route to appropriate provider using a match-case structure
-        content = None
+    ### Instruction:
+    You are a data scientist working for a company that is building a report for a cosmetic patent document. Your job is to provide the final composition report of the product mentioned in the patent. Using the provided extracted functional role information, compile a comprehensive JSON object detailing the product's functional roles, the chemicals belonging to those roles, and their weights in percentages or ranges.Include all the unique extracted functional roles, their chemicals, and weights (or weight ranges). Ensure the JSON is clean, well-structured, and free of duplicates.If no functional roles are found in the complete data, respond with an empty functional_roles JSON object. Dont add comments, notes, or suggestions. Only provide the JSON object in the specified format.
 
-        if provider == "ollama":
-            logging.debug(f"Sending request to http://localhost:7860/ollama/chat with payload: {payload}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post("http://localhost:7860/ollama/chat", json=payload)
-            response.raise_for_status()
-            result = response.json()
-            message = result.get('generated_text', {}).get('message', {})
-            content = message.get('content', None)
-
-        elif provider == "openai":
-            output = await openai_generate(prompt)
-            cleaned_output = clean_functional_role_info(output)
-            return cleaned_output
-
-        elif provider == "groq":
-            logging.debug(f"Sending request to Groq endpoint with payload: {payload}")
-            async with httpx.AsyncClient() as client:
-                response = await client.post("http://localhost:7860/groq/chat", json=payload)
-            response.raise_for_status()
-            result = response.json()
-            content = result.get('response', None)  # Adjust based on Groq's API response structure
-
-        else:
-            raise ValueError(f"Unsupported provider: {provider}")
-
-        if content:
-            return content
-        else:
-            logging.error("No content received in the response.")
-            return None
-
-    except httpx.RequestError as e:
-        logging.error(f"Error communicating with {provider}: {e}")
-        return f"Error: {e}"
-
-    except ValueError as e:  # Handle JSON decoding errors and invalid provider
-        logging.error(f"ValueError: {e}")
-        return f"ValueError: {e}"
-
-    except Exception as e:
-        logging.error(f"Unexpected error: {e}")
-        return f"Unexpected error: {e}"
-
-# Function to clean and tokenize text into words
-def clean_and_tokenize(text: str) -> set:
+    ### Output Format:
+    Provide the response strictly in the following JSON format:
+    {output_format}
     """
-    Cleans and tokenizes input text into a set of words.
-    Removes punctuation and converts to lowercase.
-    """
-    return set(re.findall(r'\b\w+\b', text.lower()))
 
-# Function to check and append only unique words
-def information_checker(information_extracted: str, new_response: str) -> str:
-    """
-    Compares existing extracted information with new response, appends only unique words.
-    """
-    # Tokenize and clean existing and new responses
-    existing_tokens = clean_and_tokenize(information_extracted)
-    new_tokens = clean_and_tokenize(new_response)
-    
-    # Find unique words from new response
-    unique_tokens = new_tokens - existing_tokens
-
-    if unique_tokens:
-        # Append unique words to the extracted information
-        updated_information = f"{information_extracted.strip()} {' '.join(unique_tokens)}"
-        print("New unique words added:", unique_tokens)
-        return updated_information.strip()
-    else:
-        print("No new unique words to append.")
-        return information_extracted.strip()
+    report = await structured_generate(prompt, provider, CompositionReport)
+    return report.dict() if report else None
 
 functional_roles = "Antioxidant, Humectant, Emollient, Surfactant, Emulsifier, Preservative, Fragrance, Colorant, UV Filter (Sunscreen Agent), Thickener/Viscosity Modifier, Conditioning Agent, Astringent, Film-Former, Opacifier, Solvent, Exfoliant, Antimicrobial Agent, Chelating Agent, Antifoaming Agent, Moisturizer, Absorbent, Mattifier, Skin Protectant, Soothing Agent, Exfoliating Enzyme, Wetting Agent, Texturizer, Anti-inflammatory, Desensitizer, Penetration Enhancer, Hair Fixative, Antidandruff Agent, Anti-aging Agent, Brightening Agent, Anti-acne Agent, Lubricant, Deodorant Agent, Toning Agent, Antiperspirant, Styling Agent, Hair Growth Stimulator, Anti-hair Loss Agent, Nail Hardener, Plasticizer, Peptide/Protein Agent, Anti-pollution Agent, Anti-oxidative Stress Agent"
 
 def extract_document_details(text_input):
     """
-    Helper function to extract patent document details from the input text
-    and return the extracted JSON object.
+    Helper function to extract patent document details from a JSON mode response.
 
     Args:
-        text_input (str): Text containing the patent details in JSON-like format.
+        text_input (str | dict): The raw JSON string or decoded object with the patent details.
 
     Returns:
         dict: Extracted patent document details as a JSON object.
     """
-    try:
-        # Extract JSON object from the text input
-        start_index = text_input.find("{")
-        end_index = text_input.rfind("}") + 1
-        json_text = text_input[start_index:end_index]
-        document_details = json.loads(json_text)
-        print("The final document details are :", document_details)
-        return document_details.get("patent", {})
-
-    except (ValueError, KeyError, AttributeError) as e:
-        print(f"Error processing document details: {e}")
+    document = parse_structured(PatentDocument, text_input)
+    if document is None:
         return {}
+    print("The final document details are :", document)
+    return document.patent.dict()
 
-async def product_discovery_workflow(data: str, provider: str) -> List[dict]:
-    print("Process Started with the patent text")
-
-    # Split data into chunks to fit token space
-    max_tokens_per_chunk = 4096  # Total token budget
-    chunked_data = splitStringToFitTokenSpace(string=data, token_use_per_string=0)  # Adjust chunk size
-    print("Number of chunks created from the text:", len(chunked_data))
-    total_token_count = 0  # Tracks the total tokens processed
-
-    # results = []
-    information_extracted = ""  # Accumulator
-    composition_information_extracted = "" # Accumulator
-    document_information_extracted = "" # Accumulator
-
-    print("Starting chunkwise processing")
-
-    for i, chunk in enumerate(chunked_data, start=1):
-        print(f"\nProcessing Chunk {i}:")
-
-        # Format prompt and injecting contextual data to improve answer quality to include previous context and the current chunk
-        prompt = f"""
+def name_description_prompt(chunk: str, information_extracted: Optional[str] = None) -> str:
+    """
+    Per chunk product name / description keywords prompt.
+    :param information_extracted: Keywords of the previous chunks (sequential mode), None for an independent (map) prompt.
+    """
+    context = f"""
         ### Information Extracted Till Now (50 words max):
         {information_extracted}
-
+""" if information_extracted is not None else ""
+    return f"""{context}
         ### New Chunk:
         {chunk}
 
@@ -738,10 +624,26 @@ async def product_discovery_workflow(data: str, provider: str) -> List[dict]:
         the last chunk to create one holistic product name and description from the complete information. You will not add any suggestions , comments or notes to the response, just give the summarized paragraph containing keywords that would help in the final analysis.
         """
 
-        composition_prompt = f"""
+
+def composition_prompt_for(
+    chunk: str, composition_information_extracted: Optional[str] = None, candidate_chemicals: Optional[List[str]] = None
+) -> str:
+    """
+    Per chunk functional role / chemical / weight prompt.
+    :param composition_information_extracted: Roles found in the previous chunks (sequential mode), None for a map prompt.
+    :param candidate_chemicals: Known ingredients found in the chunk by the ingredient matcher, given as hints.
+    """
+    context = f"""
         ### Functional Role Extracted Till Now:
         {composition_information_extracted}
-
+""" if composition_information_extracted is not None else ""
+    if candidate_chemicals:
+        context += f"""
+        ### Candidate Chemicals (known ingredients mentioned in the chunk, other chemicals may be listed too):
+        {", ".join(candidate_chemicals)}
+"""
+    avoid_repeating = ' Avoid repeating information already extracted in "Functional Role Extracted Till Now."' if composition_information_extracted is not None else ""
+    return f"""{context}
         ### New Chunk:
         {chunk}
 
@@ -758,11 +660,12 @@ async def product_discovery_workflow(data: str, provider: str) -> List[dict]:
         Functional Role: <Role Name>
         - Chemical: <Chemical Name>, Weight: <Percentage or Range>
 
-        If no relevant information is found, respond with a message saying **"No New Functional roles found"** exactly and nothing else. Avoid repeating information already extracted in "Functional Role Extracted Till Now." Do not provide any comments, notes, or suggestions. Only provide the extracted data in the specified format.
+        If no relevant information is found, respond with a message saying **"No New Functional roles found"** exactly and nothing else.{avoid_repeating} Do not provide any comments, notes, or suggestions. Only provide the extracted data in the specified format.
         """
 
-        # Format prompt and injecting contextual data to improve answer quality to include previous context and the current chunk
-        output_format = """
+
+def document_prompt_for(chunk: str) -> str:
+    output_format = """
         {
         "patent": {
             "patent_no": "OA06243",
@@ -773,7 +676,7 @@ async def product_discovery_workflow(data: str, provider: str) -> List[dict]:
         }
         """
 
-        document_prompt = f"""
+    return f"""
         ### New Chunk:
         {chunk}
 
@@ -782,6 +685,157 @@ async def product_discovery_workflow(data: str, provider: str) -> List[dict]:
         {output_format}
         """
 
+
+def candidate_chemicals_for(chunk: str, section: str) -> Optional[List[str]]:
+    """
+    Known ingredients of a chunk that can list a formulation.
+    :return: The ingredients found, an empty list when the composition prompt can be skipped (a formulation
+             section without any known ingredient, or a section that never lists one), None without a dictionary.
+    """
+    if section not in FORMULATION_SECTIONS:
+        return []
+    matcher = get_ingredient_matcher() if INGREDIENT_PREFILTER else None
+    if not matcher:
+        return None
+    return matcher.find(chunk)
+
+
+def relevance_gate_allows(task: str, chunk: str) -> bool:
+    """
+    False when the relevance gate is confident the prompt of the task finds nothing in the chunk.
+    """
+    gate = get_relevance_gate()
+    return gate is None or gate.should_call(task, chunk)
+
+
+async def record_chunk_outcome(task: str, chunk: str, response: Any, nothing_found: str) -> None:
+    # Outcome of a call, the training data of the relevance gate. Failed calls say nothing about the chunk.
+    # Only the context free map prompts are recorded: a sequential prompt carries what was extracted so far, its
+    # "nothing found" means nothing new, not an irrelevant chunk.
+    if isinstance(response, str) and is_cacheable(response):
+        await asyncio.to_thread(record_outcome, task, chunk, is_extracted(response, nothing_found))
+
+
+async def document_details(chunk: str, provider: str) -> Optional[Dict[str, Any]]:
+    """
+    Patent details of the first chunk. They are read from the front page by extract_patent_metadata, the LLM is
+    only asked (and only fills the fields the rules missed) when the extraction is not confident enough.
+    :return: The PatentDocument dict, or None when the LLM call failed.
+    """
+    metadata = extract_patent_metadata(chunk)
+    if metadata.confidence >= PATENT_METADATA_CONFIDENCE:
+        print(f"Document details read from the front page (confidence {metadata.confidence})")
+        return metadata.document()
+    print(f"Front page metadata confidence {metadata.confidence}, asking the LLM for the document details")
+    document = await cached_chunk_result(
+        chunk, DOCUMENT_DETAILS_TEMPLATE, provider_model(provider), lambda: structured_dict(document_prompt_for(chunk), provider, PatentDocument)
+    )
+    if document is None:
+        return None
+    return metadata.document(fallback=document)
+
+
+def finalize_product_information(
+    document_information_extracted: Dict[str, Any],
+    name_description_info: Optional[Dict[str, str]],
+    functional_roles_info: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    # Call the cleaner and get document information.
+    document_info = extract_document_details(document_information_extracted)
+
+    # Finalize extracted information
+    finalized_information = {
+        "patent_no": document_info.get("patent_no"),
+        "inventor_names": document_info.get("inventor_name"),
+        "cpcc_codes": document_info.get("cpcc_codes"),
+        "assignee_information": document_info.get("assignee_information"),
+        "product_name": name_description_info.get("name") if name_description_info else None,
+        "description": name_description_info.get("description") if name_description_info else None,
+        "functional_roles": functional_roles_info.get("functional_roles") if functional_roles_info else None
+    }
+
+    print(finalized_information)
+    return finalized_information
+
+
+async def product_discovery_workflow(
+    data: Union[str, AsyncIterator[str]], provider: str, mode: Optional[str] = None, job_id: Optional[str] = None
+) -> List[dict]:
+    """
+    Build the product report (document details, product name and description, composition) of a patent.
+    :param data: The patent text, or an async stream of it.
+    :param provider: The provider name (e.g., "ollama", "openai", "groq").
+    :param mode: "map_reduce" (chunks extracted independently in parallel, then reduced) or "sequential"
+                 (every chunk prompt carries everything extracted so far). PRODUCT_DISCOVERY_MODE by default.
+    :param job_id: Checkpoint the run in the job store under this id. Running the same job again resumes it:
+                   completed chunks are not sent to the LLM again and a done job returns its stored result.
+                   A run with failed chunks still returns its report, but leaves the job "failed" and resumable.
+    """
+    mode = mode or PRODUCT_DISCOVERY_MODE
+    if mode not in ("sequential", "map_reduce"):
+        raise ValueError(f"Unsupported product discovery mode: {mode}")
+
+    store = get_job_store() if job_id else None
+    if store:
+        job = store.get_job(job_id)
+        if job is None:
+            store.create_job("product_discovery", {"provider": provider, "mode": mode}, job_id=job_id)
+        elif job["status"] == "done":
+            print(f"Job {job_id} already done")
+            return job["result"]
+
+    try:
+        if mode == "sequential":
+            finalized_information = await sequential_product_discovery_workflow(data, provider, job_id)
+        else:
+            finalized_information = await map_reduce_product_discovery_workflow(data, provider, job_id)
+    except Exception as e:
+        # A job of the job runner is failed by the runner
+        if store and not run_by_job_runner(job_id):
+            store.fail_job(job_id, str(e))
+        raise
+    return finalized_information
+
+
+async def sequential_product_discovery_workflow(
+    data: Union[str, AsyncIterator[str]], provider: str, job_id: Optional[str] = None
+) -> List[dict]:
+    print("Process Started with the patent text")
+    checkpoints = await JobCheckpoints.load(job_id)
+    await checkpoints.stage("chunks")
+    if INGREDIENT_PREFILTER:
+        # Built once per process, off the event loop
+        await asyncio.to_thread(get_ingredient_matcher)
+    composition_calls_skipped = 0
+    relevance_calls_skipped = Counter()
+    # Stops the prompts once they stop finding new facts, and tracks the prompt tokens against the token budget
+    convergence = make_convergence_policy([NAME_DESCRIPTION_TASK, COMPOSITION_TASK])
+
+    # Section-aware chunks (claims, description, examples, tables) with overlap, so ingredients are not cut in half.
+    # A streamed document is chunked as it arrives.
+    patent_chunks = aiter_patent_chunks(data, max_allowed_token_length())
+
+    # results = []
+    keywords = KeywordAccumulator()  # Accumulator
+    composition = CompositionAccumulator()  # Accumulator
+    document_information_extracted = {} # Accumulator
+
+    print("Starting chunkwise processing")
+
+    i = 0
+    async for patent_chunk in patent_chunks:
+        i += 1
+        chunk = patent_chunk.text
+        print(f"\nProcessing Chunk {i} ({patent_chunk.section}):")
+
+        # Format prompt and injecting contextual data to improve answer quality to include previous context and the current chunk
+        # Only the most recent facts are rendered into the prompts, the accumulators dedup everything anyway
+        information_extracted = keywords.render(limit=NAME_DESCRIPTION_CONTEXT_WORDS)
+        composition_information_extracted = composition.render(weights=False, limit=COMPOSITION_CONTEXT_CHEMICALS)
+        prompt = name_description_prompt(chunk, information_extracted)
+        candidate_chemicals = candidate_chemicals_for(chunk, patent_chunk.section)
+        composition_prompt = composition_prompt_for(chunk, composition_information_extracted, candidate_chemicals)
+
         # Log token usage for name and description
         tokens_in_prompt = num_tokens_from_string(prompt)
         tokens_information_extracted = num_tokens_from_string(information_extracted)
@@ -794,23 +848,71 @@ async def product_discovery_workflow(data: str, provider: str) -> List[dict]:
         print(f"Tokens sent for Chunk {i}: {tokens_in_prompt_2}")
         print(f"information_extracted tokens sent for Chunk {i} {tokens_information_extracted_2}")
 
-        # Process the starting chunks of patents for document details - No. of Api calls 2 maximum.
-        if i < 2 : # The logic needs to be more strict so that document chunk is queries for.
-            document_information_extracted = await process(document_prompt, provider)
-            print(f"Document Chunk {i} processed response: {document_information_extracted}")
+        # Answers of a chunk completed in a previous run of the job are replayed into the accumulators
+        checkpoint = checkpoints.get(i, chunk)
+        # Prompts sent (or replayed) for the chunk, and their prompt tokens
+        sent_tasks = [NAME_DESCRIPTION_TASK, COMPOSITION_TASK]
+        tokens_sent = 0
+        if checkpoint is not None:
+            print(f"Chunk {i} resumed from job checkpoint")
+            document, processedChunk, processedChunk_2 = checkpoint["document"], checkpoint["summary"], checkpoint["composition"]
+            if document is not None:
+                document_information_extracted = document
+        else:
+            sent_tasks = []
+            document = None
+            # Document details are on the front page of the patent, the LLM is only called when the rules can't read them
+            if i < 2 :
+                document = await document_details(chunk, provider)
+                if document is not None:
+                    document_information_extracted = document
+                print(f"Document Chunk {i} processed response: {document_information_extracted}")
         
-        # Process the chunk for name and description information Here - No. of Api calls ~ No. of Chunks
-        processedChunk = await process(prompt, provider)
-        print(f"Chunk {i} processed response: {processedChunk}")
-
-        # Process the chunk for functional_role and ingredient analysis - No. of Api calls ~ No. of chunks
-        processedChunk_2 = await process(composition_prompt, provider)
-        print(f"Chunk {i} processed response: {processedChunk_2}")
+            # Process the chunk for name and description information Here - No. of Api calls ~ No. of Chunks
+            # The prompt carries the context extracted so far, so the whole prompt is the cache key
+            if not convergence.active(NAME_DESCRIPTION_TASK):
+                processedChunk = "No new information found"
+            elif relevance_gate_allows(NAME_DESCRIPTION_TASK, chunk):
+                processedChunk = await cached_chunk_result(
+                    prompt, NAME_DESCRIPTION_TEMPLATE, provider_model(provider), lambda: process(prompt, provider)
+                )
+                sent_tasks.append(NAME_DESCRIPTION_TASK)
+                tokens_sent += tokens_in_prompt
+            else:
+                relevance_calls_skipped[NAME_DESCRIPTION_TASK] += 1
+                processedChunk = "No new information found"
+            print(f"Chunk {i} processed response: {processedChunk}")
+
+            # Process the chunk for functional_role and ingredient analysis - No. of Api calls ~ No. of chunks with ingredients
+            if candidate_chemicals is None or candidate_chemicals:
+                if not convergence.active(COMPOSITION_TASK):
+                    processedChunk_2 = "No New Functional roles found"
+                elif relevance_gate_allows(COMPOSITION_TASK, chunk):
+                    processedChunk_2 = await cached_chunk_result(
+                        composition_prompt, COMPOSITION_TEMPLATE, provider_model(provider), lambda: process(composition_prompt, provider)
+                    )
+                    sent_tasks.append(COMPOSITION_TASK)
+                    tokens_sent += tokens_in_prompt_2
+                else:
+                    relevance_calls_skipped[COMPOSITION_TASK] += 1
+                    processedChunk_2 = "No New Functional roles found"
+                print(f"Chunk {i} processed response: {processedChunk_2}")
+            else:
+                # Background, summary, abstract, ... never list the formulation of the product, and a chunk
+                # without any known ingredient has nothing to extract
+                composition_calls_skipped += patent_chunk.section in FORMULATION_SECTIONS
+                processedChunk_2 = "No New Functional roles found"
+            if is_cacheable(processedChunk) and is_cacheable(processedChunk_2) and (i >= 2 or document is not None):
+                await checkpoints.save(i, chunk, {"document": document, "summary": processedChunk, "composition": processedChunk_2})
+            else:
+                checkpoints.fail(i)
 
 
         # Check if new information exists and append unique parts
+        new_words, added = [], 0
         if "No new information found" not in processedChunk:
-            information_extracted = information_checker(information_extracted, processedChunk)
+            new_words = keywords.add(processedChunk)
+            print("New unique words added:", new_words)
         else:
             print(f"No new information found in Chunk {i}")
 
@@ -819,21 +921,31 @@ async def product_discovery_workflow(data: str, provider: str) -> List[dict]:
         if "No New Functional roles found" in processedChunk_2:
             print(f"No new functional roles found in Chunk {i}. Skipping appending to information_extracted_2.")
         else:
-            # Directly append the new functional roles to the existing extracted information
-            print(f"Appending new functional roles from Chunk {i}.")
-            composition_information_extracted += f" {processedChunk_2.strip()}"
-
-        # Break the loop if the token count exceeds the maximum limit
-        if total_token_count > max_tokens_per_chunk:
-            print("Token limit exceeded, stopping chunk processing.")
+            added = composition.add_text(processedChunk_2)
+            print(f"Added {added} new functional role facts from Chunk {i}.")
+
+        # Break the loop once no prompt is worth sending anymore, or the token budget is spent
+        new_facts = {NAME_DESCRIPTION_TASK: len(new_words), COMPOSITION_TASK: added}
+        convergence.observe({task: new_facts[task] for task in sent_tasks}, tokens_sent)
+        if convergence.stopped:
+            print(f"Extraction converged after Chunk {i}, stopping chunk processing.")
             break
 
+    print("Number of chunks created from the text:", i)
+    print("Composition calls skipped by the ingredient matcher:", composition_calls_skipped)
+    print("Calls skipped by the relevance gate:", dict(relevance_calls_skipped))
+    print("Convergence:", convergence.report())
+
+    information_extracted = keywords.render()
+    composition_information_extracted = composition.render()
     print("\nFinal Information Extracted from all the text:")
     print(information_extracted)
 
     print("\nFinal Composition Information Extracted from all the text:")
     print(composition_information_extracted)
 
+    await checkpoints.stage("reduce")
+
     # Call extract_name_description to finalize the output
     name_description_info = await extract_name_description(information_extracted, provider)
     print("\nFinalized Product Name and Description:")
@@ -842,23 +954,232 @@ async def product_discovery_workflow(data: str, provider: str) -> List[dict]:
     # Call extract_name_description to finalize the output
     functional_roles_info = await final_composition_information(composition_information_extracted, provider)
 
+    finalized_information = finalize_product_information(
+        document_information_extracted, name_description_info, functional_roles_info
+    )
+    await checkpoints.complete(finalized_information)
+    return finalized_information
 
-    # Call the cleaner and get document information.
-    document_info = extract_document_details(document_information_extracted)
 
-    # Finalize extracted information
-    finalized_information = {
-        "patent_no": document_info.get("patent_no"),
-        "inventor_names": document_info.get("inventor_name"),
-        "cpcc_codes": document_info.get("cpcc_codes"),
-        "assignee_information": document_info.get("assignee_information"),
-        "product_name": name_description_info.get("name") if name_description_info else None,
-        "description": name_description_info.get("description") if name_description_info else None,
-        "functional_roles": functional_roles_info.get("functional_roles") if functional_roles_info else None
-    }
 
-    print(finalized_information)
-    return finalized_information
+
+def is_extracted(response: str, nothing_found: str) -> bool:
+    # Failed calls and "nothing found" answers carry no information for the reduce step
+    return bool(response.strip()) and nothing_found not in response and not response.startswith("Error:")
+
+
+def group_by_token_budget(texts: List[str], token_budget: int) -> List[str]:
+    """
+    Pack texts, in order, into groups of at most token_budget tokens (a text larger than the budget is its own group).
+    :return: The groups, every group joined into one string.
+    """
+    groups = []
+    current, current_tokens = [], 0
+    for text in texts:
+        tokens = num_tokens_from_string(text)
+        if current and current_tokens + tokens > token_budget:
+            groups.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        groups.append("\n".join(current))
+    return groups
+
+
+async def condense_keywords(keywords: str, provider: str) -> str:
+    prompt = f"""
+    ### Extracted Information:
+    {keywords}
+
+    ### Instruction:
+    You are a data scientist working for a company that is building a report for a cosmetic patent document. The extracted information are keywords about the product name and description gathered from parts of the patent. Merge them into no more than **50 keywords or tokens**, removing duplicates and keeping the words that best describe the product. You will not add any suggestions , comments or notes to the response, just give the keywords.
+    """
+    return await process(prompt, provider)
 
 
+async def reduce_name_description(summaries: List[str], provider: str) -> Optional[Dict[str, str]]:
+    """
+    Reduce step of the product name and description. Keywords of all the chunks that don't fit one call are
+    condensed group by group in parallel, until they fit (hierarchical reduce for long documents).
+    :param summaries: The map outputs, in chunk order.
+    """
+    groups = group_by_token_budget(summaries, MAP_REDUCE_TOKEN_BUDGET)
+    level = 0
+    while len(groups) > 1 and level < MAP_REDUCE_MAX_LEVELS:
+        level += 1
+        print(f"Condensing {len(groups)} keyword groups, level {level}")
+        condensed = await asyncio.gather(*(condense_keywords(group, provider) for group in groups))
+        groups = group_by_token_budget(
+            [keywords for keywords in condensed if keywords and not keywords.startswith("Error:")], MAP_REDUCE_TOKEN_BUDGET
+        )
+    return await extract_name_description("\n".join(groups), provider)
+
+
+async def reduce_composition(compositions: List[str], provider: str) -> Optional[Dict[str, Any]]:
+    """
+    Reduce step of the composition. The map outputs are deduplicated into a CompositionAccumulator, then finalized
+    with one final_composition_information call per token budget group, in parallel, and the reports merged.
+    :param compositions: The map outputs of the formulation chunks, in chunk order.
+    """
+    composition = CompositionAccumulator()
+    for text in compositions:
+        composition.add_text(text)
+    groups = group_by_token_budget(composition.render().splitlines(), MAP_REDUCE_TOKEN_BUDGET) or [""]
+    reports = [report for report in await asyncio.gather(
+        *(final_composition_information(group, provider) for group in groups)
+    ) if report]
+    if not reports:
+        return None
+    merged = CompositionAccumulator()
+    for report in reports:
+        merged.add_report(report)
+    return merged.to_report()
+
+
+async def map_reduce_product_discovery_workflow(
+    data: Union[str, AsyncIterator[str]], provider: str, job_id: Optional[str] = None
+) -> List[dict]:
+    """
+    Map: every chunk is summarized and its composition extracted on its own, up to EXTRACTION_CONCURRENCY
+    chunks in parallel and cached by chunk. Reduce: the per chunk outputs are combined by
+    reduce_name_description and reduce_composition.
+    :param job_id: Job whose completed chunks are checkpointed, and skipped when the job is resumed.
+    """
+    print("Process Started with the patent text")
+    model = provider_model(provider)
+    checkpoints = await JobCheckpoints.load(job_id)
+    await checkpoints.stage("map")
+    semaphore = asyncio.Semaphore(max(1, EXTRACTION_CONCURRENCY))
+    if INGREDIENT_PREFILTER:
+        # Built once per process, off the event loop
+        await asyncio.to_thread(get_ingredient_matcher)
+    composition_calls_skipped = 0
+    relevance_calls_skipped = Counter()
+    # Stops the prompts once they stop finding new facts, and tracks the prompt tokens against the token budget
+    convergence = make_convergence_policy([NAME_DESCRIPTION_TASK, COMPOSITION_TASK])
+    # Facts seen so far, to count what every chunk adds. Chunks finish out of order, they are observed in chunk order.
+    keywords, composition_facts = KeywordAccumulator(), CompositionAccumulator()
+    finished: Dict[int, Tuple[Dict[str, Any], List[str], int]] = {}
+    next_observed = 1
+
+    def observe_finished(i: int, output: Dict[str, Any], sent_tasks: List[str], tokens_sent: int) -> None:
+        nonlocal next_observed
+        finished[i] = (output, sent_tasks, tokens_sent)
+        while next_observed in finished:
+            output, sent_tasks, tokens_sent = finished.pop(next_observed)
+            new_facts = {
+                NAME_DESCRIPTION_TASK: len(keywords.add(output["summary"])) if output["summary"] else 0,
+                COMPOSITION_TASK: composition_facts.add_text(output["composition"]) if output["composition"] else 0,
+            }
+            convergence.observe({task: new_facts[task] for task in sent_tasks}, tokens_sent)
+            next_observed += 1
+
+    async def map_chunk(i: int, chunk: str, section: str) -> Dict[str, Any]:
+        nonlocal composition_calls_skipped
+        print(f"\nProcessing Chunk {i} ({section}):")
+        checkpoint = checkpoints.get(i, chunk)
+        if checkpoint is not None:
+            print(f"Chunk {i} resumed from job checkpoint")
+            observe_finished(i, checkpoint, [NAME_DESCRIPTION_TASK, COMPOSITION_TASK], 0)
+            return checkpoint
+
+        candidate_chemicals = candidate_chemicals_for(chunk, section)
+        with_composition = candidate_chemicals is None or bool(candidate_chemicals)
+        prompt = name_description_prompt(chunk)
+        composition_prompt = composition_prompt_for(chunk, candidate_chemicals=candidate_chemicals)
+
+        calls = {}
+        sent_tasks, tokens_sent = [], 0
+        if convergence.active(NAME_DESCRIPTION_TASK):
+            if relevance_gate_allows(NAME_DESCRIPTION_TASK, chunk):
+                calls["summary"] = cached_chunk_result(chunk, NAME_DESCRIPTION_MAP_TEMPLATE, model, lambda: process(prompt, provider))
+                sent_tasks.append(NAME_DESCRIPTION_TASK)
+                tokens_sent += num_tokens_from_string(prompt)
+            else:
+                relevance_calls_skipped[NAME_DESCRIPTION_TASK] += 1
+        # Background, summary, abstract, ... never list the formulation of the product, and a chunk without
+        # any known ingredient has nothing to extract
+        if not with_composition:
+            composition_calls_skipped += section in FORMULATION_SECTIONS
+        elif convergence.active(COMPOSITION_TASK):
+            if relevance_gate_allows(COMPOSITION_TASK, chunk):
+                calls["composition"] = cached_chunk_result(
+                    chunk, COMPOSITION_MAP_TEMPLATE, model, lambda: process(composition_prompt, provider)
+                )
+                sent_tasks.append(COMPOSITION_TASK)
+                tokens_sent += num_tokens_from_string(composition_prompt)
+            else:
+                relevance_calls_skipped[COMPOSITION_TASK] += 1
+        # The document details are on the first page
+        if i == 1:
+            calls["document"] = document_details(chunk, provider)
+        results = dict(zip(calls, await asyncio.gather(*calls.values(), return_exceptions=True)))
+        failed = False
+        for result in results.values():
+            if isinstance(result, Exception):
+                logging.error(f"Chunk {i} failed: {result}")
+            failed = failed or isinstance(result, Exception) or not is_cacheable(result)
+
+        summary = results.get("summary")
+        composition = results.get("composition")
+        document = results.get("document")
+        await record_chunk_outcome(NAME_DESCRIPTION_TASK, chunk, summary, "No new information found")
+        await record_chunk_outcome(COMPOSITION_TASK, chunk, composition, "No New Functional roles found")
+        print(f"Chunk {i} processed response: {summary}")
+        output = {
+            "summary": summary if isinstance(summary, str) and is_extracted(summary, "No new information found") else None,
+            "composition": composition if isinstance(composition, str) and is_extracted(composition, "No New Functional roles found") else None,
+            "document": document if isinstance(document, dict) else None,
+        }
+        # A failed call is retried when the job is resumed
+        if failed:
+            checkpoints.fail(i)
+        else:
+            await checkpoints.save(i, chunk, output)
+        observe_finished(i, output, sent_tasks, tokens_sent)
+        return output
 
+    async def bounded_map_chunk(i: int, chunk: str, section: str) -> Dict[str, Any]:
+        try:
+            return await map_chunk(i, chunk, section)
+        finally:
+            semaphore.release()
+
+    tasks = []
+    try:
+        async for patent_chunk in aiter_patent_chunks(data, max_allowed_token_length()):
+            await semaphore.acquire()
+            # The chunks left are not read once no prompt is worth sending anymore, or the token budget is spent
+            if convergence.stopped:
+                semaphore.release()
+                print(f"Extraction converged after Chunk {convergence.chunks}, stopping chunk processing.")
+                break
+            tasks.append(asyncio.create_task(bounded_map_chunk(len(tasks) + 1, patent_chunk.text, patent_chunk.section)))
+        mapped = list(await asyncio.gather(*tasks))
+    finally:
+        for task in tasks:
+            task.cancel()
+    print("Number of chunks created from the text:", len(mapped))
+    print("Chunks resumed from job checkpoints:", checkpoints.resumed)
+    print("Composition calls skipped by the ingredient matcher:", composition_calls_skipped)
+    print("Calls skipped by the relevance gate:", dict(relevance_calls_skipped))
+    print("Convergence:", convergence.report())
+    await checkpoints.stage("reduce")
+
+    summaries = [chunk["summary"].strip() for chunk in mapped if chunk["summary"]]
+    compositions = [chunk["composition"].strip() for chunk in mapped if chunk["composition"]]
+    document_information_extracted = next((chunk["document"] for chunk in mapped if chunk["document"]), {})
+
+    name_description_info, functional_roles_info = await asyncio.gather(
+        reduce_name_description(summaries, provider),
+        reduce_composition(compositions, provider),
+    )
+    print("\nFinalized Product Name and Description:")
+    print(name_description_info)
+
+    finalized_information = finalize_product_information(
+        document_information_extracted, name_description_info, functional_roles_info
+    )
+    await checkpoints.complete(finalized_information)
+    return finalized_information
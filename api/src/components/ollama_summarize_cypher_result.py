@@ -1,6 +1,8 @@
 import httpx
 from typing import Any, Awaitable, Callable, Dict, List
 
+from llm.ollamaapi import iter_ollama_stream
+
 system = f"""
 You are an assistant that helps to generate text to form nice and human understandable answers based on some contextual information.
 The latest prompt contains the information, and you need to generate a human readable response based on the given information.
@@ -52,14 +54,16 @@ class OllamaSummarizeCypherResult:
         callback: Callable[[str], Awaitable[Any]] = None,
     ) -> str:
         """
-        Sends the prompt to Ollama's endpoint and returns the streaming response.
+        Sends the prompt to Ollama's endpoint and streams the answer token by token.
+        Each token is handed to the callback as soon as the model emits it.
         """
         print("The db context and question asked again")
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0)) as client:
             payload = {
                 "model": "auto",  # Specify the model
                 "system_message": system,
                 "prompt":self.generate_user_prompt(question, results),
+                "stream": True,
             }
 
             async with client.stream("POST", "http://localhost:7860/ollama/chat", json=payload) as response:
@@ -67,10 +71,10 @@ class OllamaSummarizeCypherResult:
                     raise ValueError(f"Error from Ollama: {await response.aread()}")
 
                 output = []
-                async for line in response.aiter_lines():
+                async for token in iter_ollama_stream(response):
                     if callback:
-                        await callback(line)
-                    output.append(line)
+                        await callback(token)
+                    output.append(token)
 
                 return "".join(output)
 
@@ -0,0 +1,161 @@
+import asyncio
+import re
+import unittest
+from unittest.mock import patch
+
+from components.unit_test_helpers import WordEncoding, import_prompt_creator
+
+prompt_creator = import_prompt_creator()
+
+# 6 chunks of about 800 words, one sentence per word
+DOCUMENT = " ".join(f"Chemical{i}." for i in range(4800))
+
+
+def first_chemical(prompt):
+    return re.search(r"Chemical\d+", prompt).group(0)
+
+
+class FakeExtraction:
+    """
+    Stand-in for structured_dict, answering with one node named after the first chemical of the chunk.
+    Earlier chunks take longer, so chunks complete out of order.
+    """
+
+    def __init__(self, failing=None):
+        self.failing = failing
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+
+    async def __call__(self, prompt, provider, response_model, system_message=None):
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            name = first_chemical(prompt)
+            await asyncio.sleep(0.05 / self.calls)
+            if name == self.failing:
+                raise RuntimeError("timeout")
+            return {"nodes": [{"name": name, "label": "Chemical", "properties": {}}], "relationships": []}
+        finally:
+            self.in_flight -= 1
+
+
+class SlowLLM:
+    """
+    Stand-in for the OpenAI client, taking 0.1s to answer.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def generate(self, messages):
+        raise AssertionError("the blocking client stalls the event loop")
+
+    async def agenerate(self, messages):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.1)
+            return f"Summary of {messages[0]['content']}"
+        finally:
+            self.in_flight -= 1
+
+
+async def uncached(text, template, model, compute):
+    return await compute()
+
+
+class TestParallelExtraction(unittest.TestCase):
+
+    def extract(self, fake, data=DOCUMENT, concurrency=None):
+        with patch.object(prompt_creator, "structured_dict", fake), \
+                patch.object(prompt_creator, "cached_chunk_result", uncached), \
+                patch("tiktoken.get_encoding", return_value=WordEncoding()):
+            return asyncio.run(prompt_creator.run_with_chunk_logging(data, "openai", concurrency))
+
+    def test_chunks_are_extracted_concurrently_up_to_the_limit(self):
+        fake = FakeExtraction()
+        result, chunks = self.extract(fake, concurrency=2)
+
+        self.assertEqual(fake.calls, len(chunks))
+        self.assertGreater(len(chunks), 2)
+        self.assertEqual(fake.max_in_flight, 2)
+        # Merged in chunk order, not completion order
+        self.assertEqual([node["name"] for node in result["nodes"]], [first_chemical(c["input_chunk_text"]) for c in chunks])
+        self.assertEqual([c["chunk_number"] for c in chunks], list(range(1, len(chunks) + 1)))
+
+    def test_concurrency_of_one_is_sequential(self):
+        fake = FakeExtraction()
+        self.extract(fake, concurrency=1)
+
+        self.assertEqual(fake.max_in_flight, 1)
+
+    def test_failing_chunk_only_loses_its_own_results(self):
+        fake = FakeExtraction(failing="Chemical0")
+        with self.assertLogs(level="ERROR"):
+            result, chunks = self.extract(fake, concurrency=4)
+
+        self.assertEqual(chunks[0]["chunk_result_nodes"], [])
+        self.assertEqual(len(result["nodes"]), len(chunks) - 1)
+
+    def test_streamed_document(self):
+        async def stream():
+            for start in range(0, len(DOCUMENT), 1000):
+                yield DOCUMENT[start:start + 1000]
+
+        fake = FakeExtraction()
+        result, chunks = self.extract(fake, stream(), concurrency=3)
+
+        self.assertLessEqual(fake.max_in_flight, 3)
+        self.assertEqual(len(result["nodes"]), len(chunks))
+        self.assertNotIn("input_chunk_text", chunks[0])
+
+
+class TestMapCalls(unittest.TestCase):
+
+    def test_openai_map_calls_overlap(self):
+        llm = SlowLLM()
+
+        async def map_stage():
+            return await asyncio.gather(*(prompt_creator.process(f"Chunk {i}", "openai") for i in range(4)))
+
+        with patch.object(prompt_creator, "llm", llm), patch("tiktoken.get_encoding", return_value=WordEncoding()):
+            outputs = asyncio.run(map_stage())
+
+        self.assertEqual(outputs, [f"Summary of Chunk {i}" for i in range(4)])
+        self.assertEqual(llm.max_in_flight, 4)
+
+
+class TestRelevanceOutcomes(unittest.TestCase):
+
+    def discover(self, mode):
+        recorded = []
+
+        async def nothing_found(prompt, provider):
+            return "No new information found"
+
+        async def no_document(*args):
+            return None
+
+        with patch.object(prompt_creator, "process", nothing_found), \
+                patch.object(prompt_creator, "structured_dict", no_document), \
+                patch.object(prompt_creator, "structured_generate", no_document), \
+                patch.object(prompt_creator, "cached_chunk_result", uncached), \
+                patch.object(prompt_creator, "relevance_gate_allows", lambda task, chunk: True), \
+                patch.object(prompt_creator, "record_outcome", lambda *outcome: recorded.append(outcome)), \
+                patch.object(prompt_creator, "INGREDIENT_PREFILTER", False), \
+                patch("tiktoken.get_encoding", return_value=WordEncoding()):
+            asyncio.run(prompt_creator.product_discovery_workflow(DOCUMENT, "openai", mode=mode))
+        return recorded
+
+    def test_only_map_prompts_train_the_relevance_gate(self):
+        # A sequential "nothing found" only means nothing new compared with the earlier chunks
+        self.assertEqual(self.discover("sequential"), [])
+        recorded = self.discover("map_reduce")
+        self.assertEqual({task for task, _, _ in recorded}, {"name_description", "composition"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from utils.patent_metadata import extract_patent_metadata, find_patent_number
+
+USPTO_FRONT_PAGE = (
+    "DOCUMENT ID  US 20240398687 A1  DATE  PUBLISHED  2024-12-05  INVENTOR INFORMATION  NAME   CITY   STATE   "
+    "ZIP CODE   COUNTRY  HSIEH; I-fan   Scotch Plains   NJ   N/A   US  HARIHARAN; Ramakrishnan   Springfield   NJ   "
+    "N/A   US  ASSIGNEE INFORMATION  NAME  L’ORÉAL  CITY  Paris  STATE  N/A  ZIP CODE  N/A  COUNTRY  FR  TYPE CODE  03  "
+    "APPLICATION NO  18/679749  DATE FILED  2024-05-31  CPC CURRENT  TYPE   CPC   DATE  CPCI   A   61   Q   3 / 02   "
+    "2013-01-01  CPCI   A   61   K   8 / 87   2013-01-01  CPCA   A   61   K   2800 / 95   2013-01-01  "
+    "HYBRID NAIL COMPOSITION  DOMESTIC PRIORITY (CONTINUITY DATA)  us-provisional-application US 63469992 20230531"
+)
+
+INID_FRONT_PAGE = """(12) United States Patent
+(10) Patent No.: US 7,123,456 B2
+(72) Inventors: Jane Doe, Paris (FR); John Smith, Clark, NJ (US)
+(73) Assignee: L'Oreal, Paris (FR)
+(52) U.S. Cl.
+CPC ........ A61K 8/87 (2013.01); A61Q 19/00 (2013.01)
+
+BACKGROUND OF THE INVENTION
+"""
+
+
+class TestPatentMetadata(unittest.TestCase):
+
+    def test_uspto_full_text_front_page(self):
+        metadata = extract_patent_metadata(USPTO_FRONT_PAGE)
+
+        self.assertEqual(metadata.patent_no, "US 20240398687 A1")
+        self.assertEqual(metadata.inventor_name, ["HSIEH; I-fan", "HARIHARAN; Ramakrishnan"])
+        self.assertEqual(metadata.assignee_information, "L’ORÉAL")
+        self.assertEqual(metadata.cpcc_codes, ["A61Q 3/02", "A61K 8/87", "A61K 2800/95"])
+        self.assertEqual(metadata.confidence, 1.0)
+
+    def test_inid_front_page(self):
+        metadata = extract_patent_metadata(INID_FRONT_PAGE)
+
+        self.assertEqual(metadata.patent_no, "US 7123456 B2")
+        self.assertEqual(metadata.inventor_name, ["Jane Doe", "John Smith"])
+        self.assertEqual(metadata.assignee_information, "L'Oreal")
+        self.assertEqual(metadata.cpcc_codes, ["A61K 8/87", "A61Q 19/00"])
+
+    def test_low_confidence_is_completed_by_the_fallback(self):
+        metadata = extract_patent_metadata("US 1234567 B2\nInventors: Jane Doe\n\nBACKGROUND")
+
+        self.assertLess(metadata.confidence, 0.8)
+        document = metadata.document(fallback={"patent": {"patent_no": "OA06243", "assignee_information": "Loreal"}})
+        self.assertEqual(document["patent"]["patent_no"], "US 1234567 B2")
+        self.assertEqual(document["patent"]["assignee_information"], "Loreal")
+        self.assertEqual(find_patent_number("show WO2019123456A1 and EP 1 234 567 B1"), "WO 2019/123456 A1")
+
+
+if __name__ == "__main__":
+    unittest.main()
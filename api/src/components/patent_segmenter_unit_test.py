@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+
+from components.unit_test_helpers import WordEncoding
+from utils.patent_segmenter import FORMULATION_SECTIONS, astream_patent_chunks, chunk_patent, segment_patent
+
+PATENT = """US 1234567 B2
+Inventors: Jane Doe
+
+BACKGROUND OF THE INVENTION
+Moisturizers are known in the art.
+
+DETAILED DESCRIPTION
+The composition comprises a humectant and an emollient.
+
+Table 1
+Glycerin        20%
+Dimethicone     15%
+
+EXAMPLES
+Example 1 was prepared by mixing glycerin with water at room temperature.
+
+What is claimed is:
+1. A composition comprising 5-20% glycerin.
+"""
+
+
+class TestPatentSegmenter(unittest.TestCase):
+
+    def test_sections_follow_headings(self):
+        sections = segment_patent(PATENT)
+
+        self.assertEqual(
+            [section.name for section in sections],
+            ["front", "background", "description", "table", "examples", "claims"],
+        )
+        self.assertIn("Dimethicone     15%", PATENT[sections[3].start:sections[3].end])
+
+    def test_chunks_are_tagged_and_keep_sections_apart(self):
+        chunks = chunk_patent(PATENT, 50, overlap_tokens=0, encoding=WordEncoding())
+
+        self.assertEqual(chunks[1].section, "background")
+        self.assertNotIn("background", FORMULATION_SECTIONS)
+        self.assertTrue(all("What is claimed" not in chunk.text for chunk in chunks if chunk.section != "claims"))
+        for chunk in chunks:
+            self.assertEqual(PATENT[chunk.start:chunk.end].strip(), chunk.text)
+
+    def test_small_sections_are_packed_with_their_tables(self):
+        text = "EXAMPLES\n" + "".join(
+            f"Example {i}\nA lotion was prepared by mixing the following ingredients at room temperature.\n\n"
+            f"Table {i}\nGlycerin        {i}%\nWater           {90 - i}%\n\n"
+            for i in range(1, 31)
+        )
+        chunks = chunk_patent(text, 200, overlap_tokens=0, encoding=WordEncoding())
+
+        # 30 examples and tables of 20 words in 200 word chunks, instead of 60 chunks
+        self.assertEqual(len(chunks), 4)
+        self.assertTrue(all(chunk.section == "examples" and chunk.token_count <= 200 for chunk in chunks))
+        for i in range(1, 31):
+            self.assertEqual(
+                [chunk for chunk in chunks if f"Example {i}\n" in chunk.text],
+                [chunk for chunk in chunks if f"Table {i}\n" in chunk.text],
+            )
+        for chunk in chunks:
+            self.assertEqual(text[chunk.start:chunk.end].strip(), chunk.text)
+
+        async def stream():
+            for start in range(0, len(text), 37):
+                yield text[start:start + 37]
+
+        async def collect():
+            return [chunk async for chunk in astream_patent_chunks(stream(), 200, overlap_tokens=0, encoding=WordEncoding())]
+
+        self.assertEqual(asyncio.run(collect()), chunks)
+
+    def test_stream_without_newlines_is_not_buffered_whole(self):
+        text = " ".join(f"word{i}." for i in range(5000))
+        sent = []
+
+        async def stream():
+            for start in range(0, len(text), 100):
+                sent.append(start + 100)
+                yield text[start:start + 100]
+
+        async def collect():
+            chunks = []
+            async for chunk in astream_patent_chunks(stream(), 50, overlap_tokens=0, encoding=WordEncoding()):
+                # Text received but not yielded yet: about two chunks, not the whole line
+                self.assertLess(min(sent[-1], len(text)) - chunk.end, 2 * 50 * 4 * 2)
+                chunks.append(chunk)
+            return chunks
+
+        chunks = asyncio.run(collect())
+
+        self.assertEqual(len(chunks), 100)
+        self.assertTrue(all(chunk.token_count <= 50 for chunk in chunks))
+        self.assertEqual(" ".join(chunk.text for chunk in chunks), text)
+
+if __name__ == "__main__":
+    unittest.main()
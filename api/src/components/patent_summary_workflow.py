@@ -4,6 +4,7 @@ import httpx
 from typing import Callable, List, Dict, Any
 import tiktoken
 import os
+from utils.chunking import split_text_to_token_budget
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -33,8 +34,8 @@ async def openai_generate(prompt: str) -> str:
     ]
     print(f"Sending request to OpenAI endpoint with messages: {messages}")
     
-    # Assuming `llm.generate()` is correctly configured to accept the messages
-    output = llm.generate(messages)
+    # The async client, so concurrent calls (e.g. the map stage) do not block the event loop
+    output = await llm.agenerate(messages)
     print("The output is:", output)
     return output
 
@@ -109,9 +110,6 @@ async def research_or_patent_classifier(chunk: str, provider: str) -> str:
 
     return classification_response
 
-def splitString(string, max_length) -> List[str]:
-    return [string[i : i + max_length] for i in range(0, len(string), max_length)]
-
 def num_tokens_from_string(string: str) -> int: 
     """
     Estimate the number of tokens in a string using the LLaMA tokenizer.
@@ -127,30 +125,8 @@ def splitDataIntoChunksOf(max_token_chunk_size: int, token_size_of_prompt_to_be_
     # So this allowed tokens is the bandwidth we have , we set a max allowed tokens for the chunk, and substract the input token size of the prompt to be used from it before only so that only the remaining space is filled.
     allowed_tokens = max_token_chunk_size - token_size_of_prompt_to_be_used
     print("The allowed tokens for the chunk is :", allowed_tokens)
-    chunked_data = splitString(data, 500)  # Split based on approximate length
-    print("The number of chunks created are :", len(chunked_data))
-
-    combined_chunks = []
-    current_chunk = ""
-    
-    for chunk in chunked_data:
-        # Calculate token count for the combined chunk
-        current_chunk_tokens = num_tokens_from_string(current_chunk)
-        chunk_tokens = num_tokens_from_string(chunk)
-        print("The number of token the prompt had is fixed at 200 , and the number of tokens in the chunk is :", chunk_tokens)
-
-        if current_chunk_tokens + chunk_tokens <= allowed_tokens:
-            current_chunk += chunk
-        else:
-            # Append the non-empty current chunk and start a new one
-            if current_chunk.strip():
-                combined_chunks.append(current_chunk.strip())
-            current_chunk = chunk
-    
-    # Append any remaining chunk after the loop
-    if current_chunk.strip():
-        combined_chunks.append(current_chunk.strip())
-
+    combined_chunks = split_text_to_token_budget(data, allowed_tokens, snap_to_sentences=True)
+    print("The number of chunks created are :", len(combined_chunks))
     return combined_chunks
 
 async def extract_sections_from_research(chunk: str, provider: str) -> List[str]:
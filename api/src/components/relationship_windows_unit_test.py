@@ -0,0 +1,42 @@
+import unittest
+
+from utils.relationship_windows import relationship_prompt_data, relationship_windows
+
+
+def relation(start, end):
+    return {"start": start, "type": "CONTAINS", "end": end, "properties": {}}
+
+
+class TestRelationshipWindows(unittest.TestCase):
+
+    def test_windows_follow_connected_components(self):
+        relationships = [relation(f"formula {i}", f"chemical {i}") for i in range(50)]
+        relationships.append(relation("formula 0", "Glycerine"))
+        valid_names = {name for r in relationships for name in (r["start"], r["end"])} - {"Glycerine"} | {"Glycerin"}
+
+        windows = relationship_windows(relationships, valid_names, ["Glycerin", "Mica"], token_budget=100)
+
+        self.assertGreater(len(windows), 1)
+        self.assertEqual(sum(len(window.relationships) for window in windows), len(relationships))
+        # A component is never split while it fits, and a window lists only the names it needs
+        first = next(window for window in windows if relationships[-1] in window.relationships)
+        self.assertIn(relationships[0], first.relationships)
+        self.assertEqual(first.valid_names[:3], ["formula 0", "chemical 0", "Glycerin"])
+        endpoints = {name for r in first.relationships for name in (r["start"], r["end"])}
+        self.assertEqual(set(first.valid_names), endpoints - {"Glycerine"} | {"Glycerin"})
+        for window in windows:
+            self.assertLessEqual(len(relationship_prompt_data(window)) // 4, 100 + 10)
+
+    def test_component_larger_than_the_budget_is_split(self):
+        relationships = [relation("formula", f"chemical {i}") for i in range(40)]
+
+        windows = relationship_windows(relationships, {"formula"}, token_budget=60)
+
+        self.assertGreater(len(windows), 1)
+        self.assertEqual([r for window in windows for r in window.relationships], relationships)
+        self.assertTrue(all(window.valid_names == ["formula"] for window in windows))
+        self.assertEqual(relationship_windows([], {"formula"}), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import json
+import os
+import random
+import tempfile
+import unittest
+
+from utils.relevance_gate import COMPOSITION_TASK, RelevanceGate, RelevanceLog, recall_threshold, train_relevance_gate
+
+INGREDIENTS = ["glycerin", "dimethicone", "niacinamide", "tocopherol", "xanthan gum", "cetearyl alcohol", "mica"]
+BACKGROUND = [
+    "nail polishes", "consumers", "the prior art", "long lasting wear", "the present invention", "a need",
+    "the background", "chipping", "several drawbacks", "the field of cosmetics",
+]
+
+
+def formulation_chunk(rng: random.Random) -> str:
+    ingredients = rng.sample(INGREDIENTS, 4)
+    return "Example {}: ".format(rng.randint(1, 20)) + ", ".join(
+        f"{name} {rng.randint(1, 30)}%" for name in ingredients
+    ) + " by weight of the composition."
+
+
+def background_chunk(rng: random.Random) -> str:
+    return " ".join(f"It is known that {a} relate to {b}." for a, b in zip(rng.sample(BACKGROUND, 4), rng.sample(BACKGROUND, 4)))
+
+
+class TestRelevanceGate(unittest.TestCase):
+
+    def test_trained_gate_skips_background_chunks(self):
+        rng = random.Random(1)
+        outcomes = [(formulation_chunk(rng), True) for _ in range(30)] + [(background_chunk(rng), False) for _ in range(50)]
+        gate, report = train_relevance_gate({COMPOSITION_TASK: outcomes, "name_description": outcomes[:5]}, recall=1.0)
+
+        self.assertTrue(report[COMPOSITION_TASK]["gated"])
+        self.assertEqual(report[COMPOSITION_TASK]["recall"], 1.0)
+        self.assertGreater(report[COMPOSITION_TASK]["calls_saved"], 0.5)
+        # Too few outcomes to gate a task: its calls are never skipped
+        self.assertFalse(report["name_description"]["gated"])
+        self.assertTrue(gate.should_call("name_description", background_chunk(rng)))
+
+        # The gate survives its JSON round trip
+        gate = RelevanceGate.from_dict(json.loads(json.dumps(gate.to_dict())), recall=1.0)
+        self.assertTrue(gate.should_call(COMPOSITION_TASK, "Example 3: glycerin 5%, mica 2%, tocopherol 1% by weight."))
+        self.assertLess(gate.score(COMPOSITION_TASK, background_chunk(rng)), gate.thresholds[COMPOSITION_TASK])
+
+    def test_recall_knob_and_outcome_log(self):
+        scores = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]
+        self.assertEqual(recall_threshold(scores, 1.0), 0.1)
+        self.assertEqual(recall_threshold(scores, 0.8), 0.3)
+        self.assertEqual(recall_threshold([], 0.9), 0.0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            log = RelevanceLog(os.path.join(directory, "log.sqlite3"))
+            log.record(COMPOSITION_TASK, "Glycerin  5%", True)
+            log.record(COMPOSITION_TASK, "Glycerin 5%", True)
+            log.record(COMPOSITION_TASK, "Background", False)
+            self.assertEqual(log.examples(), {COMPOSITION_TASK: [("Glycerin 5%", True), ("Background", False)]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,10 +2,9 @@ import re
 import logging
 import tiktoken
 from typing import Callable, List, Dict, Any
-from utils.unstructured_data_utils import (
-    nodesTextToListOfDict,
-    relationshipTextToListOfDict,
-)
+from utils.chunking import split_text_to_token_budget
+from utils.chunk_cache import PROVIDER_MODELS, cached_chunk_result, provider_model
+from utils.unstructured_data_utils import getNodesAndRelationshipsFromResult
 import httpx
 import psutil
 from typing import Optional
@@ -50,40 +49,10 @@ def max_allowed_token_length() -> int:
     return 1024
 
 
-def splitString(string, max_length) -> List[str]:
-    return [string[i : i + max_length] for i in range(0, len(string), max_length)]
-
-
 def splitStringToFitTokenSpace(string: str, token_use_per_string: int) -> List[str]:
     allowed_tokens = max_allowed_token_length() - token_use_per_string
-    chunked_data = splitString(string, 500)  # Split based on approximate length
-    # print("The length of the splitted text array is: ", len(chunked_data))
-
-    # print(chunked_data[0])
-
-    combined_chunks = []
-    current_chunk = ""
-    
-    for chunk in chunked_data:
-        # Calculate token count for the combined chunk
-        current_chunk_tokens = num_tokens_from_string(current_chunk)
-        # print("Length of the current chunk of 500 words based on regex is in tokens is :", current_chunk_tokens)
-        chunk_tokens = num_tokens_from_string(chunk)
-        # print("Length of the chunk token of 500 words based on regex is in tokens is :", current_chunk_tokens)
-
-        if current_chunk_tokens + chunk_tokens <= allowed_tokens:
-            current_chunk += chunk
-        else:
-            # Append the non-empty current chunk and start a new one
-            if current_chunk.strip():
-                combined_chunks.append(current_chunk.strip())
-            current_chunk = chunk
-    
-    # Append any remaining chunk after the loop
-    if current_chunk.strip():
-        combined_chunks.append(current_chunk.strip())
-
-    return combined_chunks
+    # Tokenized once and cut on token boundaries, snapped to sentence ends where possible
+    return split_text_to_token_budget(string, allowed_tokens, snap_to_sentences=True)
 
 
 
@@ -162,66 +131,6 @@ def clean_llm_response(raw_response: str) -> str:
         return "Nodes: []\nRelationships: []"
 
 
-
-
-def getNodesAndRelationshipsFromResult(result):
-    regex = "Nodes:\s+(.*?)\s?\s?Relationships:\s?\s?(.*)"
-    internalRegex = "\[(.*?)\]"
-    nodes = []
-    relationships = []
-
-    print("Starting to parse :" , result, len(result))
-    
-    for row in result:
-        print(f"Processing row: {row}")
-        
-        # Match using regex
-        parsing = re.match(regex, row, flags=re.S)
-        if parsing is None:
-            print(f"No match found for row: {row}")
-            continue
-        
-        print("Regex match found. Extracting nodes and relationships.")
-        
-        # Extract raw nodes and relationships
-        rawNodes = str(parsing.group(1))
-        rawRelationships = parsing.group(2)
-        
-        print(f"Extracted rawNodes: {rawNodes}")
-        print(f"Extracted rawRelationships: {rawRelationships}")
-        
-        # Find individual elements using internal regex
-        nodes.extend(re.findall(internalRegex, rawNodes))
-        relationships.extend(re.findall(internalRegex, rawRelationships))
-        
-        print(f"Current list of nodes: {nodes}")
-        print(f"Current list of relationships: {relationships}")
-
-    # Validate extracted nodes and relationships before inserting them
-    nodes = [node for node in nodes if len(node.split(",")) >= 2]  # Ensure each node has at least name and label
-    relationships = [rel for rel in relationships if len(rel.split(",")) >= 3]  # Ensure valid relationship structure
-    
-    if not nodes:
-        print("Warning: No valid nodes found.")
-    if not relationships:
-        print("Warning: No valid relationships found.")
-
-    # Convert raw text data to structured dictionaries
-    print("Converting extracted nodes and relationships to structured dictionaries.")
-    try:
-        result = dict()
-        result["nodes"] = nodesTextToListOfDict(nodes)
-        result["relationships"] = relationshipTextToListOfDict(relationships)
-    except Exception as e:
-        logging.error(f"Error during conversion of nodes or relationships: {e}")
-        raise
-    
-    print("Inside the function nodes are : ", result["nodes"])
-
-    logging.info("Successfully parsed nodes and relationships.")
-    return result
-
-
 async def run_with_chunk_logging(data: str) -> List[str]:
         print("Process Started with the patent text")
 
@@ -309,7 +218,7 @@ api_key = "sk-proj-q1usHOsU_ZltlrMrsQd_JE9skTFrTGkvXUBvqNhnV8kw4kbT2LRcraua18oBz
 
 # Initialize LLM 
 llm = OpenAIChat(
-    openai_api_key=api_key, model_name="gpt-4o-mini", max_tokens=4096
+    openai_api_key=api_key, model_name=PROVIDER_MODELS["openai"], max_tokens=4096
 )
 
 # Helper Functions - 
@@ -325,8 +234,8 @@ async def openai_generate(prompt: str) -> str:
     ]
     print(f"Sending request to OpenAI endpoint with messages: {messages}")
     
-    # Assuming `llm.generate()` is correctly configured to accept the messages
-    output = llm.generate(messages)
+    # The async client, so concurrent calls (e.g. the map stage) do not block the event loop
+    output = await llm.agenerate(messages)
     print("The output is:", output)
     return output
 
@@ -739,6 +648,9 @@ def calculate_relevance_from_query_response(query_response_data: list) -> str:
     result_string = "\n".join(relevance_scores)
     return result_string
 
+# Prompt template version, part of the chunk cache key
+SELF_ATTENTION_COMPOSITION_TEMPLATE = "self-attention-composition-v1"
+
 # Example usage in the self_attention_chunking workflow
 async def self_attention_chunking(data: str, provider: str) -> dict:
     print("Process Started with the patent text")
@@ -780,7 +692,10 @@ async def self_attention_chunking(data: str, provider: str) -> dict:
      
         print(f"Tokens sent for Chunk {i}: {tokens_in_prompt_2}")
        
-        processedChunk_2 = await process(composition_prompt, provider)
+        # The prompt only depends on the chunk, repeated chunks are answered from the chunk cache
+        processedChunk_2 = await cached_chunk_result(
+            chunk, SELF_ATTENTION_COMPOSITION_TEMPLATE, provider_model(provider), lambda: process(composition_prompt, provider)
+        )
         print(f"Chunk {i} processed response: {processedChunk_2}")
 
         # Append the chunk and the processed response to the query-response list
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from components.unit_test_helpers import WordEncoding, import_prompt_creator, mock_async_client
+from utils.structured_output import CompositionReport, ProductSummary, json_schema, parse_structured
+
+prompt_creator = import_prompt_creator()
+
+
+class FakeJSONLLM:
+    def __init__(self, answer):
+        self.answer = answer
+        self.schemas = []
+
+    async def agenerate_json(self, messages, schema=None):
+        self.schemas.append(schema)
+        if isinstance(self.answer, Exception):
+            raise self.answer
+        return self.answer
+
+
+class TestStructuredOutput(unittest.TestCase):
+
+    def test_parses_models(self):
+        report = parse_structured(
+            CompositionReport,
+            '{"functional_roles": {"Humectant": [{"chemical": "Glycerin", "weight": "5%"}, {"chemical": "Urea"}]}}',
+        )
+
+        self.assertEqual(report.functional_roles["Humectant"][0].weight, "5%")
+        self.assertIsNone(report.functional_roles["Humectant"][1].weight)
+        self.assertEqual(parse_structured(ProductSummary, {"name": "Cream"}).name, "Cream")
+        self.assertEqual(set(json_schema(ProductSummary)["properties"]), {"name", "description"})
+
+    def test_invalid_answers_are_logged_and_skipped(self):
+        with self.assertLogs(level="WARNING") as logs:
+            self.assertIsNone(parse_structured(ProductSummary, "Here is the JSON: {"))
+            # Valid JSON, but a chemical without its name
+            self.assertIsNone(parse_structured(CompositionReport, {"functional_roles": {"Humectant": [{"weight": "5%"}]}}))
+        self.assertEqual(len(logs.records), 2)
+
+    def test_structured_generate(self):
+        llm = FakeJSONLLM({"name": "Cream", "description": "A cream"})
+        with patch.object(prompt_creator, "llm", llm), patch("tiktoken.get_encoding", return_value=WordEncoding()):
+            result = asyncio.run(prompt_creator.structured_generate("prompt", "openai", ProductSummary))
+        self.assertEqual(result, ProductSummary(name="Cream", description="A cream"))
+        self.assertEqual(llm.schemas, [json_schema(ProductSummary)])
+
+        # Not JSON at all: no result instead of an exception
+        with patch.object(prompt_creator, "llm", FakeJSONLLM(json.JSONDecodeError("Expecting value", "", 0))), \
+                patch("tiktoken.get_encoding", return_value=WordEncoding()):
+            self.assertIsNone(asyncio.run(prompt_creator.structured_generate("prompt", "openai", ProductSummary)))
+
+    def test_provider_without_json_mode_is_parsed_from_text(self):
+        def handler(request):
+            return httpx.Response(200, json={"response": '{"name": "Serum"}'})
+
+        with patch("components.ollama_prompt_creator.httpx.AsyncClient", mock_async_client(handler)), \
+                patch("tiktoken.get_encoding", return_value=WordEncoding()):
+            result = asyncio.run(prompt_creator.structured_generate("prompt", "groq", ProductSummary))
+
+        self.assertEqual(result.name, "Serum")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import importlib
+import re
+from unittest.mock import patch
+
+import httpx
+
+# Kept before any test patches httpx.AsyncClient
+RealAsyncClient = httpx.AsyncClient
+
+
+class WordEncoding:
+    """
+    Stand-in for a tiktoken encoding where every word (with its trailing whitespace) is one token.
+    """
+
+    def encode(self, text, disallowed_special=()):
+        self.words = [match for match in re.finditer(r"\S+\s*", text)]
+        return list(range(len(self.words)))
+
+    def decode_with_offsets(self, tokens):
+        return "".join(self.words[t].group(0) for t in tokens), [self.words[t].start() for t in tokens]
+
+
+def import_prompt_creator():
+    """
+    components.ollama_prompt_creator, whose LLM clients load a tiktoken encoding when the module is imported.
+    Tests calling its functions patch tiktoken.get_encoding as well, to count tokens offline.
+    """
+    with patch("tiktoken.get_encoding", return_value=WordEncoding()):
+        return importlib.import_module("components.ollama_prompt_creator")
+
+
+def mock_async_client(handler):
+    """
+    httpx.AsyncClient replacement sending the requests to handler instead of the server, to patch in place of
+    <module>.httpx.AsyncClient.
+    """
+    return lambda **kwargs: RealAsyncClient(transport=httpx.MockTransport(handler), **kwargs)
+
+
+class FakeNeo4jResult(list):
+    def consume(self):
+        return None
+
+
+class FakeNeo4jSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def run(self, query, parameters=None, **params):
+        self.driver.queries.append((query, params))
+        return FakeNeo4jResult(self.driver.answer(query, params))
+
+    def write_transaction(self, work):
+        return work(self)
+
+
+class FakeNeo4jDriver:
+    """
+    Stand-in for the neo4j driver, recording the (query, params) run in its sessions and transactions.
+    :param answer: Records of a query, answer(query, params). No records by default.
+    """
+
+    def __init__(self, answer=None):
+        self.queries = []
+        self.answer = answer or (lambda query, params: [])
+
+    def verify_connectivity(self):
+        pass
+
+    def session(self, database=None):
+        return FakeNeo4jSession(self)
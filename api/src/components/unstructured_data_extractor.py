@@ -1,14 +1,11 @@
-import re
 import os
 from typing import List
 import logging
 
 from components.base_component import BaseComponent
 from llm.basellm import BaseLLM
-from utils.unstructured_data_utils import (
-    nodesTextToListOfDict,
-    relationshipTextToListOfDict,
-)
+from utils.chunking import encoding_for_llm, split_text_to_token_budget
+from utils.unstructured_data_utils import getNodesAndRelationshipsFromResult
 
 
 def generate_system_message_with_schema() -> str:
@@ -73,52 +70,13 @@ Data: {data}
 Types: {labels}"""
 
 
-def splitString(string, max_length) -> List[str]:
-    return [string[i : i + max_length] for i in range(0, len(string), max_length)]
-
-
 def splitStringToFitTokenSpace(
     llm: BaseLLM, string: str, token_use_per_string: int
 ) -> List[str]:
     allowed_tokens = llm.max_allowed_token_length() - token_use_per_string
-    chunked_data = splitString(string, 500)
-    combined_chunks = []
-    current_chunk = ""
-    for chunk in chunked_data:
-        if (
-            llm.num_tokens_from_string(current_chunk)
-            + llm.num_tokens_from_string(chunk)
-            < allowed_tokens
-        ):
-            current_chunk += chunk
-        else:
-            combined_chunks.append(current_chunk)
-            current_chunk = chunk
-    combined_chunks.append(current_chunk)
-
-    return combined_chunks
-
-
-def getNodesAndRelationshipsFromResult(result):
-    regex = "Nodes:\s+(.*?)\s?\s?Relationships:\s?\s?(.*)"
-    internalRegex = "\[(.*?)\]"
-    nodes = []
-    relationships = []
-    for row in result:
-        parsing = re.match(regex, row, flags=re.S)
-        if parsing == None:
-            continue
-        rawNodes = str(parsing.group(1))
-        rawRelationships = parsing.group(2)
-        nodes.extend(re.findall(internalRegex, rawNodes))
-        relationships.extend(re.findall(internalRegex, rawRelationships))
-
-    result = dict()
-    result["nodes"] = []
-    result["relationships"] = []
-    result["nodes"].extend(nodesTextToListOfDict(nodes))
-    result["relationships"].extend(relationshipTextToListOfDict(relationships))
-    return result
+    return split_text_to_token_budget(
+        string, allowed_tokens, snap_to_sentences=True, encoding=encoding_for_llm(llm)
+    )
 
 
 class DataExtractor(BaseComponent):
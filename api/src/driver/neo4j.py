@@ -1,9 +1,26 @@
 from typing import Any, Dict, List, Optional
 import json
+import os
+import threading
 import traceback
 
 from neo4j import GraphDatabase, exceptions
 
+from utils.entity_resolution import resolve_existing_names, variant_key
+
+# Merge the chemicals written with the chemical nodes already in the graph that have the same variant_key
+GRAPH_ENTITY_RESOLUTION = os.getenv("GRAPH_ENTITY_RESOLUTION", "true").lower() == "true"
+# Chemical nodes given their key per query, when the nodes written without one are backfilled
+NAME_KEY_BATCH = 5000
+# Version of variant_key stored with the name_key of the chemicals, the keys of an older version are recomputed.
+# 2: the word order is kept.
+NAME_KEY_VERSION = 2
+
+# Graphs (host, database) whose chemical keys are indexed and up to date, the keys are checked once per process
+# by the API startup or the batch ingestion, not on the write path.
+_chemical_keys_ready = set()
+_chemical_keys_lock = threading.Lock()
+
 node_properties_query = """
 CALL apoc.meta.data()
 YIELD label, other, elementType, type, property
@@ -52,6 +69,7 @@ class Neo4jDatabase:
     ) -> None:
         """Initialize a neo4j database"""
         self._driver = GraphDatabase.driver(host, auth=(user, password))
+        self._host = host
         self._database = database
         self._read_only = read_only
         self.schema = ""
@@ -116,6 +134,95 @@ class Neo4jDatabase:
                 else:
                     return [{"code": "error", "message": e}]
 
+    def chemical_names(self) -> List[str]:
+        """
+        Names of all the chemical nodes, e.g. to recognize known ingredients in new patents.
+        """
+        return [row["name"] for row in self.query("MATCH (c:chemical) WHERE c.name IS NOT NULL RETURN c.name AS name") if row.get("name")]
+
+    def ensure_chemical_keys(self) -> None:
+        """
+        Indexes of the chemical names and of their variant_key, and the key of the chemical nodes written without
+        one or with the key of an older NAME_KEY_VERSION. Done once per process and graph, at startup: the backfill
+        scans every chemical and is not run on the write path.
+        """
+        with _chemical_keys_lock:
+            if (self._host, self._database) in _chemical_keys_ready:
+                return
+            self._update_chemical_keys()
+            _chemical_keys_ready.add((self._host, self._database))
+
+    def _update_chemical_keys(self) -> None:
+        with self._driver.session(database=self._database) as session:
+            session.run("CREATE INDEX chemical_name IF NOT EXISTS FOR (c:chemical) ON (c.name)").consume()
+            session.run("CREATE INDEX chemical_name_key IF NOT EXISTS FOR (c:chemical) ON (c.name_key)").consume()
+            backfilled = 0
+            while True:
+                names = [
+                    record["name"]
+                    for record in session.run(
+                        """
+                        MATCH (c:chemical)
+                        WHERE c.name IS NOT NULL AND (c.name_key IS NULL OR coalesce(c.name_key_version, 1) < $version)
+                        RETURN DISTINCT c.name AS name LIMIT $limit
+                        """,
+                        version=NAME_KEY_VERSION,
+                        limit=NAME_KEY_BATCH,
+                    )
+                ]
+                if not names:
+                    break
+                session.write_transaction(
+                    lambda tx: tx.run(
+                        """
+                        UNWIND $rows AS row
+                        MATCH (c:chemical {name: row.name})
+                        SET c.name_key = row.name_key, c.name_key_version = $version
+                        """,
+                        rows=[{"name": name, "name_key": variant_key(name)} for name in names],
+                        version=NAME_KEY_VERSION,
+                    ).consume()
+                )
+                backfilled += len(names)
+        if backfilled:
+            print(f"Name keys set on {backfilled} existing chemicals")
+
+    def existing_chemicals(self, keys: List[str]) -> Dict[str, str]:
+        """
+        The chemical nodes of the keys, one indexed lookup for all of them.
+        :return: variant_key -> name of the chemical node.
+        """
+        with self._driver.session(database=self._database) as session:
+            result = session.run(
+                """
+                UNWIND $keys AS key
+                MATCH (c:chemical {name_key: key})
+                RETURN key, min(c.name) AS name
+                """,
+                keys=keys,
+            )
+            return {record["key"]: record["name"] for record in result}
+
+    def resolve_chemical_names(self, names: List[str]) -> Dict[str, str]:
+        """
+        Name of the chemical node to write for each chemical name, so that near-duplicates are not added to the
+        graph: the existing node with the same variant_key ("glycerine" is written as the existing "glycerin"), or
+        else the first name of the batch with that key. The graph is queried once for the whole batch.
+        :param names: Normalized (lower case) chemical names.
+        """
+        if not GRAPH_ENTITY_RESOLUTION:
+            return {name: name for name in names}
+        try:
+            resolved = resolve_existing_names(names, self.existing_chemicals)
+        except Exception as e:
+            # Written as they are, as before the resolution
+            print(f"Error resolving the chemicals against the graph: {e}")
+            return {name: name for name in names}
+        merged = {name: target for name, target in resolved.items() if name != target}
+        if merged:
+            print(f"Chemicals merged with existing ones: {merged}")
+        return resolved
+
     def refresh_schema(self) -> None:
         node_props = [el["output"] for el in self.query(node_properties_query)]
         rel_props = [el["output"] for el in self.query(rel_properties_query)]
@@ -246,6 +353,10 @@ class Neo4jDatabase:
             return
 
 
+        chemical_names = self.resolve_chemical_names(
+            [chem["chemical"].lower() for chemicals_list in functional_roles.values() for chem in chemicals_list]
+        )
+
         # Create functional_role nodes and link to product
         for role, chemicals_list in functional_roles.items():
             role_name = role.lower()  # Normalize role name
@@ -266,11 +377,12 @@ class Neo4jDatabase:
             # Create chemical nodes and link to functional_role
             for chem in chemicals_list:
                 try:
-                    chemical_name = chem["chemical"].lower()  # Normalize chemical name
+                    chemical_name = chemical_names[chem["chemical"].lower()]  # Normalized, resolved against the graph
                     weight = chem.get("weight", "null")  # Extract weight (if available)
 
                     chemical_query = f"""
                     MERGE (chemical:chemical {{name: '{chemical_name}'}})
+                    SET chemical.name_key = '{variant_key(chemical_name)}', chemical.name_key_version = {NAME_KEY_VERSION}
                     MERGE (product:product {{aa_product_name: '{product_name}'}})
                     MERGE (product)-[:CONTAINS {{functional_role: '{role_name}', weight: '{weight}'}}]->(chemical)
                     """
@@ -281,6 +393,108 @@ class Neo4jDatabase:
                     print(f"Error executing chemical query for chemical '{chemical_name}': {e}")
                     return
 
+    def insert_patent_data_batch(self, json_objects: List[Dict[str, Any]], batch_size: int = 500) -> Dict[str, Any]:
+        """
+        Batched insert_patent_data: the same patents, products, functional roles and chemicals, written with
+        parameterized UNWIND queries so that a whole batch of patents costs a few round trips. The chemicals of the
+        batch are resolved against the existing ones first (resolve_chemical_names).
+        :param json_objects: Product reports, as built for insert_patent_data.
+        :param batch_size: Rows sent per query.
+        Reports without assignee, inventors or CPC codes are written too: the patent is merged on its number only.
+        :return: Counts of the written patents and chemicals, and the reports skipped as invalid.
+        """
+        patents = []
+        contains = []
+        skipped = []
+        for json_object in json_objects:
+            properties = json_object.get("properties") or {}
+            missing = [key for key in ["patent_no", "cpcc_codes", "inventor_names", "assignee", "properties"] if key not in json_object]
+            # The patent and the product are merged on their number and name, they can't be null
+            if "patent_no" not in missing and json_object["patent_no"] is None:
+                missing.append("patent_no")
+            if properties.get("product_name") is None:
+                missing.append("product_name")
+            if missing or not properties.get("functional_roles"):
+                skipped.append({"patent_no": json_object.get("patent_no"), "missing": missing or ["functional_roles"]})
+                continue
+            patents.append({
+                "patent_no": json_object["patent_no"],
+                "inventor_names": json_object["inventor_names"],
+                "cpcc_codes": json_object["cpcc_codes"],
+                "assignee": json_object["assignee"],
+                "product_name": properties["product_name"],
+                "description": properties["description"],
+                "product_type": json_object.get("type"),
+            })
+            for role, chemicals_list in properties["functional_roles"].items():
+                for chem in chemicals_list:
+                    contains.append({
+                        "product_name": properties["product_name"],
+                        "role": role.lower(),  # Normalize role name
+                        "chemical": chem["chemical"].lower(),  # Normalize chemical name, resolved below
+                        "weight": chem.get("weight") or "null",
+                    })
+
+        chemical_names = self.resolve_chemical_names([row["chemical"] for row in contains])
+        for row in contains:
+            row["chemical"] = chemical_names[row["chemical"]]
+            row["name_key"] = variant_key(row["chemical"])
+
+        with self._driver.session(database=self._database) as session:
+            if patents:
+                session.write_transaction(
+                    lambda tx: tx.run(
+                        """
+                        MERGE (head:patents {d_type: "patents"})
+                        ON CREATE SET head.length = 0
+                        SET head.length = head.length + size($patents)
+                        """,
+                        patents=patents,
+                    ).consume()
+                )
+            for start in range(0, len(patents), batch_size):
+                session.write_transaction(
+                    lambda tx: tx.run(
+                        """
+                        UNWIND $rows AS row
+                        MATCH (head:patents {d_type: "patents"})
+                        MERGE (patent:patent {aa_patent_no: row.patent_no})
+                        ON CREATE SET patent.created_at = timestamp()
+                        SET patent.inventor_names = coalesce(row.inventor_names, patent.inventor_names, ""),
+                            patent.cpcc_codes = coalesce(row.cpcc_codes, patent.cpcc_codes, ""),
+                            patent.the_assignee = coalesce(row.assignee, patent.the_assignee, "")
+                        MERGE (head)-[:HAS]->(patent)
+                        MERGE (product:product {
+                            aa_product_name: row.product_name,
+                            description: coalesce(row.description, ""),
+                            product_type: coalesce(row.product_type, "")
+                        })
+                        ON CREATE SET product.created_at = timestamp()
+                        MERGE (patent)-[:PROTECTS]->(product)
+                        """,
+                        rows=patents[start:start + batch_size],
+                    ).consume()
+                )
+            for start in range(0, len(contains), batch_size):
+                session.write_transaction(
+                    lambda tx: tx.run(
+                        """
+                        UNWIND $rows AS row
+                        MERGE (role:functional_role {name: row.role})
+                        MERGE (product:product {aa_product_name: row.product_name})
+                        MERGE (product)-[:OF]->(role)
+                        MERGE (chemical:chemical {name: row.chemical})
+                        SET chemical.name_key = row.name_key, chemical.name_key_version = $version
+                        MERGE (product)-[:CONTAINS {functional_role: row.role, weight: row.weight}]->(chemical)
+                        """,
+                        rows=contains[start:start + batch_size],
+                        version=NAME_KEY_VERSION,
+                    ).consume()
+                )
+
+        print(f"Batch insert: {len(patents)} patents, {len(contains)} chemicals, {len(skipped)} skipped")
+        return {"patents": len(patents), "chemicals": len(contains), "skipped": skipped}
+
     def insert_real_world_product(self, json_object: Dict[str, Any]) -> None:
             queries = []
 
@@ -367,6 +581,10 @@ class Neo4jDatabase:
                 print(f"Error executing product query: {e}")
                 return
 
+            chemical_names = self.resolve_chemical_names(
+                [chem["chemical"].lower() for chemicals_list in functional_roles.values() for chem in chemicals_list]
+            )
+
             # Create functional_role nodes and link to product
             for role, chemicals_list in functional_roles.items():
                 role_name = role.lower()  # Normalize role name
@@ -387,11 +605,12 @@ class Neo4jDatabase:
                 # Create chemical nodes and link to functional_role
                 for chem in chemicals_list:
                     try:
-                        chemical_name = chem["chemical"].lower()  # Normalize chemical name
+                        chemical_name = chemical_names[chem["chemical"].lower()]  # Normalized, resolved against the graph
                         weight = chem.get("weight", "null")  # Extract weight (if available)
 
                         chemical_query = f"""
                         MERGE (chemical:chemical {{name: '{chemical_name}'}})
+                        SET chemical.name_key = '{variant_key(chemical_name)}', chemical.name_key_version = {NAME_KEY_VERSION}
                         MERGE (product:product {{aa_product_name: '{product_name}'}})
                         MERGE (product)-[:CONTAINS {{functional_role: '{role_name}', weight: '{weight}'}}]->(chemical)
                         """
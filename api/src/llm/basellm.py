@@ -1,7 +1,11 @@
+import asyncio
+import json
 from abc import ABC, abstractmethod
 from typing import (
     Any,
+    Dict,
     List,
+    Optional,
 )
 
 
@@ -9,6 +13,34 @@ def raise_(ex):
     raise ex
 
 
+class ClientErrorResponse(str):
+    """
+    "Error: ..." answer to a request the provider rejected (bad request, context length, invalid key).
+    The provider is up, so the circuit breakers do not count it as a provider failure.
+    """
+
+
+class LLMClientError(Exception):
+    """Raised instead of a JSON parse error when the provider rejected the request"""
+
+
+def error_response(error: Exception, status_code: Optional[int] = None) -> str:
+    """
+    "Error: ..." answer of a failed call.
+    :param status_code: HTTP status of the failed call, 4xx statuses other than 429 (rate limit) are client errors.
+    """
+    if status_code is not None and 400 <= status_code < 500 and status_code != 429:
+        return ClientErrorResponse(f"Error: {error}")
+    return f"Error: {error}"
+
+
+def json_answer(output: str) -> Dict[str, Any]:
+    """The JSON object of a JSON mode answer, a rejected request raises LLMClientError"""
+    if isinstance(output, ClientErrorResponse):
+        raise LLMClientError(output)
+    return json.loads(output)
+
+
 class BaseLLM(ABC):
     """LLM wrapper should take in a prompt and return a string."""
 
@@ -16,6 +48,22 @@ class BaseLLM(ABC):
     def generate(self, messages: List[str]) -> str:
         """Comment"""
 
+    async def agenerate(self, messages: List[str]) -> str:
+        """Awaitable generate, runs the blocking call in a worker thread unless a subclass has a native async client"""
+        return await asyncio.to_thread(self.generate, messages)
+
+    def generate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Returns the answer as a parsed JSON object. Providers with a JSON mode constrain the output to the schema"""
+        return json_answer(self.generate(messages))
+
+    async def agenerate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Awaitable generate_json"""
+        return await asyncio.to_thread(self.generate_json, messages, schema)
+
     @abstractmethod
     async def generateStreaming(
         self, messages: List[str], onTokenCallback
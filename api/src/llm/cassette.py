@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from llm.basellm import BaseLLM
+from llm.hedged import is_error_response
+
+# "record" stores every LLM call in the cassette directory, "replay" answers from it. Empty disables cassettes.
+LLM_CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "")
+LLM_CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "cassettes")
+# Latency injected on replay: "none", "recorded", a constant in seconds, "uniform:MIN,MAX" or "lognormal:MEDIAN,SIGMA"
+LLM_CASSETTE_LATENCY = os.getenv("LLM_CASSETTE_LATENCY", "none")
+LLM_CASSETTE_SEED = int(os.getenv("LLM_CASSETTE_SEED", "0"))
+
+CASSETTE_MODES = ("record", "replay")
+
+
+class CassetteMiss(KeyError):
+    """Raised in replay mode when a request was never recorded."""
+
+
+def latency_model(spec: str, seed: int = 0) -> Callable[[Optional[float]], float]:
+    """
+    Build the replay delay function from a latency spec.
+    :param spec: "none", "recorded", "<seconds>", "uniform:MIN,MAX" or "lognormal:MEDIAN,SIGMA".
+    :param seed: Seed of the random generator so that replays are repeatable.
+    :return: A function mapping the recorded latency (or None) to the delay to inject.
+    """
+    spec = spec.strip().lower()
+    rng = random.Random(seed)
+    if spec in ("", "none"):
+        return lambda recorded: 0.0
+    if spec == "recorded":
+        return lambda recorded: recorded or 0.0
+    kind, _, args = spec.partition(":")
+    if kind == "uniform":
+        low, high = (float(value) for value in args.split(","))
+        return lambda recorded: rng.uniform(low, high)
+    if kind == "lognormal":
+        median, sigma = (float(value) for value in args.split(","))
+        return lambda recorded: rng.lognormvariate(math.log(median), sigma)
+    try:
+        constant = float(spec)
+    except ValueError:
+        raise ValueError(f"Invalid cassette latency: {spec}")
+    return lambda recorded: constant
+
+
+class CassetteLLM(BaseLLM):
+    """
+    Record/replay wrapper around an LLM.
+    In record mode every successful call is forwarded to the wrapped LLM and stored as one JSON file
+    per request, keyed by a hash of the request. In replay mode the stored answers are served without
+    touching the network, optionally delayed by a latency model, so pipelines can be profiled repeatably.
+    """
+
+    def __init__(
+        self,
+        llm: BaseLLM,
+        name: str,
+        mode: str = "replay",
+        directory: str = LLM_CASSETTE_DIR,
+        latency: str = "none",
+        seed: int = 0,
+    ) -> None:
+        """
+        :param llm: The LLM that is recorded (and used for token counting on replay).
+        :param name: Cassette name, a sub directory of the cassette directory.
+        :param mode: "record" or "replay".
+        :param directory: Root directory of the cassettes.
+        :param latency: Replay latency spec, see latency_model.
+        :param seed: Seed of the latency model.
+        """
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unsupported cassette mode: {mode}")
+        self.llm = llm
+        self.name = name
+        self.mode = mode
+        self.path = os.path.join(directory, name)
+        self.delay = latency_model(latency, seed)
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _key(self, kind: str, messages: List[Any], schema: Optional[Dict[str, Any]] = None) -> str:
+        model = getattr(self.llm, "model", type(self.llm).__name__)
+        request = json.dumps(
+            {"model": model, "kind": kind, "messages": messages, "schema": schema}, sort_keys=True, default=str
+        )
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def _record(
+        self, key: str, kind: str, messages: List[Any], schema: Optional[Dict[str, Any]], response: Any, seconds: float
+    ) -> None:
+        entry = {
+            "request": {"kind": kind, "messages": messages, "schema": schema},
+            "response": response,
+            "latency_seconds": round(seconds, 4),
+            "recorded_at": time.time(),
+        }
+        with self._lock:
+            with open(self._file(key), "w") as f:
+                json.dump(entry, f, indent=2, default=str)
+
+    def _replay(self, key: str) -> Dict[str, Any]:
+        try:
+            with open(self._file(key)) as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            raise CassetteMiss(f"No recording for request {key} in cassette {self.path}")
+        entry["delay"] = self.delay(entry.get("latency_seconds"))
+        return entry
+
+    def _call(self, kind: str, messages: List[Any], schema: Optional[Dict[str, Any]], call: Callable[[], Any]) -> Any:
+        key = self._key(kind, messages, schema)
+        if self.mode == "replay":
+            entry = self._replay(key)
+            time.sleep(entry["delay"])
+            return entry["response"]
+        started = time.perf_counter()
+        output = call()
+        if not is_error_response(output):
+            self._record(key, kind, messages, schema, output, time.perf_counter() - started)
+        return output
+
+    async def _acall(self, kind: str, messages: List[Any], schema: Optional[Dict[str, Any]], acall: Callable[[], Any]) -> Any:
+        key = self._key(kind, messages, schema)
+        if self.mode == "replay":
+            entry = self._replay(key)
+            await asyncio.sleep(entry["delay"])
+            return entry["response"]
+        started = time.perf_counter()
+        output = await acall()
+        if not is_error_response(output):
+            self._record(key, kind, messages, schema, output, time.perf_counter() - started)
+        return output
+
+    def generate(self, messages: List[str]) -> str:
+        return self._call("text", messages, None, lambda: self.llm.generate(messages))
+
+    async def agenerate(self, messages: List[str]) -> str:
+        return await self._acall("text", messages, None, lambda: self.llm.agenerate(messages))
+
+    def generate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        return self._call("json", messages, schema, lambda: self.llm.generate_json(messages, schema))
+
+    async def agenerate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        return await self._acall("json", messages, schema, lambda: self.llm.agenerate_json(messages, schema))
+
+    async def generateStreaming(self, messages: List[str], onTokenCallback) -> List[Any]:
+        key = self._key("stream", messages)
+        if self.mode == "replay":
+            entry = self._replay(key)
+            tokens = entry["response"]["tokens"]
+            # Spread the injected latency over the tokens so the stream keeps its pacing
+            pause = entry["delay"] / len(tokens) if tokens else 0.0
+            for token in tokens:
+                await asyncio.sleep(pause)
+                await onTokenCallback(token)
+            return entry["response"]["result"]
+
+        tokens = []
+
+        async def recordToken(token):
+            tokens.append(json.loads(json.dumps(token, default=str)))
+            await onTokenCallback(token)
+
+        started = time.perf_counter()
+        result = await self.llm.generateStreaming(messages, recordToken)
+        self._record(
+            key, "stream", messages, None, {"tokens": tokens, "result": result}, time.perf_counter() - started
+        )
+        return result
+
+    def num_tokens_from_string(self, string: str) -> int:
+        return self.llm.num_tokens_from_string(string)
+
+    def max_allowed_token_length(self) -> int:
+        return self.llm.max_allowed_token_length()
+
+
+def with_cassette(llm: BaseLLM, name: str) -> BaseLLM:
+    """
+    Wrap an LLM in a cassette when LLM_CASSETTE_MODE is set, otherwise return it unchanged.
+    :param llm: The LLM to wrap.
+    :param name: Cassette name, one per call site so recordings of different pipelines don't mix.
+    """
+    if not LLM_CASSETTE_MODE:
+        return llm
+    return CassetteLLM(
+        llm,
+        name,
+        mode=LLM_CASSETTE_MODE,
+        directory=LLM_CASSETTE_DIR,
+        latency=LLM_CASSETTE_LATENCY,
+        seed=LLM_CASSETTE_SEED,
+    )
@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from llm.basellm import BaseLLM, ClientErrorResponse, LLMClientError
+
+
+def is_error_response(output: Any) -> bool:
+    # The wrappers report failed calls as "Error: ..." strings instead of raising
+    return isinstance(output, str) and output.startswith("Error:")
+
+
+def is_provider_failure(output: Any) -> bool:
+    # Transport errors, timeouts, 5xx and rate limits. A rejected request (context length, bad request, invalid
+    # key) says nothing about the health of the provider and must not open its breaker.
+    return is_error_response(output) and not isinstance(output, ClientErrorResponse)
+
+
+class CircuitBreaker:
+    """
+    Skips a provider after a run of consecutive failures.
+    After reset_timeout seconds one trial call is let through (half-open); a success closes the breaker again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        # A half-open trial call is in flight, the other calls still skip the provider
+        self.trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def available(self) -> bool:
+        """
+        Whether a call could go through now, without taking the half-open trial.
+        """
+        state = self.state
+        return state == "closed" or (state == "half-open" and not self.trial)
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go through. In the half-open state only the first caller gets through, it holds the
+        trial until its outcome is recorded (or release is called).
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def release(self) -> None:
+        # The call was abandoned before its outcome was known
+        with self._lock:
+            self.trial = False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.failure_threshold:
+                # A failed trial opens the breaker for another reset_timeout
+                self.opened_at = time.monotonic()
+
+
+class LatencyTracker:
+    """
+    Rolling window of call latencies used to derive the hedge deadline.
+    """
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        window: int = 200,
+        min_samples: int = 20,
+        initial_deadline: float = 10.0,
+    ) -> None:
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_deadline = initial_deadline
+        self.samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.samples.append(seconds)
+
+    def deadline(self) -> float:
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return self.initial_deadline
+            ordered = sorted(self.samples)
+        index = min(int(len(ordered) * self.percentile), len(ordered) - 1)
+        return ordered[index]
+
+
+class HedgedLLM(BaseLLM):
+    """
+    Latency-aware wrapper around one or more LLMs.
+    The first provider is called; if it has not answered by its pXX deadline a hedge request is sent
+    to the next healthy provider (or the same one when there is no fallback). The first successful
+    answer wins and the other request is cancelled. Providers whose circuit breaker is open are skipped.
+    Latencies are tracked per provider, so a slow fallback does not stretch the deadline of a fast primary.
+    """
+
+    def __init__(
+        self,
+        providers: List[BaseLLM],
+        hedge_percentile: float = 0.95,
+        initial_deadline: float = 10.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        max_workers: int = 16,
+    ) -> None:
+        """
+        :param providers: LLMs in order of preference, e.g. [OpenAIChat(...), OllamaChat(...)].
+        :param hedge_percentile: Latency percentile after which the hedge request is fired.
+        :param initial_deadline: Hedge deadline in seconds until enough latencies have been observed.
+        :param failure_threshold: Consecutive failures after which a provider is skipped.
+        :param reset_timeout: Seconds before a skipped provider is tried again.
+        """
+        if not providers:
+            raise ValueError("HedgedLLM needs at least one provider")
+        self.providers = providers
+        self.latencies = [
+            LatencyTracker(percentile=hedge_percentile, initial_deadline=initial_deadline) for _ in providers
+        ]
+        self.breakers = [CircuitBreaker(failure_threshold, reset_timeout) for _ in providers]
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedged-llm")
+
+    def _call_order(self) -> List[int]:
+        available = [i for i, breaker in enumerate(self.breakers) if breaker.available()]
+        if not available:
+            raise Exception("All LLM providers are unavailable (circuit breakers open)")
+        # With a single healthy provider the hedge goes to the same provider
+        return available if len(available) > 1 else available * 2
+
+    def _next_allowed(self, order: List[int]) -> Optional[int]:
+        # Takes the half-open trial of the provider, if it is one
+        while order:
+            index = order.pop(0)
+            if self.breakers[index].allow():
+                return index
+        return None
+
+    def _timed(self, index: int, call: Callable[[BaseLLM], Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            output = call(self.providers[index])
+        except LLMClientError:
+            self.breakers[index].record_success()
+            raise
+        except Exception:
+            self.breakers[index].record_failure()
+            raise
+        self._record(index, output, started)
+        return output
+
+    def _record(self, index: int, output: Any, started: float) -> None:
+        if is_provider_failure(output):
+            self.breakers[index].record_failure()
+            return
+        self.breakers[index].record_success()
+        if not is_error_response(output):
+            # A rejected request is answered at once, its latency would pull the hedge deadline down
+            self.latencies[index].record(time.perf_counter() - started)
+
+    def _hedge(self, call: Callable[[BaseLLM], Any]) -> Any:
+        order = self._call_order()
+        pending = {}
+
+        def launch() -> Optional[int]:
+            index = self._next_allowed(order)
+            if index is not None:
+                future = self._executor.submit(self._timed, index, call)
+                pending[future] = index
+            return index
+
+        first = launch()
+        if first is None:
+            raise Exception("All LLM providers are unavailable (circuit breakers open)")
+        deadline = self.latencies[first].deadline()
+        last_output, last_error = None, None
+        while pending:
+            done, _ = wait(list(pending), timeout=deadline, return_when=FIRST_COMPLETED)
+            if not done:
+                # pXX deadline passed without an answer: fire the hedge and wait for whichever finishes first
+                if launch() is not None:
+                    logging.info(f"Hedged LLM call after {deadline:.2f}s")
+                deadline = None
+                continue
+            for future in done:
+                pending.pop(future)
+                try:
+                    output = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if not is_error_response(output):
+                    # Blocking clients cannot be interrupted, the losing call is simply abandoned
+                    for loser, loser_index in pending.items():
+                        if loser.cancel():
+                            # Never started: no outcome to record
+                            self.breakers[loser_index].release()
+                    return output
+                last_output = output
+            # The finished call failed: go straight to the fallback instead of waiting for the deadline
+            launch()
+
+        if last_output is not None:
+            return last_output
+        raise last_error
+
+    async def _arun(self, index: int, acall: Callable[[BaseLLM], Awaitable[Any]]) -> Any:
+        started = time.perf_counter()
+        try:
+            output = await acall(self.providers[index])
+        except asyncio.CancelledError:
+            # The losing request of a hedge: no outcome, but a half-open trial must not stay taken
+            self.breakers[index].release()
+            raise
+        except LLMClientError:
+            self.breakers[index].record_success()
+            raise
+        except Exception:
+            self.breakers[index].record_failure()
+            raise
+        self._record(index, output, started)
+        return output
+
+    async def _ahedge(self, acall: Callable[[BaseLLM], Awaitable[Any]]) -> Any:
+        order = self._call_order()
+        pending = set()
+
+        def launch() -> Optional[int]:
+            index = self._next_allowed(order)
+            if index is not None:
+                pending.add(asyncio.ensure_future(self._arun(index, acall)))
+            return index
+
+        first = launch()
+        if first is None:
+            raise Exception("All LLM providers are unavailable (circuit breakers open)")
+        deadline = self.latencies[first].deadline()
+        last_output, last_error = None, None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=deadline, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if launch() is not None:
+                        logging.info(f"Hedged LLM call after {deadline:.2f}s")
+                    deadline = None
+                    continue
+                for task in done:
+                    pending.discard(task)
+                    try:
+                        output = task.result()
+                    except Exception as e:
+                        last_error = e
+                        continue
+                    if not is_error_response(output):
+                        return output
+                    last_output = output
+                launch()
+        finally:
+            # Cancel the losing request(s)
+            for task in pending:
+                task.cancel()
+
+        if last_output is not None:
+            return last_output
+        raise last_error
+
+    def generate(self, messages: List[str]) -> str:
+        return self._hedge(lambda provider: provider.generate(messages))
+
+    async def agenerate(self, messages: List[str]) -> str:
+        return await self._ahedge(lambda provider: provider.agenerate(messages))
+
+    def generate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        # Invalid JSON raises, which counts as a failed call and moves on to the fallback. A rejected request raises
+        # LLMClientError, which moves on to the fallback without counting against the provider
+        return self._hedge(lambda provider: provider.generate_json(messages, schema))
+
+    async def agenerate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        return await self._ahedge(lambda provider: provider.agenerate_json(messages, schema))
+
+    async def generateStreaming(self, messages: List[str], onTokenCallback) -> List[Any]:
+        # Tokens cannot be taken back once streamed, so streaming goes to the first healthy provider only
+        index = self._next_allowed(self._call_order())
+        if index is None:
+            raise Exception("All LLM providers are unavailable (circuit breakers open)")
+        try:
+            output = await self.providers[index].generateStreaming(messages, onTokenCallback)
+        except asyncio.CancelledError:
+            self.breakers[index].release()
+            raise
+        except Exception:
+            self.breakers[index].record_failure()
+            raise
+        if output and is_provider_failure(output[0]):
+            self.breakers[index].record_failure()
+        else:
+            self.breakers[index].record_success()
+        return output
+
+    def num_tokens_from_string(self, string: str) -> int:
+        return self.providers[0].num_tokens_from_string(string)
+
+    def max_allowed_token_length(self) -> int:
+        return self.providers[0].max_allowed_token_length()
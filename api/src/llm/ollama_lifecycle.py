@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from llm.ollamaapi import OLLAMA_HOST, OLLAMA_KEEP_ALIVE
+
+# Models loaded at API startup, comma separated. Empty by default: a deployment without Ollama has nothing to
+# preload and is ready at once.
+OLLAMA_PRELOAD_MODELS = os.getenv("OLLAMA_PRELOAD_MODELS", "")
+# Seconds between keep-alive pings. Defaults to half of the residency window.
+OLLAMA_KEEP_ALIVE_PING_SECONDS = os.getenv("OLLAMA_KEEP_ALIVE_PING_SECONDS")
+
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_keep_alive(keep_alive: str) -> Optional[float]:
+    """
+    Convert an Ollama keep_alive value ("30m", "1h", "300", "-1") into seconds.
+    :return: The residency window in seconds, or None if the model stays loaded forever.
+    """
+    value = str(keep_alive).strip()
+    match = re.fullmatch(r"(-?\d+(?:\.\d+)?)(ms|s|m|h)?", value)
+    if match is None:
+        raise ValueError(f"Invalid keep_alive duration: {keep_alive}")
+    seconds = float(match.group(1)) * DURATION_UNITS[match.group(2) or "s"]
+    return None if seconds < 0 else seconds
+
+
+class OllamaModelManager:
+    """
+    Keeps the configured Ollama models resident so that user requests never pay the model load time.
+    Models are preloaded once at startup and then pinged before their keep_alive window expires.
+    """
+
+    def __init__(
+        self,
+        models: List[str],
+        host: str = OLLAMA_HOST,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+        ping_interval: Optional[float] = None,
+    ) -> None:
+        """
+        :param models: Names of the Ollama models to keep loaded (e.g. ["llama3.1"]).
+        :param host: Base URL of the Ollama server.
+        :param keep_alive: How long Ollama keeps a model in memory after each request.
+        :param ping_interval: Seconds between keep-alive pings, defaults to half the residency window.
+        """
+        self.models = models
+        self.host = host
+        self.keep_alive = keep_alive
+        residency = parse_keep_alive(keep_alive)
+        if ping_interval is None:
+            # Models kept forever still get an occasional ping so that an Ollama restart is noticed
+            ping_interval = max(residency / 2, 30.0) if residency else 300.0
+        self.ping_interval = ping_interval
+        self.state: Dict[str, Dict[str, Any]] = {
+            model: {"status": "pending", "load_seconds": None, "last_ping": None, "error": None}
+            for model in models
+        }
+        self._task: Optional[asyncio.Task] = None
+
+    async def load(self, model: str) -> None:
+        """
+        Load a model into memory (or refresh its residency) with an empty generate request.
+        """
+        entry = self.state[model]
+        if entry["status"] != "loaded":
+            entry["status"] = "loading"
+        started = time.perf_counter()
+        try:
+            async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0)) as client:
+                response = await client.post(
+                    f"{self.host}/api/generate",
+                    json={"model": model, "keep_alive": self.keep_alive},
+                )
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            logging.error(f"Could not load Ollama model {model}: {e}")
+            entry.update(status="error", error=str(e))
+            return
+
+        if entry["load_seconds"] is None:
+            entry["load_seconds"] = round(time.perf_counter() - started, 3)
+        entry.update(status="loaded", last_ping=time.time(), error=None)
+
+    async def preload(self) -> None:
+        await asyncio.gather(*(self.load(model) for model in self.models))
+
+    async def _keep_alive_loop(self) -> None:
+        await self.preload()
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await self.preload()
+
+    def start(self) -> None:
+        """
+        Start preloading and pinging in the background so API startup is not blocked.
+        """
+        if self.models and self._task is None:
+            self._task = asyncio.create_task(self._keep_alive_loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def ready(self) -> bool:
+        return all(entry["status"] == "loaded" for entry in self.state.values())
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "keep_alive": self.keep_alive,
+            "ping_interval_seconds": self.ping_interval,
+            "models": self.state,
+        }
+
+
+def model_manager_from_env() -> OllamaModelManager:
+    models = [model.strip() for model in OLLAMA_PRELOAD_MODELS.split(",") if model.strip()]
+    ping_interval = (
+        float(OLLAMA_KEEP_ALIVE_PING_SECONDS) if OLLAMA_KEEP_ALIVE_PING_SECONDS else None
+    )
+    return OllamaModelManager(models=models, ping_interval=ping_interval)
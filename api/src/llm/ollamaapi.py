@@ -1,9 +1,48 @@
-from typing import Callable, List, Dict, Any
-from llm.basellm import BaseLLM
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Union
+from llm.basellm import BaseLLM, error_response, json_answer
 import requests
 import logging
+import json
+import os
+import httpx
 import tiktoken
 
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://host.docker.internal:11434")
+# How long Ollama keeps a model in memory after a request ("30m", "1h", "-1" for forever)
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+
+def to_chat_messages(messages: List[Union[str, Dict[str, str]]]) -> List[Dict[str, str]]:
+    """
+    Normalize a conversation into Ollama's chat message format.
+    :param messages: Plain strings (sent as user turns) or {"role", "content"} dicts.
+    :return: A list of {"role", "content"} dicts.
+    """
+    return [
+        message if isinstance(message, dict) else {"role": "user", "content": message}
+        for message in messages
+    ]
+
+
+async def iter_ollama_stream(response: httpx.Response) -> AsyncIterator[str]:
+    """
+    Yield the content tokens of an Ollama NDJSON chat stream as they arrive.
+    Each line of the stream is a JSON object carrying a partial "message"; the
+    last one has "done": true.
+    :param response: An httpx response opened in streaming mode.
+    """
+    async for line in response.aiter_lines():
+        if not line.strip():
+            continue
+        chunk = json.loads(line)
+        if "error" in chunk:
+            raise ValueError(f"Error from Ollama: {chunk['error']}")
+        content = chunk.get("message", {}).get("content", "")
+        if content:
+            yield content
+        if chunk.get("done"):
+            break
+
 class OllamaChat(BaseLLM):
     """Wrapper around Ollama's llama3.x large language model."""
 
@@ -33,17 +72,36 @@ class OllamaChat(BaseLLM):
         self.host = host  # Store the endpoint
         self.tokenizer = tiktoken.get_encoding("cl100k_base")
 
-    def generate(self, message:List[str]) -> str:
+    def _payload(
+        self,
+        messages: List[Union[str, Dict[str, str]]],
+        stream: bool,
+        format: Optional[Union[str, Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        payload = {
+            "model": self.model,
+            "messages": to_chat_messages(messages),
+            "options": {
+                "num_predict": self.max_tokens,
+                "temperature": self.temperature,
+            },
+            "stream": stream,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+        }
+        if format is not None:
+            # "json" for JSON mode or a JSON schema to constrain the output
+            payload["format"] = format
+        return payload
+
+    def generate(self, message:List[str], format: Optional[Union[str, Dict[str, Any]]] = None) -> str:
         """
         Generate a response from the model.
         :param messages: A list of strings representing the conversation history.
+        :param format: Optional Ollama output format, "json" or a JSON schema.
         :return: The generated response as a string.
         """
         try:
-            # Prepare the request payload with only the chunk (prompt)
-            payload = {
-                "prompt": message[0]  # Assuming the API expects a field named "chunk" for the prompt
-            }
+            payload = self._payload(message, stream=False, format=format)
 
             # Make the POST request to the Ollama endpoint
             logging.debug(f"Sending request to {self.host} with payload: {payload}")
@@ -54,48 +112,69 @@ class OllamaChat(BaseLLM):
 
             # Parse and return the generated response
             result = response.json()
-            return result.get("generated_text", "")
+            return result.get("generated_text", {}).get("message", {}).get("content", "")
         except requests.RequestException as e:
             logging.error(f"Error communicating with Ollama: {e}")
-            return f"Error: {e}"
+            return error_response(e, getattr(e.response, "status_code", None))
         except ValueError as e:  # Handle JSON decoding errors
             logging.error(f"Invalid JSON received from Ollama: {response.text}")
             return f"Invalid JSON received: {response.text}"
 
+    async def agenerate(self, messages: List[str], format: Optional[Union[str, Dict[str, Any]]] = None) -> str:
+        """
+        Async variant of generate. The request is cancelled with the task, which lets callers abandon slow calls.
+        :param messages: A list of strings or chat message dicts.
+        :param format: Optional Ollama output format, "json" or a JSON schema.
+        :return: The generated response as a string.
+        """
+        try:
+            async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0)) as client:
+                response = await client.post(self.host, json=self._payload(messages, stream=False, format=format))
+            response.raise_for_status()
+            result = response.json()
+            return result.get("generated_text", {}).get("message", {}).get("content", "")
+        except httpx.HTTPError as e:
+            logging.error(f"Error communicating with Ollama: {e}")
+            status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            return error_response(e, status_code)
+
+    def generate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        return json_answer(self.generate(messages, format=schema or "json"))
+
+    async def agenerate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        return json_answer(await self.agenerate(messages, format=schema or "json"))
+
     async def generateStreaming(
         self, messages: List[str], onTokenCallback: Callable[[str], None]
     ) -> List[str]:
         """
         Generate a response from the model in streaming mode.
+        Tokens are forwarded to the callback as soon as Ollama emits them.
         :param messages: A list of dictionaries representing the conversation history.
         :param onTokenCallback: A callback function to handle each token during streaming.
         :return: The complete response as a list of tokens.
         """
         try:
-            # Convert list of strings to the format expected by the model
-            formatted_messages = "\n".join(messages)
-
-            print("Formatted messages : ", formatted_messages)
-            stream = chat(
-                model=self.model,
-                messages=formatted_messages,
-                options={
-                    "max_tokens": self.max_tokens,
-                    "temperature": self.temperature,
-                },
-                stream=True,
-            )
-
+            payload = self._payload(messages, stream=True)
+            logging.debug(f"Streaming request to {self.host} with payload: {payload}")
 
             result = []
-            for chunk in stream:
-                content = chunk["message"]["content"]
-                result.append(content)
-                await onTokenCallback(content)
+            async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0)) as client:
+                async with client.stream("POST", self.host, json=payload) as response:
+                    response.raise_for_status()
+                    async for content in iter_ollama_stream(response):
+                        result.append(content)
+                        if onTokenCallback:
+                            await onTokenCallback(content)
             return result
-        
+
         except Exception as e:
-            return [str(f"Error: {e}")]
+            status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+            return [error_response(e, status_code)]
 
     def num_tokens_from_string(self, string: str) -> int: 
         """
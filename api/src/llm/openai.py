@@ -1,14 +1,31 @@
+import asyncio
+import random
 from typing import (
+    Any,
     Callable,
+    Dict,
     List,
+    Optional,
 )
 
 import openai
 import tiktoken
-from llm.basellm import BaseLLM
+from llm.basellm import BaseLLM, ClientErrorResponse, json_answer
 from retry import retry
 
 
+def json_response_format(schema: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    OpenAI response_format for JSON output: schema constrained when a schema is given, plain JSON mode otherwise.
+    """
+    if schema is None:
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema.get("title", "result"), "schema": schema},
+    }
+
+
 class OpenAIChat(BaseLLM):
     """Wrapper around OpenAI Chat large language models."""
 
@@ -24,29 +41,81 @@ class OpenAIChat(BaseLLM):
         self.max_tokens = max_tokens
         self.temperature = temperature
 
-    @retry(tries=3, delay=1)
+    # Exponential backoff with jitter so that retries from concurrent callers do not arrive in lockstep
+    @retry(tries=3, delay=1, backoff=2, jitter=(0, 1))
     def generate(
         self,
         messages: List[str],
+        response_format: Optional[Dict[str, Any]] = None,
     ) -> str:
         try:
             completions = openai.ChatCompletion.create(
-                model=self.model,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                messages=messages,
+                **self._completion_params(messages, response_format)
             )
             return completions.choices[0].message.content
         # catch context length / do not retry
         except openai.error.InvalidRequestError as e:
-            return str(f"Error: {e}")
+            return ClientErrorResponse(f"Error: {e}")
         # catch authorization errors / do not retry
         except openai.error.AuthenticationError as e:
-            return "Error: The provided OpenAI API key is invalid"
+            return ClientErrorResponse("Error: The provided OpenAI API key is invalid")
         except Exception as e:
             print(f"Retrying LLM call {e}")
             raise Exception()
 
+    def _completion_params(
+        self, messages: List[str], response_format: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        params = {
+            "model": self.model,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "messages": messages,
+        }
+        if response_format is not None:
+            params["response_format"] = response_format
+        return params
+
+    async def agenerate(
+        self,
+        messages: List[str],
+        tries: int = 3,
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        delay = 1
+        for attempt in range(1, tries + 1):
+            try:
+                completions = await openai.ChatCompletion.acreate(
+                    **self._completion_params(messages, response_format)
+                )
+                return completions.choices[0].message.content
+            # catch context length / do not retry
+            except openai.error.InvalidRequestError as e:
+                return ClientErrorResponse(f"Error: {e}")
+            # catch authorization errors / do not retry
+            except openai.error.AuthenticationError as e:
+                return ClientErrorResponse("Error: The provided OpenAI API key is invalid")
+            except Exception as e:
+                if attempt == tries:
+                    raise
+                print(f"Retrying LLM call {e}")
+                await asyncio.sleep(delay + random.uniform(0, 1))
+                delay *= 2
+
+    def generate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        return json_answer(
+            self.generate(messages, response_format=json_response_format(schema))
+        )
+
+    async def agenerate_json(
+        self, messages: List[str], schema: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        return json_answer(
+            await self.agenerate(messages, response_format=json_response_format(schema))
+        )
+
     async def generateStreaming(
         self,
         messages: List[str],
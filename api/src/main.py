@@ -1,7 +1,9 @@
+import asyncio
 import os
-from typing import Optional
+from typing import Any, Dict, List, Optional, Union
 from components.company_report import CompanyReport
 import requests
+import httpx
 import logging
 
 from components.question_proposal_generator import (
@@ -11,6 +13,7 @@ import json
 import re
 from components.ollama_prompt_creator import run_with_chunk_logging
 from components.ollama_prompt_creator import product_discovery_workflow
+from components.batch_ingestion import backup_product_report, build_product_report, graph_writer, ingest_documents
 from components.self_attention_chunking_workflow import self_attention_chunking
 from components.patent_summary_workflow import workflow_classifier
 from components.ollama_summarize_cypher_result import OllamaSummarizeCypherResult
@@ -22,14 +25,20 @@ from components.unstructured_data_extractor import (
     DataExtractorWithSchema,
 )
 from driver.neo4j import Neo4jDatabase
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fewshot_examples import get_fewshot_examples
 from llm.openai import OpenAIChat
-from llm.ollamaapi import OllamaChat
+from llm.ollamaapi import OllamaChat, OLLAMA_HOST, OLLAMA_KEEP_ALIVE
+from llm.ollama_lifecycle import model_manager_from_env
+from llm.hedged import HedgedLLM
+from llm.cassette import with_cassette
 from pydantic import BaseModel
+from utils.chunking import iter_decoded_text
+from utils.job_runner import JobManager
 from utils.unstructured_data_utils import save_intermediate_results_to_csv, data_to_cypher
+from utils.patent_metadata import patentNumberRegex
 from utils.tokenizers import gpt_tokenizer, llama_tokenizer, regex_tokenizer
 
 
@@ -46,6 +55,8 @@ class ImportPayload(BaseModel):
     input: str
     neo4j_schema: Optional[str]
     api_key: Optional[str]
+    # Resumable ingestion: sending the same job_id again resumes the job from its last completed chunk
+    job_id: Optional[str]
 
 
 class questionProposalPayload(BaseModel):
@@ -82,6 +93,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Keeps the local Ollama models warm so the first user query does not pay the load time
+ollama_model_manager = model_manager_from_env()
+
+
+@app.on_event("startup")
+async def preload_ollama_models():
+    ollama_model_manager.start()
+
+
+@app.on_event("shutdown")
+async def stop_ollama_keep_alive():
+    await ollama_model_manager.stop()
+
+
+def update_chemical_keys() -> None:
+    try:
+        graph_writer().ensure_chemical_keys()
+    except Exception as e:
+        # The chemicals are then resolved against the keys already in the graph
+        print(f"Error updating the chemical keys: {e}")
+
+
+@app.on_event("startup")
+async def start_chemical_keys_update():
+    # The backfill can scan the whole graph, it runs in a worker thread without delaying the startup
+    app.state.chemical_keys_update = asyncio.create_task(asyncio.to_thread(update_chemical_keys))
+
+
 @app.get("/lightrag/chunks")
 def get_lightrag_chunks():
     """Proxy to LightRAG /chunks endpoint."""
@@ -189,9 +228,12 @@ async def websocket_endpoint(websocket: WebSocket):
             api_key = openai_api_key if openai_api_key else data.get("api_key")
 
 
-            default_llm = OpenAIChat(
-                openai_api_key=api_key,
-                model_name=data.get("model_name", "gpt-4o"),
+            default_llm = with_cassette(
+                OpenAIChat(
+                    openai_api_key=api_key,
+                    model_name=data.get("model_name", "gpt-4o"),
+                ),
+                "text2cypher",
             )
 
             summarize_results = SummarizeCypherResult(
@@ -265,14 +307,8 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.send_json({"type": "error", "detail": message})
 
     async def onToken(token):
-        delta = token["choices"][0]["delta"]
-        if "content" not in delta:
-            return
-        content = delta["content"]
-        if token["choices"][0]["finish_reason"] == "stop":
-            await websocket.send_json({"type": "end", "output": content})
-        else:
-            await websocket.send_json({"type": "stream", "output": content})
+        # Ollama tokens arrive as plain strings; the final "end" message is sent once the summary completes
+        await websocket.send_json({"type": "stream", "output": token})
 
     async def send_output(content, is_end=False):
         message_type = "end" if is_end else "stream"
@@ -552,6 +588,163 @@ dummy_product_3 = {
 
 
 
+def save_product_report(finalized_information: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the product report for the frontend, back it up as JSON and store it in the knowledge graph.
+    :param finalized_information: The output of product_discovery_workflow.
+    :return: The report object.
+    """
+    # Build JSON object for the frontend
+    response_object = build_product_report(finalized_information)
+
+    # Save the response_object to a JSON file using patent_no as the filename
+    backup_product_report(response_object)
+
+    # my_patent = {
+    #         "type": "cosmetic_product_patent",
+    #         "patent_no": "US 20240115471 A1",
+    #         "inventor_names": [
+    #             "Kazuhiko Maruyama",
+    #             "Tomoko Mizuno"
+    #         ],
+    #         "cpcc_codes": [
+    #             "A61K8/342",
+    #             "A61K8/375",
+    #             "A61K8/39",
+    #             "A61Q19/00",
+    #             "A61K8/442",
+    #             "A61K8/927",
+    #             "A61K8/062",
+    #             "A61K8/44",
+    #             "A61Q5/02",
+    #             "A61Q1/06",
+    #             "A61Q1/08",
+    #             "A61Q19/10",
+    #             "A61K2800/10",
+    #             "A61Q1/10",
+    #             "A61Q1/04",
+    #             "A61K2800/596"
+    #         ],
+    #         "assignee": "L'OREAL",
+    #         "task_type": "product discover workflow",
+    #         "properties": {
+    #             "product_name": "Advanced Emollient Skin Treatment",
+    #             "description": "This innovative emulsion combines a unique blend of polyglyceryl esters, natural oils, and silicone derivatives to create a non-greasy, stable formulation that enhances skin hydration and texture. Designed for effective application, it utilizes a carefully balanced ratio of surfactants and emollients to provide a smooth, luxurious feel while delivering therapeutic benefits for skin and hair care.",
+    #             "functional_roles": {
+    #                 "Emollient": [
+    #                 {"chemical": "Oil", "weight": "0.01% to 15% (preferably 0.1% to 12%, more preferably 1% to 9%)"},
+    #                 {"chemical": "Diethyl sebacate", "weight": "Not specified"},
+    #                 {"chemical": "Isopropyl lauroyl sarcosinate", "weight": "Not specified"},
+    #                 {"chemical": "Diisopropyl sebacate", "weight": "Not specified"},
+    #                 {"chemical": "Bis(2-ethylhexyl) sebacate", "weight": "Not specified"},
+    #                 {"chemical": "Diisopropyl adipate", "weight": "Not specified"},
+    #                 {"chemical": "Di-n-propyl adipate", "weight": "Not specified"},
+    #                 {"chemical": "Dioctyl adipate", "weight": "Not specified"},
+    #                 {"chemical": "Bis(2-ethylhexyl) adipate", "weight": "Not specified"},
+    #                 {"chemical": "Diisostearyl adipate", "weight": "Not specified"},
+    #                 {"chemical": "Bis(2-ethylhexyl) maleate", "weight": "Not specified"},
+    #                 {"chemical": "Triisopropyl citrate", "weight": "Not specified"},
+    #                 {"chemical": "Triisocetyl citrate", "weight": "Not specified"},
+    #                 {"chemical": "Triisostearyl citrate", "weight": "Not specified"},
+    #                 {"chemical": "Glyceryl trilactate", "weight": "Not specified"},
+    #                 {"chemical": "Glyceryl trioctanoate", "weight": "Not specified"},
+    #                 {"chemical": "Trioctyldodecyl citrate", "weight": "Not specified"},
+    #                 {"chemical": "Trioleyl citrate", "weight": "Not specified"},
+    #                 {"chemical": "Neopentyl glycol diheptanoate", "weight": "Not specified"},
+    #                 {"chemical": "Diethylene glycol diisononanoate", "weight": "Not specified"},
+    #                 {"chemical": "Sugar esters and diesters of C6-C30 fatty acids", "weight": "Not specified"},
+    #                 {"chemical": "Sucrose monooleate", "weight": "Not specified"},
+    #                 {"chemical": "Glucose monooleate", "weight": "Not specified"},
+    #                 {"chemical": "Methylglucose dioleate", "weight": "Not specified"},
+    #                 {"chemical": "Oleates", "weight": "Not specified"},
+    #                 {"chemical": "Laurates", "weight": "Not specified"},
+    #                 {"chemical": "Palmitates", "weight": "Not specified"},
+    #                 {"chemical": "Myristates", "weight": "Not specified"},
+    #                 {"chemical": "Behenates", "weight": "Not specified"},
+    #                 {"chemical": "Cocoates", "weight": "Not specified"},
+    #                 {"chemical": "Stearates", "weight": "Not specified"},
+    #                 {"chemical": "Linoleates", "weight": "Not specified"},
+    #                 {"chemical": "Linolenates", "weight": "Not specified"},
+    #                 {"chemical": "Caprates", "weight": "Not specified"},
+    #                 {"chemical": "Arachidonates", "weight": "Not specified"},
+    #                 {"chemical": "Oleopalmitate", "weight": "Not specified"},
+    #                 {"chemical": "Oleostearate", "weight": "Not specified"},
+    #                 {"chemical": "Palmitostearate", "weight": "Not specified"},
+    #                 {"chemical": "Pentaerythrityl tetraethyl hexanoate", "weight": "Not specified"},
+    #                 {"chemical": "2-ethylhexyl hexanoate", "weight": "Not specified"},
+    #                 {"chemical": "Ethyl laurate", "weight": "Not specified"},
+    #                 {"chemical": "Cetyl octanoate", "weight": "Not specified"},
+    #                 {"chemical": "Octyldodecyl octanoate", "weight": "Not specified"},
+    #                 {"chemical": "Isodecyl neopentanoate", "weight": "Not specified"},
+    #                 {"chemical": "Myristyl propionate", "weight": "Not specified"},
+    #                 {"chemical": "2-ethylhexyl 2-ethylhexanoate", "weight": "Not specified"},
+    #                 {"chemical": "2-ethylhexyl octanoate", "weight": "Not specified"},
+    #                 {"chemical": "2-ethylhexyl caprylate/caprate", "weight": "Not specified"},
+    #                 {"chemical": "Methyl palmitate", "weight": "Not specified"},
+    #                 {"chemical": "Ethyl palmitate", "weight": "Not specified"},
+    #                 {"chemical": "Isopropyl palmitate", "weight": "Not specified"}
+    #                 ],
+    #                 "Emulsifier": [
+    #                 {"chemical": "First polyglyceryl fatty acid ester (C6-C22)", "weight": "0.01% to 20% (preferably 0.05% to 15%, more preferably 0.1% to 10%)"},
+    #                 {"chemical": "Second polyglyceryl fatty acid ester (C24-C32)", "weight": "Weight ratio more than 15 and less than 35 with first polyglyceryl fatty acid ester"},
+    #                 {"chemical": "PG2 caprylate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 sesquicaprylate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 dicaprylate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 tricaprylate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 caprate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 sesquicaprate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 dicaprate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 tricaprate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 laurate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 sesquilaurate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 dilaurate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 trilaurate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 myristate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 sesquimyristate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 dimyristate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 trimyristate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 stearate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 sesquistearate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 distearate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 tristearate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 isostearate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 sesquiisostearate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 diisostearate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 triisostearate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 oleate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 sesquioleate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 dioleate", "weight": "Not specified"},
+    #                 {"chemical": "PG2 trioleate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 caprylate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 sesquicaprylate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 dicaprylate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 tricaprylate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 caprate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 sesquicaprate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 dicaprate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 tricaprate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 laurate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 sesquilaurate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 dilaurate", "weight": "Not specified"},
+    #                 {"chemical": "PG3 trilaurate", "weight": "Not specified"}
+    #                 ]
+    #             }
+    #         }
+    #     }
+
+
+
+
+    # # Save the analysed information in the knowledge graph database 
+    db = Neo4jDatabase(host="bolt://kg:7688", user="neo4j", password="your12345", read_only=False)
+    db.insert_patent_data(response_object)
+
+    # # Dummy ingridient insert- 
+    # db.insert_real_world_product(dummy_product_1)
+
+    return response_object
+
+
 @app.post("/api/make_product_report")
 async def root(payload: ImportPayload):
     """
@@ -565,182 +758,45 @@ async def root(payload: ImportPayload):
     api_key = openai_api_key if openai_api_key else payload.api_key
 
     try:        
-        finalized_information = await product_discovery_workflow(data=payload.input, provider="openai")
+        finalized_information = await product_discovery_workflow(
+            data=payload.input, provider="openai", job_id=payload.job_id
+        )
         print("The payload input is : ", payload.input)
        
         # Log Extraction Result
         print("Finalized Information:", finalized_information)
 
-        # Build JSON object for the frontend
-        response_object = {
-            "type": "cosmetic_product_patent",
-            "patent_no": finalized_information.get("patent_no",""),
-            "inventor_names": finalized_information.get("inventor_names",""),
-            "cpcc_codes": finalized_information.get("cpcc_codes",""),
-            "assignee":finalized_information.get("assignee_information",""),
-            "task_type": "product discover workflow",
-            "properties": {
-                "product_name": finalized_information.get("product_name", ""),
-                "description":finalized_information.get("description", ""),
-                "functional_roles": finalized_information.get("functional_roles", [])
-            }
-        }
+        await asyncio.to_thread(save_product_report, finalized_information)
 
-        # Save the response_object to a JSON file using patent_no as the filename
-        patent_no = response_object["patent_no"].replace(" ", "_").replace("/", "_")  # Replace unsafe characters
-        filename = f"{patent_no}.json"
-        folder_path = "./backup"  # Save all backups in a folder called "backup"
-        
-        os.makedirs(folder_path, exist_ok=True)  # Ensure the folder exists
-        filepath = os.path.join(folder_path, filename)
-        
-        with open(filepath, "w") as json_file:
-            json.dump(response_object, json_file, indent=4)
-        
-        print(f"Backup saved: {filepath}")
-
-        # my_patent = {
-        #         "type": "cosmetic_product_patent",
-        #         "patent_no": "US 20240115471 A1",
-        #         "inventor_names": [
-        #             "Kazuhiko Maruyama",
-        #             "Tomoko Mizuno"
-        #         ],
-        #         "cpcc_codes": [
-        #             "A61K8/342",
-        #             "A61K8/375",
-        #             "A61K8/39",
-        #             "A61Q19/00",
-        #             "A61K8/442",
-        #             "A61K8/927",
-        #             "A61K8/062",
-        #             "A61K8/44",
-        #             "A61Q5/02",
-        #             "A61Q1/06",
-        #             "A61Q1/08",
-        #             "A61Q19/10",
-        #             "A61K2800/10",
-        #             "A61Q1/10",
-        #             "A61Q1/04",
-        #             "A61K2800/596"
-        #         ],
-        #         "assignee": "L'OREAL",
-        #         "task_type": "product discover workflow",
-        #         "properties": {
-        #             "product_name": "Advanced Emollient Skin Treatment",
-        #             "description": "This innovative emulsion combines a unique blend of polyglyceryl esters, natural oils, and silicone derivatives to create a non-greasy, stable formulation that enhances skin hydration and texture. Designed for effective application, it utilizes a carefully balanced ratio of surfactants and emollients to provide a smooth, luxurious feel while delivering therapeutic benefits for skin and hair care.",
-        #             "functional_roles": {
-        #                 "Emollient": [
-        #                 {"chemical": "Oil", "weight": "0.01% to 15% (preferably 0.1% to 12%, more preferably 1% to 9%)"},
-        #                 {"chemical": "Diethyl sebacate", "weight": "Not specified"},
-        #                 {"chemical": "Isopropyl lauroyl sarcosinate", "weight": "Not specified"},
-        #                 {"chemical": "Diisopropyl sebacate", "weight": "Not specified"},
-        #                 {"chemical": "Bis(2-ethylhexyl) sebacate", "weight": "Not specified"},
-        #                 {"chemical": "Diisopropyl adipate", "weight": "Not specified"},
-        #                 {"chemical": "Di-n-propyl adipate", "weight": "Not specified"},
-        #                 {"chemical": "Dioctyl adipate", "weight": "Not specified"},
-        #                 {"chemical": "Bis(2-ethylhexyl) adipate", "weight": "Not specified"},
-        #                 {"chemical": "Diisostearyl adipate", "weight": "Not specified"},
-        #                 {"chemical": "Bis(2-ethylhexyl) maleate", "weight": "Not specified"},
-        #                 {"chemical": "Triisopropyl citrate", "weight": "Not specified"},
-        #                 {"chemical": "Triisocetyl citrate", "weight": "Not specified"},
-        #                 {"chemical": "Triisostearyl citrate", "weight": "Not specified"},
-        #                 {"chemical": "Glyceryl trilactate", "weight": "Not specified"},
-        #                 {"chemical": "Glyceryl trioctanoate", "weight": "Not specified"},
-        #                 {"chemical": "Trioctyldodecyl citrate", "weight": "Not specified"},
-        #                 {"chemical": "Trioleyl citrate", "weight": "Not specified"},
-        #                 {"chemical": "Neopentyl glycol diheptanoate", "weight": "Not specified"},
-        #                 {"chemical": "Diethylene glycol diisononanoate", "weight": "Not specified"},
-        #                 {"chemical": "Sugar esters and diesters of C6-C30 fatty acids", "weight": "Not specified"},
-        #                 {"chemical": "Sucrose monooleate", "weight": "Not specified"},
-        #                 {"chemical": "Glucose monooleate", "weight": "Not specified"},
-        #                 {"chemical": "Methylglucose dioleate", "weight": "Not specified"},
-        #                 {"chemical": "Oleates", "weight": "Not specified"},
-        #                 {"chemical": "Laurates", "weight": "Not specified"},
-        #                 {"chemical": "Palmitates", "weight": "Not specified"},
-        #                 {"chemical": "Myristates", "weight": "Not specified"},
-        #                 {"chemical": "Behenates", "weight": "Not specified"},
-        #                 {"chemical": "Cocoates", "weight": "Not specified"},
-        #                 {"chemical": "Stearates", "weight": "Not specified"},
-        #                 {"chemical": "Linoleates", "weight": "Not specified"},
-        #                 {"chemical": "Linolenates", "weight": "Not specified"},
-        #                 {"chemical": "Caprates", "weight": "Not specified"},
-        #                 {"chemical": "Arachidonates", "weight": "Not specified"},
-        #                 {"chemical": "Oleopalmitate", "weight": "Not specified"},
-        #                 {"chemical": "Oleostearate", "weight": "Not specified"},
-        #                 {"chemical": "Palmitostearate", "weight": "Not specified"},
-        #                 {"chemical": "Pentaerythrityl tetraethyl hexanoate", "weight": "Not specified"},
-        #                 {"chemical": "2-ethylhexyl hexanoate", "weight": "Not specified"},
-        #                 {"chemical": "Ethyl laurate", "weight": "Not specified"},
-        #                 {"chemical": "Cetyl octanoate", "weight": "Not specified"},
-        #                 {"chemical": "Octyldodecyl octanoate", "weight": "Not specified"},
-        #                 {"chemical": "Isodecyl neopentanoate", "weight": "Not specified"},
-        #                 {"chemical": "Myristyl propionate", "weight": "Not specified"},
-        #                 {"chemical": "2-ethylhexyl 2-ethylhexanoate", "weight": "Not specified"},
-        #                 {"chemical": "2-ethylhexyl octanoate", "weight": "Not specified"},
-        #                 {"chemical": "2-ethylhexyl caprylate/caprate", "weight": "Not specified"},
-        #                 {"chemical": "Methyl palmitate", "weight": "Not specified"},
-        #                 {"chemical": "Ethyl palmitate", "weight": "Not specified"},
-        #                 {"chemical": "Isopropyl palmitate", "weight": "Not specified"}
-        #                 ],
-        #                 "Emulsifier": [
-        #                 {"chemical": "First polyglyceryl fatty acid ester (C6-C22)", "weight": "0.01% to 20% (preferably 0.05% to 15%, more preferably 0.1% to 10%)"},
-        #                 {"chemical": "Second polyglyceryl fatty acid ester (C24-C32)", "weight": "Weight ratio more than 15 and less than 35 with first polyglyceryl fatty acid ester"},
-        #                 {"chemical": "PG2 caprylate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 sesquicaprylate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 dicaprylate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 tricaprylate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 caprate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 sesquicaprate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 dicaprate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 tricaprate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 laurate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 sesquilaurate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 dilaurate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 trilaurate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 myristate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 sesquimyristate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 dimyristate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 trimyristate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 stearate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 sesquistearate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 distearate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 tristearate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 isostearate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 sesquiisostearate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 diisostearate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 triisostearate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 oleate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 sesquioleate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 dioleate", "weight": "Not specified"},
-        #                 {"chemical": "PG2 trioleate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 caprylate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 sesquicaprylate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 dicaprylate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 tricaprylate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 caprate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 sesquicaprate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 dicaprate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 tricaprate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 laurate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 sesquilaurate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 dilaurate", "weight": "Not specified"},
-        #                 {"chemical": "PG3 trilaurate", "weight": "Not specified"}
-        #                 ]
-        #             }
-        #         }
-        #     }
-           
+        return ""
 
-        
+    except Exception as e:
+        print(e)
+        raise HTTPException(status_code=500, detail=f"Error: {e}")
 
-        # # Save the analysed information in the knowledge graph database 
-        db = Neo4jDatabase(host="bolt://kg:7688", user="neo4j", password="your12345", read_only=False)
-        db.insert_patent_data(response_object)
 
-        # # Dummy ingridient insert- 
-        # db.insert_real_world_product(dummy_product_1)
+@app.post("/api/make_product_report/stream")
+async def root(
+    request: Request, provider: str = "openai", api_key: Optional[str] = None, job_id: Optional[str] = None
+):
+    """
+    Streaming variant of /api/make_product_report. The patent is sent as the raw request body
+    (plain text, a chunked upload or a file via curl --data-binary @patent.txt) and chunks are
+    extracted as they arrive, so memory stays bounded and processing starts before the upload ends.
+    Uploading the patent again with the same job_id resumes the job from its checkpoints.
+    """
+    if not openai_api_key and not api_key:
+        raise HTTPException(
+            status_code=403,
+            detail="Please set OPENAI_API_KEY environment variable or send it as api_key in the query string",
+        )
 
+    try:
+        finalized_information = await product_discovery_workflow(
+            data=iter_decoded_text(request.stream()), provider=provider, job_id=job_id
+        )
+        print("Finalized Information:", finalized_information)
+        await asyncio.to_thread(save_product_report, finalized_information)
         return ""
 
     except Exception as e:
@@ -864,6 +920,138 @@ async def root(payload: ImportPayload):
         return f"Error: {e}"
 
 
+@app.post("/ollama/data2cypher/stream")
+async def root(request: Request, provider: str = "openai"):
+    """
+    Streaming variant of /ollama/data2cypher, the document is the raw request body and is extracted chunk by chunk as it arrives.
+    """
+    try:
+        result, chunks = await run_with_chunk_logging(data=iter_decoded_text(request.stream()), provider=provider)
+        print("Extracted result: " + str(result))
+
+        save_intermediate_results_to_csv([{"stage": "Extraction", "chunks": chunks}])
+
+        return {"data": result}
+
+    except Exception as e:
+        print(e)
+        return f"Error: {e}"
+
+
+#####################################################################################
+# Background jobs: the long workflows answer with a job id right away and run in the job workers
+#####################################################################################
+
+class JobPayload(BaseModel):
+    input: str
+    provider: Optional[str] = "openai"
+    # Submitting a failed job_id again retries it from its checkpoints
+    job_id: Optional[str]
+
+
+async def product_report_job(params: Dict[str, Any], job_id: str) -> Dict[str, Any]:
+    finalized_information = await product_discovery_workflow(
+        data=params["input"], provider=params["provider"], job_id=job_id
+    )
+    # Neo4j and file writes, off the event loop (and the lease renewals of the job)
+    await asyncio.to_thread(save_product_report, finalized_information)
+    return finalized_information
+
+
+async def data2cypher_job(params: Dict[str, Any], job_id: str) -> Dict[str, Any]:
+    result, chunks = await run_with_chunk_logging(data=params["input"], provider=params["provider"])
+    save_intermediate_results_to_csv([{"stage": "Extraction", "chunks": chunks}])
+    return {"data": result}
+
+
+async def document_summary_job(params: Dict[str, Any], job_id: str) -> Dict[str, Any]:
+    return {"sections": await workflow_classifier(data=params["input"], provider=params["provider"])}
+
+
+async def batch_product_report_job(params: Dict[str, Any], job_id: str) -> Dict[str, Any]:
+    documents = [(document["name"], document["input"]) for document in params["documents"]]
+    return await ingest_documents(documents, provider=params["provider"])
+
+
+job_manager = JobManager()
+job_manager.register("product_report", product_report_job)
+job_manager.register("data2cypher", data2cypher_job)
+job_manager.register("document_summary", document_summary_job)
+job_manager.register("batch_product_report", batch_product_report_job)
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    job_manager.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    # Running jobs go back to "pending" in the job store and are resumed from their checkpoints by the next worker
+    await job_manager.stop()
+
+
+@app.post("/api/jobs/{kind}")
+async def root(kind: str, payload: JobPayload):
+    """
+    Start a background job: "product_report" (/api/make_product_report), "data2cypher" (/ollama/data2cypher)
+    or "document_summary" (/api/detail_document_summary). Poll GET /api/jobs/{job_id} or subscribe to
+    /api/jobs/{job_id}/ws for the progress and the result.
+    """
+    if kind not in job_manager.handlers:
+        raise HTTPException(status_code=404, detail=f"Unknown job kind: {kind}")
+    job_id = await job_manager.submit(kind, {"input": payload.input, "provider": payload.provider}, job_id=payload.job_id)
+    return {"job_id": job_id, "status": job_manager.status(job_id)["status"]}
+
+
+class BatchDocument(BaseModel):
+    name: str
+    input: str
+
+
+class BatchPayload(BaseModel):
+    documents: List[BatchDocument]
+    provider: Optional[str] = "openai"
+    job_id: Optional[str]
+
+
+@app.post("/api/batch/make_product_report")
+async def root(payload: BatchPayload):
+    """
+    Product reports of many patents as one background job. The chunks of all the documents share one LLM
+    concurrency budget and the reports are written to the graph in batches. The job result is the
+    throughput report of the batch.
+    """
+    params = {
+        "documents": [document.dict() for document in payload.documents],
+        "provider": payload.provider,
+    }
+    job_id = await job_manager.submit("batch_product_report", params, job_id=payload.job_id)
+    return {"job_id": job_id, "status": job_manager.status(job_id)["status"]}
+
+
+@app.get("/api/jobs/{job_id}")
+async def root(job_id: str):
+    job = job_manager.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+@app.websocket("/api/jobs/{job_id}/ws")
+async def websocket_endpoint(websocket: WebSocket, job_id: str):
+    """
+    Progress events (stage, chunks done and failed, prompt tokens) of a job, then its final status and result.
+    """
+    await websocket.accept()
+    try:
+        async for event in job_manager.subscribe(job_id):
+            await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        print("disconnected")
+
+
 class companyReportPayload(BaseModel):
     company: str
     api_key: Optional[str]
@@ -927,17 +1115,26 @@ async def tokenize_text(payload: TokenizerPayload):
 
 # Define the payload structure for the Ollama endpoint
 class OllamaPayload(BaseModel):
-    prompt: str  # User's prompt
+    prompt: Optional[str] = None  # User's prompt
     model: Optional[str] = "llama3.2"  # Default model
+    system_message: Optional[str] = None  # Optional system prompt sent before the user's prompt
+    messages: Optional[List[Dict[str, str]]] = None  # Full chat history, takes precedence over prompt
+    keep_alive: Optional[str] = None  # Overrides OLLAMA_KEEP_ALIVE for this request
+    options: Optional[Dict[str, Any]] = None  # Passed through to Ollama (temperature, num_predict, ...)
+    stream: Optional[bool] = False  # Stream Ollama's NDJSON chunks back as they are generated
+    format: Optional[Union[str, Dict[str, Any]]] = None  # "json" or a JSON schema to constrain the answer
+
+
+OLLAMA_CHAT_URI = f"{OLLAMA_HOST}/api/chat"
 
 
 @app.post("/ollama/chat")
 async def ollama_completion(payload: OllamaPayload):
     """
-    Endpoint to interact with the Ollama Chat API
+    Endpoint to interact with the Ollama Chat API.
+    With "stream": true the NDJSON chunks from Ollama are forwarded line by line,
+    so the first token reaches the client as soon as the model produces it.
     """
-    OLLAMA_URI = "http://host.docker.internal:11434/api/chat"
-
     print("The Received prompt is :" , payload.prompt)
 
     # Adjust model and system message based on condition
@@ -945,24 +1142,61 @@ async def ollama_completion(payload: OllamaPayload):
     
     if payload.model == "auto":
         model = "llama3.1"
+
+    messages = payload.messages
+    if not messages:
+        if payload.prompt is None:
+            raise HTTPException(status_code=422, detail="Either prompt or messages is required")
+        messages = [{"role": "user", "content": payload.prompt}]
+        if payload.system_message:
+            messages.insert(0, {"role": "system", "content": payload.system_message})
+
+    request_body = {
+        "model": model,
+        "messages": messages,
+        "stream": bool(payload.stream),
+        "keep_alive": payload.keep_alive or OLLAMA_KEEP_ALIVE,
+    }
+    if payload.options:
+        request_body["options"] = payload.options
+    if payload.format:
+        request_body["format"] = payload.format
+
+    if payload.stream:
+        client = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0))
+        try:
+            response = await client.send(
+                client.build_request("POST", OLLAMA_CHAT_URI, json=request_body),
+                stream=True,
+            )
+        except httpx.RequestError as e:
+            await client.aclose()
+            raise HTTPException(status_code=500, detail=f"Error communicating with Ollama: {str(e)}")
+        if response.status_code != 200:
+            detail = (await response.aread()).decode(errors="replace")
+            await response.aclose()
+            await client.aclose()
+            raise HTTPException(status_code=500, detail=f"Error communicating with Ollama: {detail}")
+
+        async def forward_ndjson():
+            try:
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        yield line + "\n"
+            finally:
+                await response.aclose()
+                await client.aclose()
+
+        return StreamingResponse(forward_ndjson(), media_type="application/x-ndjson")
+
     try:
-        response = requests.post(
-            OLLAMA_URI,
-            json={
-                "model": model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": payload.prompt
-                    },
-                ],
-                "stream": False
-            },
-        )
+        # Async client: concurrent chat requests are not serialized on the event loop
+        async with httpx.AsyncClient(timeout=httpx.Timeout(None, connect=10.0)) as client:
+            response = await client.post(OLLAMA_CHAT_URI, json=request_body)
         logging.debug(f"Raw response: {response.text}")  # Log the raw response
         response.raise_for_status()
         return {"generated_text": response.json()}
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Error communicating with Ollama: {str(e)}")
     except ValueError as e:  # Handle JSON decoding errors
         raise HTTPException(
@@ -972,9 +1206,9 @@ async def ollama_completion(payload: OllamaPayload):
     
 def extract_patent_no(prompt: str) -> str:
     """
-    Extract the patent number from the prompt using regex.
+    Extract the US, EP or WO patent number from the prompt, as written, the graph is matched on the stored number.
     """
-    patent_no_match = re.search(r"\bUS\s?\d{4,}\s?[A-Z]?\d*\b", prompt)
+    patent_no_match = patentNumberRegex.search(prompt)
     return patent_no_match.group(0) if patent_no_match else None
     
 
@@ -1054,8 +1288,24 @@ load_dotenv(ROOT_DIR / ".env")
 api_key = "api-key"
 
 
-llm = OpenAIChat(
-    openai_api_key=api_key, model_name="gpt-4o-mini", max_tokens=4096
+# Local Ollama model (e.g. "llama3.1") used as hedge / fallback, opt-in: by default only OpenAI is called
+LLM_FALLBACK_OLLAMA_MODEL = os.getenv("LLM_FALLBACK_OLLAMA_MODEL", "")
+
+# OpenAI first, the local Ollama model as hedge / fallback once the p95 deadline passes
+llm_providers = [
+    OpenAIChat(openai_api_key=api_key, model_name="gpt-4o-mini", max_tokens=4096)
+]
+if LLM_FALLBACK_OLLAMA_MODEL:
+    llm_providers.append(
+        OllamaChat(model_name=LLM_FALLBACK_OLLAMA_MODEL, max_tokens=4096, temperature=0.0)
+    )
+llm = with_cassette(
+    HedgedLLM(
+        llm_providers,
+        hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95")),
+        initial_deadline=float(os.getenv("LLM_HEDGE_INITIAL_DEADLINE", "10")),
+    ),
+    "patent_workflows",
 )
 
 # Helper Functions - 
@@ -1071,15 +1321,15 @@ async def openai_generate(prompt: str) -> str:
     ]
     print(f"Sending request to OpenAI endpoint with messages: {messages}")
     
-    # Assuming `llm.generate()` is correctly configured to accept the messages
-    output = llm.generate(messages)
+    # Hedged call: a slow upstream completion is raced against the fallback provider
+    output = await llm.agenerate(messages)
     print("The output is:", output)
     return output
 
 
 @app.post("/ollama/cyphered")
 async def ollama_completion(payload: OllamaPayload):
-    OLLAMA_URI = "http://host.docker.internal:11434/api/chat"
+    OLLAMA_URI = OLLAMA_CHAT_URI
     prompt = payload.prompt
     model = payload.model if payload.model != "auto" else "llama3.1"
     
@@ -1110,7 +1360,8 @@ async def ollama_completion(payload: OllamaPayload):
             "messages": [
                 {"role": "user", "content": website_flag_prompt}
             ],
-            "stream": False
+            "stream": False,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
         }
 
         website_flag_response = requests.post(OLLAMA_URI, json=website_flag_request)
@@ -1164,7 +1415,8 @@ async def ollama_completion(payload: OllamaPayload):
                 "messages": [
                     {"role": "user", "content": patent_flag_prompt}
                 ],
-                "stream": False
+                "stream": False,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
             }
 
             llm_response = requests.post(OLLAMA_URI, json=llm_flag_request)
@@ -1214,7 +1466,8 @@ async def ollama_completion(payload: OllamaPayload):
                 "messages": [
                     {"role": "user", "content": llama_prompt},
                 ],
-                "stream": False
+                "stream": False,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
             },
         )
         response.raise_for_status()
@@ -1411,7 +1664,13 @@ async def health():
 
 @app.get("/ready")
 async def readiness_check():
-    return {"status": "ok"}
+    """
+    Ready only once every preloaded Ollama model is resident, so the first user query is fast.
+    """
+    ollama_status = ollama_model_manager.status()
+    if not ollama_model_manager.ready:
+        return JSONResponse(status_code=503, content={"status": "loading", "ollama": ollama_status})
+    return {"status": "ok", "ollama": ollama_status}
 
 
 if __name__ == "__main__":
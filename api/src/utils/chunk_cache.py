@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from utils.data_dir import data_path
+
+# SQLite file of the chunk result cache. An empty value disables the cache.
+CHUNK_CACHE_PATH = os.getenv("CHUNK_CACHE_PATH", data_path("chunk_cache.sqlite3"))
+
+# Model answering the calls of each provider
+PROVIDER_MODELS = {"openai": "gpt-4o-mini", "ollama": "llama3.1"}
+
+whitespaceRegex = re.compile(r"\s+")
+
+
+def provider_model(provider: str) -> str:
+    """
+    Provider and model name, part of the chunk cache key so results of different models are never mixed.
+    """
+    return f"{provider}:{PROVIDER_MODELS.get(provider, 'default')}"
+
+
+def normalize_chunk(text: str) -> str:
+    # Re-wrapped or re-indented text is the same content
+    return whitespaceRegex.sub(" ", text).strip()
+
+
+def is_cacheable(value: Any) -> bool:
+    # Failed calls are reported as "Error: ..." strings or None, those are retried next time
+    if value is None:
+        return False
+    if isinstance(value, str):
+        return not value.startswith(("Error:", "Invalid JSON received", "ValueError:", "Unexpected error:"))
+    return True
+
+
+class ChunkCache:
+    """
+    Persistent, content-addressed store of per-chunk LLM results.
+    Results are keyed by a hash of the normalized chunk text, the prompt template version and the model,
+    so repeated text (boilerplate, re-uploaded documents) never hits the LLM twice.
+    """
+
+    def __init__(self, path: str = CHUNK_CACHE_PATH) -> None:
+        """
+        :param path: SQLite database file, created on first use.
+        """
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunk_results (
+                    key TEXT PRIMARY KEY,
+                    template TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    @staticmethod
+    def key(text: str, template: str, model: str) -> str:
+        """
+        :param text: The chunk (or any prompt input) the result was computed from.
+        :param template: Name and version of the prompt template, e.g. "graph-extraction-v1".
+        :param model: Provider and model that produced the result.
+        """
+        content = "\0".join([template, model, normalize_chunk(text)])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT result FROM chunk_results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, template: str, model: str, value: Any) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO chunk_results (key, template, model, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, template, model, json.dumps(value), time.time()),
+            )
+
+    async def get_or_compute(
+        self, text: str, template: str, model: str, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        Return the cached result for the chunk, or compute it and store it when the call succeeded.
+        The SQLite reads and writes run in a worker thread, off the event loop.
+        :param compute: Coroutine function producing a JSON serializable result.
+        """
+        key = self.key(text, template, model)
+        cached = await asyncio.to_thread(self.get, key)
+        if cached is not None:
+            return cached
+        value = await compute()
+        if is_cacheable(value):
+            await asyncio.to_thread(self.set, key, template, model, value)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM chunk_results").fetchone()[0]
+        return {"path": self.path, "entries": entries, "hits": self.hits, "misses": self.misses}
+
+
+_chunk_cache: Optional[ChunkCache] = None
+
+
+def get_chunk_cache() -> Optional[ChunkCache]:
+    """
+    The process wide chunk cache, or None when CHUNK_CACHE_PATH is empty.
+    """
+    global _chunk_cache
+    if _chunk_cache is None and CHUNK_CACHE_PATH:
+        _chunk_cache = ChunkCache(CHUNK_CACHE_PATH)
+    return _chunk_cache
+
+
+async def cached_chunk_result(
+    text: str, template: str, model: str, compute: Callable[[], Awaitable[Any]]
+) -> Any:
+    """
+    get_or_compute on the process wide cache, or just compute when the cache is disabled.
+    """
+    cache = get_chunk_cache()
+    if cache is None:
+        return await compute()
+    return await cache.get_or_compute(text, template, model, compute)
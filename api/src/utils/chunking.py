@@ -0,0 +1,171 @@
+import codecs
+import re
+from bisect import bisect_left, bisect_right
+from typing import Any, AsyncIterator, List, NamedTuple, Optional, Union
+
+import tiktoken
+
+DEFAULT_ENCODING = "cl100k_base"
+# Rough characters per token, used to decide when enough streamed text is buffered to cut chunks
+CHARS_PER_TOKEN = 4
+
+# A sentence ends with ., ! or ? (optionally followed by a closing quote or bracket) and whitespace, or at a blank line
+sentenceBoundaryRegex = re.compile(r"[.!?][\"')\]]?\s+|\n\s*\n")
+
+
+class Chunk(NamedTuple):
+    text: str
+    start: int  # character offset of the chunk in the source text
+    end: int
+    token_count: int
+
+
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> Any:
+    # tiktoken caches encodings, so this is cheap after the first call
+    return tiktoken.get_encoding(encoding_name)
+
+
+def encoding_for_llm(llm: Any) -> Any:
+    """
+    Tokenizer matching an LLM wrapper: the tiktoken encoding of its model when tiktoken knows it, cl100k_base otherwise.
+    """
+    model = getattr(llm, "model", None)
+    if model:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            pass
+    return get_encoding()
+
+
+def sentence_token_boundaries(text: str, offsets: List[int]) -> List[int]:
+    """
+    Token indices at which a new sentence starts.
+    :param text: The source text.
+    :param offsets: Character offset of every token, as returned by decode_with_offsets.
+    """
+    boundaries = []
+    for match in sentenceBoundaryRegex.finditer(text):
+        index = bisect_left(offsets, match.end())
+        # Only cut where a token starts exactly at the sentence start
+        if index < len(offsets) and offsets[index] == match.end():
+            boundaries.append(index)
+    return boundaries
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int,
+    overlap_tokens: int = 0,
+    snap_to_sentences: bool = False,
+    min_fill: float = 0.5,
+    encoding: Optional[Any] = None,
+) -> List[Chunk]:
+    """
+    Split text into chunks of at most max_tokens tokens.
+    The text is tokenized once and cut on token boundaries, so the work is linear in the document length.
+    :param text: The text to split.
+    :param max_tokens: Token budget of every chunk.
+    :param overlap_tokens: Tokens repeated at the start of the next chunk.
+    :param snap_to_sentences: Cut at the last sentence boundary inside the budget when possible.
+    :param min_fill: With sentence snapping, never cut before this fraction of the budget is used.
+    :param encoding: tiktoken encoding (anything with encode and decode_with_offsets), cl100k_base by default.
+    :return: The chunks with their character offsets in text.
+    """
+    if max_tokens <= 0:
+        raise ValueError(f"max_tokens must be positive, got {max_tokens}")
+    if not 0 <= overlap_tokens < max_tokens:
+        raise ValueError("overlap_tokens must be smaller than max_tokens")
+    if not text:
+        return []
+
+    encoding = encoding or get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    _, offsets = encoding.decode_with_offsets(tokens)
+    boundaries = sentence_token_boundaries(text, offsets) if snap_to_sentences else []
+
+    chunks = []
+    start = 0
+    while start < len(tokens):
+        end = min(start + max_tokens, len(tokens))
+        if boundaries and end < len(tokens):
+            candidate = bisect_right(boundaries, end) - 1
+            if candidate >= 0 and boundaries[candidate] >= start + max_tokens * min_fill:
+                end = boundaries[candidate]
+        start_char = offsets[start]
+        end_char = offsets[end] if end < len(tokens) else len(text)
+        chunks.append(Chunk(text[start_char:end_char], start_char, end_char, end - start))
+        if end >= len(tokens):
+            break
+        start = max(end - overlap_tokens, start + 1)
+    return chunks
+
+
+def split_text_to_token_budget(text: str, max_tokens: int, **kwargs: Any) -> List[str]:
+    """
+    chunk_text returning only the stripped, non empty chunk texts.
+    """
+    return [chunk.text.strip() for chunk in chunk_text(text, max_tokens, **kwargs) if chunk.text.strip()]
+
+
+async def iter_decoded_text(byte_stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Decode a UTF-8 byte stream (e.g. Request.stream()) piece by piece, characters split across pieces are kept intact.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for piece in byte_stream:
+        text = decoder.decode(piece)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def astream_chunks(
+    texts: AsyncIterator[str],
+    max_tokens: int,
+    overlap_tokens: int = 0,
+    snap_to_sentences: bool = False,
+    encoding: Optional[Any] = None,
+) -> AsyncIterator[Chunk]:
+    """
+    Streaming variant of chunk_text: chunks are yielded as soon as enough text has arrived.
+    Only about two chunks of text are buffered, so memory stays bounded whatever the document size.
+    :param texts: The document as an async stream of text pieces.
+    :return: The chunks with their character offsets in the whole document.
+    """
+    threshold = 2 * max_tokens * CHARS_PER_TOKEN
+    buffer = ""
+    offset = 0
+    async for text in texts:
+        buffer += text
+        if len(buffer) < threshold:
+            continue
+        chunks = chunk_text(buffer, max_tokens, overlap_tokens, snap_to_sentences, encoding=encoding)
+        if len(chunks) < 2:
+            continue
+        # The last chunk may still grow with the next pieces, it is cut again together with them
+        for chunk in chunks[:-1]:
+            yield Chunk(chunk.text, offset + chunk.start, offset + chunk.end, chunk.token_count)
+        tail_start = chunks[-1].start
+        buffer = buffer[tail_start:]
+        offset += tail_start
+
+    for chunk in chunk_text(buffer, max_tokens, overlap_tokens, snap_to_sentences, encoding=encoding):
+        yield Chunk(chunk.text, offset + chunk.start, offset + chunk.end, chunk.token_count)
+
+
+async def aiter_token_chunks(
+    data: Union[str, AsyncIterator[str]], max_tokens: int, **kwargs: Any
+) -> AsyncIterator[str]:
+    """
+    Stripped, non empty chunk texts of a whole document or of a text stream.
+    """
+    if isinstance(data, str):
+        for chunk in split_text_to_token_budget(data, max_tokens, **kwargs):
+            yield chunk
+        return
+    async for chunk in astream_chunks(data, max_tokens, **kwargs):
+        if chunk.text.strip():
+            yield chunk.text.strip()
@@ -0,0 +1,133 @@
+import os
+from collections import Counter
+from typing import Callable, Dict, Optional, Sequence
+
+from utils.relevance_gate import COMPOSITION_TASK, NAME_DESCRIPTION_TASK
+
+# Policy deciding when the per chunk prompts of a workflow can stop: "saturation" or "none" (every chunk is sent)
+CONVERGENCE_POLICY = os.getenv("CONVERGENCE_POLICY", "saturation")
+# Consecutive chunks without any new fact after which a prompt is no longer sent
+CONVERGENCE_PATIENCE = int(os.getenv("CONVERGENCE_PATIENCE", "4"))
+# Facts after which a field counts as filled: one chunk without new facts is then enough to stop its prompt
+CONVERGENCE_REQUIRED_KEYWORDS = int(os.getenv("CONVERGENCE_REQUIRED_KEYWORDS", "40"))
+CONVERGENCE_REQUIRED_COMPOSITION_FACTS = int(os.getenv("CONVERGENCE_REQUIRED_COMPOSITION_FACTS", "20"))
+# Prompt tokens a workflow may send for its chunks, 0 for no limit
+PRODUCT_DISCOVERY_TOKEN_BUDGET = int(os.getenv("PRODUCT_DISCOVERY_TOKEN_BUDGET", "0"))
+
+
+class ConvergencePolicy:
+    """
+    Decides, chunk after chunk, which per chunk prompts are still worth sending. This one sends every prompt
+    until the token budget is spent; subclasses stop (downshift) the prompts that stopped finding anything.
+    A policy follows one workflow run: the workflow calls observe once per chunk, in chunk order.
+    """
+
+    def __init__(self, tasks: Sequence[str], token_budget: int = PRODUCT_DISCOVERY_TOKEN_BUDGET) -> None:
+        """
+        :param tasks: The prompts sent for every chunk, e.g. "name_description" and "composition".
+        :param token_budget: Prompt tokens after which the workflow stops, 0 for no limit.
+        """
+        self.tasks = list(tasks)
+        self.token_budget = token_budget
+        self.tokens = 0
+        self.chunks = 0
+        self.facts: Counter = Counter()
+        self.stopped_tasks: Dict[str, int] = {}
+        self.skipped: Counter = Counter()
+
+    def active(self, task: str) -> bool:
+        """
+        False when the prompt of the task is no longer sent. The skipped calls are counted.
+        """
+        if self.stopped or task in self.stopped_tasks:
+            self.skipped[task] += 1
+            return False
+        return True
+
+    @property
+    def stopped(self) -> bool:
+        # No prompt left to send: the remaining chunks don't need to be read at all
+        return (
+            bool(self.token_budget) and self.tokens >= self.token_budget
+        ) or len(self.stopped_tasks) == len(self.tasks)
+
+    def observe(self, new_facts: Dict[str, int], tokens: int = 0) -> None:
+        """
+        :param new_facts: The number of new facts every prompt sent for the chunk added, prompts not sent
+                          (skipped by a filter) are left out.
+        :param tokens: Prompt tokens sent for the chunk.
+        """
+        self.chunks += 1
+        self.tokens += tokens
+        for task, count in new_facts.items():
+            self.facts[task] += count
+
+    def report(self) -> Dict[str, object]:
+        return {
+            "chunks": self.chunks,
+            "prompt_tokens": self.tokens,
+            "stopped_after_chunk": self.stopped_tasks,
+            "calls_skipped": dict(self.skipped),
+        }
+
+
+class SaturationPolicy(ConvergencePolicy):
+    """
+    Stops the prompt of a task once it found facts and then nothing new for patience consecutive chunks,
+    or as soon as a chunk adds nothing to a field already filled (required facts reached).
+    """
+
+    def __init__(
+        self,
+        tasks: Sequence[str],
+        patience: int = CONVERGENCE_PATIENCE,
+        required_facts: Optional[Dict[str, int]] = None,
+        token_budget: int = PRODUCT_DISCOVERY_TOKEN_BUDGET,
+    ) -> None:
+        super().__init__(tasks, token_budget)
+        self.patience = patience
+        self.required_facts = required_facts or {}
+        self.quiet: Counter = Counter()
+
+    def observe(self, new_facts: Dict[str, int], tokens: int = 0) -> None:
+        super().observe(new_facts, tokens)
+        for task, count in new_facts.items():
+            if task in self.stopped_tasks:
+                continue
+            self.quiet[task] = 0 if count else self.quiet[task] + 1
+            # A prompt that never found anything may still find its facts further in the document
+            if not self.facts[task] or not self.quiet[task]:
+                continue
+            filled = task in self.required_facts and self.facts[task] >= self.required_facts[task]
+            if filled or self.quiet[task] >= self.patience:
+                self.stopped_tasks[task] = self.chunks
+
+
+CONVERGENCE_POLICIES: Dict[str, Callable[[Sequence[str]], ConvergencePolicy]] = {
+    "none": ConvergencePolicy,
+    "saturation": lambda tasks: SaturationPolicy(
+        tasks,
+        required_facts={
+            NAME_DESCRIPTION_TASK: CONVERGENCE_REQUIRED_KEYWORDS,
+            COMPOSITION_TASK: CONVERGENCE_REQUIRED_COMPOSITION_FACTS,
+        },
+    ),
+}
+
+
+def register_convergence_policy(name: str, factory: Callable[[Sequence[str]], ConvergencePolicy]) -> None:
+    """
+    Make a policy selectable with CONVERGENCE_POLICY.
+    :param factory: Builds the policy of one workflow run from the tasks it sends.
+    """
+    CONVERGENCE_POLICIES[name] = factory
+
+
+def make_convergence_policy(tasks: Sequence[str], name: Optional[str] = None) -> ConvergencePolicy:
+    """
+    A new policy for one workflow run, CONVERGENCE_POLICY by default.
+    """
+    name = name or CONVERGENCE_POLICY
+    if name not in CONVERGENCE_POLICIES:
+        raise ValueError(f"Unsupported convergence policy: {name}")
+    return CONVERGENCE_POLICIES[name](tasks)
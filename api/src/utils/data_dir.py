@@ -0,0 +1,9 @@
+import os
+
+# Directory of the API's local stores (chunk cache, jobs, relevance log, entity registry), relative to the working
+# directory. Every store path can still be set on its own.
+API_DATA_DIR = os.getenv("API_DATA_DIR", "data")
+
+
+def data_path(filename: str) -> str:
+    return os.path.join(API_DATA_DIR, filename)
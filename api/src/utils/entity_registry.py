@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping, MutableSet
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.data_dir import data_path
+
+# SQLite file of the entity registry shared by the workers and kept across restarts. An empty value keeps the
+# registry in memory, for the process only.
+ENTITY_REGISTRY_PATH = os.getenv("ENTITY_REGISTRY_PATH", data_path("entity_registry.sqlite3"))
+# Seconds a writer waits for the lock held by another process
+ENTITY_REGISTRY_TIMEOUT = float(os.getenv("ENTITY_REGISTRY_TIMEOUT", "30"))
+
+# Rows read at a time when iterating, so millions of entities are never all in memory
+ITERATION_BATCH = 1000
+
+RelationshipTuple = Tuple[str, str, str, str]
+
+
+def canonical_properties(properties: Any) -> str:
+    """
+    JSON of the properties with sorted keys, the same for {"a": 1, "b": 2} and {"b": 2, "a": 1}.
+    :param properties: A dict, or its JSON.
+    """
+    if isinstance(properties, str):
+        try:
+            properties = json.loads(properties)
+        except ValueError:
+            return properties
+    return json.dumps(properties, sort_keys=True, ensure_ascii=False)
+
+
+def _hash(*parts: Any) -> str:
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+def node_key(name: str) -> str:
+    return _hash(name)
+
+
+def relationship_key(start: str, type: str, end: str, properties: Any) -> str:
+    return _hash(start, type, end, canonical_properties(properties))
+
+
+def relationship_tuple(relationship: Dict[str, Any]) -> RelationshipTuple:
+    return (
+        relationship["start"],
+        relationship["type"],
+        relationship["end"],
+        canonical_properties(relationship.get("properties") or {}),
+    )
+
+
+class EntityRegistry:
+    """
+    Nodes and relationships already written, deduplicated across documents, requests and worker processes.
+    Entities are stored under a hash of their canonical identity (the node name; start, type, end and sorted
+    properties of a relationship), so a membership check is one primary key lookup. Writes are atomic
+    INSERT OR IGNORE, several processes can share the file (WAL mode).
+    """
+
+    def __init__(self, path: str = ENTITY_REGISTRY_PATH) -> None:
+        """
+        :param path: SQLite database file, created on first use. Empty for an in-memory registry.
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path or ":memory:", timeout=ENTITY_REGISTRY_TIMEOUT, check_same_thread=False)
+        with self._lock, self._connection:
+            if path:
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS nodes (key TEXT PRIMARY KEY, name TEXT NOT NULL, node TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS relationships (
+                    key TEXT PRIMARY KEY,
+                    start TEXT NOT NULL,
+                    type TEXT NOT NULL,
+                    end TEXT NOT NULL,
+                    properties TEXT NOT NULL
+                )
+                """
+            )
+        self.nodes = NodeRegistry(self)
+        self.relationships = RelationshipRegistry(self)
+
+    def execute(self, sql: str, parameters: Iterable[Any] = ()) -> sqlite3.Cursor:
+        with self._lock, self._connection:
+            return self._connection.execute(sql, tuple(parameters))
+
+    def executemany(self, sql: str, rows: List[Tuple[Any, ...]]) -> int:
+        """
+        :return: The number of rows changed.
+        """
+        with self._lock, self._connection:
+            before = self._connection.total_changes
+            self._connection.executemany(sql, rows)
+            return self._connection.total_changes - before
+
+    def batches(self, sql: str) -> Iterator[tuple]:
+        # Keyset pagination: the rows are not held by an open cursor while the caller works
+        last_key = ""
+        while True:
+            with self._lock:
+                rows = self._connection.execute(sql, (last_key, ITERATION_BATCH)).fetchall()
+            yield from rows
+            if len(rows) < ITERATION_BATCH:
+                return
+            last_key = rows[-1][0]
+
+
+class NodeRegistry(MutableMapping):
+    """
+    Node name -> node dict. The dicts read are copies: change a node by assigning it again.
+    """
+
+    def __init__(self, registry: EntityRegistry) -> None:
+        self._registry = registry
+
+    def __getitem__(self, name: str) -> Dict[str, Any]:
+        row = self._registry.execute("SELECT node FROM nodes WHERE key = ?", (node_key(name),)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return json.loads(row[0])
+
+    def __setitem__(self, name: str, node: Dict[str, Any]) -> None:
+        self._registry.execute(
+            "INSERT OR REPLACE INTO nodes (key, name, node) VALUES (?, ?, ?)",
+            (node_key(name), name, json.dumps(node, ensure_ascii=False)),
+        )
+
+    def __delitem__(self, name: str) -> None:
+        if not self._registry.execute("DELETE FROM nodes WHERE key = ?", (node_key(name),)).rowcount:
+            raise KeyError(name)
+
+    def __contains__(self, name: object) -> bool:
+        return self._registry.execute("SELECT 1 FROM nodes WHERE key = ?", (node_key(str(name)),)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[str]:
+        for _, name in self._registry.batches("SELECT key, name FROM nodes WHERE key > ? ORDER BY key LIMIT ?"):
+            yield name
+
+    def __len__(self) -> int:
+        return self._registry.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+    def values(self) -> Iterator[Dict[str, Any]]:
+        # One query per batch instead of one per name
+        for _, node in self._registry.batches("SELECT key, node FROM nodes WHERE key > ? ORDER BY key LIMIT ?"):
+            yield json.loads(node)
+
+    def clear(self) -> None:
+        self._registry.execute("DELETE FROM nodes")
+
+    def add_new(self, nodes: Iterable[Dict[str, Any]]) -> int:
+        """
+        Add the nodes whose name is not registered yet, a registered node is never overwritten.
+        :return: The number of nodes added.
+        """
+        rows = [(node_key(node["name"]), node["name"], json.dumps(node, ensure_ascii=False)) for node in nodes]
+        return self._registry.executemany("INSERT OR IGNORE INTO nodes (key, name, node) VALUES (?, ?, ?)", rows)
+
+
+class RelationshipRegistry(MutableSet):
+    """
+    Set of (start, type, end, properties JSON) relationship tuples.
+    """
+
+    def __init__(self, registry: EntityRegistry) -> None:
+        self._registry = registry
+
+    def __contains__(self, relationship: object) -> bool:
+        # The properties can be a dict or JSON, they are put in canonical form once, by relationship_key
+        if not isinstance(relationship, tuple) or len(relationship) != 4:
+            return False
+        key = relationship_key(*relationship)
+        return self._registry.execute("SELECT 1 FROM relationships WHERE key = ?", (key,)).fetchone() is not None
+
+    def __iter__(self) -> Iterator[RelationshipTuple]:
+        for _, start, type, end, properties in self._registry.batches(
+            "SELECT key, start, type, end, properties FROM relationships WHERE key > ? ORDER BY key LIMIT ?"
+        ):
+            yield start, type, end, properties
+
+    def __len__(self) -> int:
+        return self._registry.execute("SELECT COUNT(*) FROM relationships").fetchone()[0]
+
+    def add(self, relationship: RelationshipTuple) -> None:
+        self.add_new([relationship])
+
+    def discard(self, relationship: RelationshipTuple) -> None:
+        self._registry.execute("DELETE FROM relationships WHERE key = ?", (relationship_key(*relationship),))
+
+    def clear(self) -> None:
+        self._registry.execute("DELETE FROM relationships")
+
+    def add_new(self, relationships: Iterable[RelationshipTuple]) -> int:
+        """
+        :return: The number of relationships that were not registered yet.
+        """
+        rows = []
+        for start, type, end, properties in relationships:
+            properties = canonical_properties(properties)
+            rows.append((_hash(start, type, end, properties), start, type, end, properties))
+        return self._registry.executemany(
+            "INSERT OR IGNORE INTO relationships (key, start, type, end, properties) VALUES (?, ?, ?, ?, ?)", rows
+        )
+
+
+_entity_registry: Optional[EntityRegistry] = None
+_entity_registry_lock = threading.Lock()
+
+
+def get_entity_registry() -> EntityRegistry:
+    """
+    The process wide registry of ENTITY_REGISTRY_PATH.
+    """
+    global _entity_registry
+    with _entity_registry_lock:
+        if _entity_registry is None:
+            _entity_registry = EntityRegistry(ENTITY_REGISTRY_PATH)
+    return _entity_registry
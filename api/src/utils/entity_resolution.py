@@ -0,0 +1,239 @@
+import logging
+import math
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from difflib import SequenceMatcher
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+# Similarity (Jaro-Winkler or token set) from which two names may be the same entity and are asked to the LLM
+ENTITY_MATCH_THRESHOLD = float(os.getenv("ENTITY_MATCH_THRESHOLD", "0.88"))
+# sentence-transformers model adding embedding similarity to the string similarities, empty to skip it
+ENTITY_EMBEDDING_MODEL = os.getenv("ENTITY_EMBEDDING_MODEL", "")
+ENTITY_EMBEDDING_THRESHOLD = float(os.getenv("ENTITY_EMBEDDING_THRESHOLD", "0.9"))
+
+# Block keys shared by more names than this ("acid", "sodium") carry no information and are not compared
+MAX_BLOCK_SIZE = 100
+BLOCK_PREFIX_LENGTH = 4
+MAX_EMBEDDING_GROUP = 1000
+STOPWORDS = {"a", "an", "and", "the", "of", "for", "in", "on", "to", "with", "by", "or"}
+
+nameTokenRegex = re.compile(r"[a-z]+|\d+")
+
+Embedder = Callable[[List[str]], Sequence[Sequence[float]]]
+
+
+class EntityResolution(NamedTuple):
+    # Nodes settled without the LLM: distinct names, and the obvious duplicates merged into one node
+    nodes: List[dict]
+    # Clusters of nodes that may be duplicates, for the LLM to decide
+    ambiguous: List[List[dict]]
+    # Name of every merged duplicate -> name of the node it was merged into
+    aliases: Dict[str, str]
+
+
+def name_tokens(name: str) -> Tuple[str, ...]:
+    # "L'Oréal" and "l oreal" have the same tokens
+    text = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii")
+    return tuple(nameTokenRegex.findall(text.lower()))
+
+
+def normalized_key(name: str) -> str:
+    """
+    Key of the names that are the same up to case, accents, punctuation and spacing ("GLYCERIN." and "glycerin").
+    Word order is kept: "oil-in-water emulsion" and "water-in-oil emulsion", or "2-chloro-4-nitrophenol" and
+    "4-chloro-2-nitrophenol", are different entities. Reordered names ("Varale; Aditya" and "Aditya Varale") are
+    left to the similarity and the LLM.
+    """
+    return " ".join(name_tokens(name))
+
+
+def variant_key(name: str) -> str:
+    """
+    normalized_key up to plural and spelling variants ("Glycerine" and "glycerin", "Parabens" and "paraben"), the
+    identity of the entities written to the graph. Chemical names one letter apart are often different compounds
+    ("chloride" and "chlorite"), so nothing looser is merged without the LLM.
+    """
+    tokens = []
+    for token in name_tokens(name):
+        if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        if len(token) > 4 and token.endswith("e"):
+            token = token[:-1]
+        tokens.append(token)
+    return " ".join(tokens) or str(name)
+
+
+def resolve_existing_names(names: Iterable[str], find_existing: Callable[[List[str]], Dict[str, str]]) -> Dict[str, str]:
+    """
+    Incremental resolution of new entities against the ones already written: the name to write for every new name.
+    That is the existing entity with the same variant_key, or else the first new name with that key.
+    :param find_existing: Looks up all the keys at once, variant_key -> name of the existing entity.
+    """
+    names = list(dict.fromkeys(names))
+    keys = {name: variant_key(name) for name in names}
+    canonical = dict(find_existing(list(dict.fromkeys(keys.values())))) if names else {}
+    for name in names:
+        canonical.setdefault(keys[name], name)
+    return {name: canonical[keys[name]] for name in names}
+
+
+def jaro_winkler(a: str, b: str, prefix_scale: float = 0.1) -> float:
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    window = max(0, max(len(a), len(b)) // 2 - 1)
+    a_matched, b_matched = [False] * len(a), [False] * len(b)
+    matches = 0
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not b_matched[j] and b[j] == char:
+                a_matched[i] = b_matched[j] = True
+                matches += 1
+                break
+    if not matches:
+        return 0.0
+    a_chars = [char for char, matched in zip(a, a_matched) if matched]
+    b_chars = [char for char, matched in zip(b, b_matched) if matched]
+    transpositions = sum(x != y for x, y in zip(a_chars, b_chars)) / 2
+    jaro = (matches / len(a) + matches / len(b) + (matches - transpositions) / matches) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+def token_set_similarity(a: Sequence[str], b: Sequence[str]) -> float:
+    """
+    Token set ratio: 1.0 when the words of one name are all in the other ("L'Oreal" and "L'Oreal Paris").
+    """
+    a_set, b_set = set(a), set(b)
+    common = " ".join(sorted(a_set & b_set))
+    a_text = (common + " " + " ".join(sorted(a_set - b_set))).strip()
+    b_text = (common + " " + " ".join(sorted(b_set - a_set))).strip()
+    ratios = [SequenceMatcher(None, a_text, b_text).ratio()]
+    if common:
+        ratios += [SequenceMatcher(None, common, a_text).ratio(), SequenceMatcher(None, common, b_text).ratio()]
+    return max(ratios)
+
+
+def name_similarity(a: Sequence[str], b: Sequence[str]) -> float:
+    """
+    Similarity of two tokenized names, 0 when they carry different numbers ("Example 1" and "Example 2").
+    """
+    if {token for token in a if token.isdigit()} != {token for token in b if token.isdigit()}:
+        return 0.0
+    return max(jaro_winkler(" ".join(a), " ".join(b)), token_set_similarity(a, b))
+
+
+def block_keys(tokens: Sequence[str]) -> set:
+    # Names sharing a word, or the start of one ("glycerin" and "glycerine"), are compared
+    return {token[:BLOCK_PREFIX_LENGTH] for token in tokens if token not in STOPWORDS and not token.isdigit()}
+
+
+def merge_nodes(nodes: List[dict]) -> dict:
+    """
+    One node of duplicates: the name and label of the first, the properties of all (the first value wins).
+    """
+    properties = {}
+    for node in nodes:
+        for key, value in (node.get("properties") or {}).items():
+            properties.setdefault(key, value)
+    return {"name": nodes[0]["name"], "label": nodes[0]["label"], "properties": properties}
+
+
+def _cosine(a: Sequence[float], b: Sequence[float]) -> float:
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return sum(x * y for x, y in zip(a, b)) / norm if norm else 0.0
+
+
+def resolve_entities(
+    nodes: List[dict],
+    threshold: float = ENTITY_MATCH_THRESHOLD,
+    embed: Optional[Embedder] = None,
+    embedding_threshold: float = ENTITY_EMBEDDING_THRESHOLD,
+) -> EntityResolution:
+    """
+    Entity resolution of the nodes of one label, before the LLM disambiguation. Names equal up to case, accents,
+    punctuation and spacing are merged. The other names are compared within blocks (names sharing the start
+    of a word): similar names form the ambiguous clusters, every other node is distinct.
+    :param nodes: Nodes {"name", "label", "properties"} of one label.
+    :param embed: Embeds a list of names, adds embedding similarity to the string similarities.
+    """
+    # Obvious duplicates
+    by_key: Dict[str, List[dict]] = {}
+    for node in nodes:
+        by_key.setdefault(normalized_key(node["name"]) or str(node["name"]), []).append(node)
+    entities = [merge_nodes(duplicates) for duplicates in by_key.values()]
+    aliases = {
+        duplicate["name"]: entity["name"]
+        for entity, duplicates in zip(entities, by_key.values())
+        for duplicate in duplicates
+        if duplicate["name"] != entity["name"]
+    }
+
+    # Candidate pairs of the blocks, clustered with union-find
+    parent = list(range(len(entities)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    tokens = [name_tokens(entity["name"]) for entity in entities]
+    blocks: Dict[str, List[int]] = defaultdict(list)
+    for i, entity_tokens in enumerate(tokens):
+        for key in block_keys(entity_tokens):
+            blocks[key].append(i)
+    compared = set()
+    for members in blocks.values():
+        if len(members) > MAX_BLOCK_SIZE:
+            continue
+        for x, i in enumerate(members):
+            for j in members[x + 1:]:
+                if (i, j) in compared or find(i) == find(j):
+                    continue
+                compared.add((i, j))
+                if name_similarity(tokens[i], tokens[j]) >= threshold:
+                    parent[find(j)] = find(i)
+
+    if embed is not None and 1 < len(entities) <= MAX_EMBEDDING_GROUP:
+        vectors = embed([entity["name"] for entity in entities])
+        for i in range(len(entities)):
+            for j in range(i + 1, len(entities)):
+                if find(i) != find(j) and _cosine(vectors[i], vectors[j]) >= embedding_threshold:
+                    parent[find(j)] = find(i)
+
+    clusters: Dict[int, List[dict]] = {}
+    for i, entity in enumerate(entities):
+        clusters.setdefault(find(i), []).append(entity)
+    return EntityResolution(
+        nodes=[cluster[0] for cluster in clusters.values() if len(cluster) == 1],
+        ambiguous=[cluster for cluster in clusters.values() if len(cluster) > 1],
+        aliases=aliases,
+    )
+
+
+_entity_embedder: Optional[Embedder] = None
+
+
+def get_entity_embedder() -> Optional[Embedder]:
+    """
+    The embedder of ENTITY_EMBEDDING_MODEL, loaded on first use. None when no model is set or
+    sentence-transformers is not installed.
+    """
+    global _entity_embedder
+    if _entity_embedder is None and ENTITY_EMBEDDING_MODEL:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            logging.warning("sentence-transformers is not installed, entity resolution without embeddings")
+            return None
+        model = SentenceTransformer(ENTITY_EMBEDDING_MODEL)
+        _entity_embedder = lambda names: model.encode(names).tolist()
+    return _entity_embedder
@@ -0,0 +1,156 @@
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Lines of the per chunk composition answer, markdown decoration (bullets, bold) is tolerated
+roleLineRegex = re.compile(r"^[\W_]*functional\s+role[\W_]*:?[\s*_]*(?P<role>.+?)[\s*_]*$", re.IGNORECASE)
+chemicalLineRegex = re.compile(
+    r"^[\W_]*chemical[\W_]*:?[\s*_]*(?P<chemical>[^,]+?)[\s*_]*(?:,[\s*_]*weight[\W_]*:?[\s*_]*(?P<weight>.+?)[\s*_]*)?$",
+    re.IGNORECASE,
+)
+wordRegex = re.compile(r"\b\w+\b")
+
+# Weights the LLM writes when the patent gives none
+MISSING_WEIGHTS = {"", "n/a", "na", "none", "null", "not specified", "not mentioned", "unknown", "-"}
+
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
+
+def parse_composition_text(text: str) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """
+    Parse the "Functional Role: ... / - Chemical: ..., Weight: ..." answer of a composition prompt.
+    :param text: The LLM answer for one chunk.
+    :return: (role, chemical, weight) facts, weight is None when the answer gives none.
+    """
+    role = None
+    for line in text.splitlines():
+        match = roleLineRegex.match(line)
+        if match:
+            role = match.group("role")
+            continue
+        match = chemicalLineRegex.match(line)
+        if match and role:
+            yield role, match.group("chemical"), match.group("weight")
+
+
+class CompositionAccumulator:
+    """
+    Functional role -> chemical -> weights extracted from a document, built chunk by chunk.
+    Roles and chemicals are deduplicated on insert with dict lookups on their normalized names, so adding
+    a chunk costs only the size of its own answer, whatever was accumulated before.
+    """
+
+    def __init__(self) -> None:
+        # normalized role -> (role, {normalized chemical -> (chemical, [weights])})
+        self.roles: Dict[str, Tuple[str, Dict[str, Tuple[str, List[str]]]]] = {}
+        self.facts = 0
+        # Chemicals in insertion order, rendered most recent first when the context is capped
+        self._order: List[Tuple[str, str]] = []
+
+    def __len__(self) -> int:
+        return self.facts
+
+    def add(self, role: str, chemical: str, weight: Optional[str] = None) -> bool:
+        """
+        :return: True when the fact was new (a new role, chemical or weight).
+        """
+        role, chemical = role.strip(), chemical.strip()
+        if not role or not chemical:
+            return False
+        role_key, chemical_key = normalize_name(role), normalize_name(chemical)
+        _, chemicals = self.roles.setdefault(role_key, (role, {}))
+        if chemical_key not in chemicals:
+            chemicals[chemical_key] = (chemical, [])
+            self._order.append((role_key, chemical_key))
+            new = True
+        else:
+            new = False
+        weight = (weight or "").strip()
+        weights = chemicals[chemical_key][1]
+        if weight.lower() not in MISSING_WEIGHTS and weight not in weights:
+            weights.append(weight)
+            new = True
+        if new:
+            self.facts += 1
+        return new
+
+    def add_text(self, text: str) -> int:
+        """
+        Add the facts of a composition answer.
+        :return: The number of new facts.
+        """
+        return sum(self.add(role, chemical, weight) for role, chemical, weight in parse_composition_text(text))
+
+    def add_report(self, report: Optional[Dict[str, Any]]) -> int:
+        """
+        Add the facts of a CompositionReport dict.
+        :return: The number of new facts.
+        """
+        added = 0
+        for role, chemicals in ((report or {}).get("functional_roles") or {}).items():
+            for chemical in chemicals:
+                added += self.add(role, chemical.get("chemical") or "", chemical.get("weight"))
+        return added
+
+    def render(self, weights: bool = True, limit: Optional[int] = None) -> str:
+        """
+        Compact text form, one line per role: "Role: Chemical (weight; weight), Chemical".
+        :param weights: Include the weights. The "till now" context of a prompt only needs the names.
+        :param limit: Render only the last `limit` chemicals, so a prompt context stays the same size on long documents.
+        """
+        order = self._order if limit is None else self._order[-limit:] if limit > 0 else []
+        lines: Dict[str, List[str]] = {}
+        for role_key, chemical_key in order:
+            chemical, chemical_weights = self.roles[role_key][1][chemical_key]
+            if weights and chemical_weights:
+                chemical = f"{chemical} ({'; '.join(chemical_weights)})"
+            lines.setdefault(role_key, []).append(chemical)
+        return "\n".join(f"{self.roles[role_key][0]}: {', '.join(chemicals)}" for role_key, chemicals in lines.items())
+
+    def to_report(self) -> Dict[str, Any]:
+        """
+        The accumulated facts as a CompositionReport dict.
+        """
+        return {
+            "functional_roles": {
+                role: [
+                    {"chemical": chemical, "weight": "; ".join(chemical_weights) or None}
+                    for chemical, chemical_weights in chemicals.values()
+                ]
+                for role, chemicals in self.roles.values()
+            }
+        }
+
+
+class KeywordAccumulator:
+    """
+    Unique words extracted from a document, in the order they were found.
+    Only the new answer is tokenized on every add, the words seen so far are kept in a set.
+    """
+
+    def __init__(self) -> None:
+        self.words: List[str] = []
+        self._seen = set()
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    def add(self, text: str) -> List[str]:
+        """
+        :return: The words of text that were not seen before.
+        """
+        new_words = []
+        for word in wordRegex.findall(text.lower()):
+            if word not in self._seen:
+                self._seen.add(word)
+                new_words.append(word)
+        self.words.extend(new_words)
+        return new_words
+
+    def render(self, limit: Optional[int] = None) -> str:
+        """
+        :param limit: Render only the last `limit` words.
+        """
+        words = self.words if limit is None else self.words[-limit:] if limit > 0 else []
+        return " ".join(words)
@@ -0,0 +1,227 @@
+import csv
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Ingredient dictionary: a CSV with an "ingredients" column of comma separated INCI lists (the product catalog
+# by default), or a text file with one chemical name per line
+INGREDIENT_DICTIONARY_PATH = os.getenv(
+    "INGREDIENT_DICTIONARY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "products.csv")
+)
+# Graph whose chemical nodes are added to the dictionary (the one product reports are written to), empty to skip it
+INGREDIENT_GRAPH_URL = os.getenv("INGREDIENT_GRAPH_URL", os.getenv("NEO4J_WRITE_URL", "bolt://kg:7688"))
+# Skip the composition prompt of the chunks without any dictionary hit
+INGREDIENT_PREFILTER = os.getenv("INGREDIENT_PREFILTER", "true").lower() == "true"
+
+MAX_INGREDIENT_HINTS = 30
+MIN_INGREDIENT_LENGTH = 4
+MAX_INGREDIENT_WORDS = 6
+# Ingredients too frequent in any patent text to tell a formulation chunk apart
+COMMON_TERMS = {
+    "water", "aqua", "eau", "fragrance", "parfum", "perfume", "aroma", "flavor", "alcohol", "oil", "extract",
+    "essential", "solvent",
+}
+
+wordRegex = re.compile(r"[a-z0-9]+")
+# "1,2-Hexanediol" is one ingredient, "Glycerin, Mica" two
+ingredientSeparatorRegex = re.compile(r"[，;\n]|,(?!\d)")
+annotationRegex = re.compile(r"\[[^\]]*\]|\*")
+
+
+def term_words(text: str) -> Tuple[str, ...]:
+    # "Caprylic/Capric Triglyceride" and "caprylic capric triglyceride" match the same way
+    return tuple(wordRegex.findall(text.lower()))
+
+
+class IngredientMatcher:
+    """
+    Aho-Corasick automaton over the words of the ingredient names: a chunk is scanned once, in time linear in its
+    number of words whatever the size of the dictionary, and every ingredient it mentions is found.
+    """
+
+    def __init__(self, names: Iterable[str] = ()) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Ingredient ending at every state, and the closest state along the fail links that ends one
+        self._term: List[Optional[int]] = [None]
+        self._output_link: List[int] = [0]
+        self.names: List[str] = []
+        self._ids: Dict[Tuple[str, ...], int] = {}
+        self._built = False
+        self.add(names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def add(self, names: Iterable[str]) -> int:
+        """
+        Add ingredient names, the first spelling of a name is the one reported.
+        :return: The number of new ingredients.
+        """
+        added = 0
+        for name in names:
+            words = term_words(name)
+            text = " ".join(words)
+            if (
+                not words
+                or words in self._ids
+                or len(text) < MIN_INGREDIENT_LENGTH
+                or len(words) > MAX_INGREDIENT_WORDS
+                or text in COMMON_TERMS
+                or not any(c.isalpha() for c in text)
+            ):
+                continue
+            state = 0
+            for word in words:
+                next_state = self._goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][word] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._term.append(None)
+                    self._output_link.append(0)
+                state = next_state
+            self._ids[words] = len(self.names)
+            self._term[state] = len(self.names)
+            self.names.append(name.strip())
+            added += 1
+        if added:
+            self._built = False
+        return added
+
+    def _build(self) -> None:
+        # Breadth first: the fail link of a state is the longest proper suffix of its words that is also in the trie
+        queue = list(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+            self._output_link[state] = 0
+        index = 0
+        while index < len(queue):
+            state = queue[index]
+            index += 1
+            for word, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(word, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                link = self._fail[next_state]
+                self._output_link[next_state] = link if self._term[link] is not None else self._output_link[link]
+                queue.append(next_state)
+        self._built = True
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """
+        :return: (word position, ingredient name) of every ingredient of the text, overlapping ones included.
+        """
+        if not self._built:
+            self._build()
+        goto, fail, term, output_link = self._goto, self._fail, self._term, self._output_link
+        state = 0
+        for position, word in enumerate(wordRegex.findall(text.lower())):
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            match = state if term[state] is not None else output_link[state]
+            while match:
+                yield position, self.names[term[match]]
+                match = output_link[match]
+
+    def find(self, text: str, limit: Optional[int] = MAX_INGREDIENT_HINTS) -> List[str]:
+        """
+        The distinct ingredients of the text, in order of first mention. A longer name hides the names it
+        contains ("sodium hyaluronate" does not also report "hyaluronate" at the same place).
+        """
+        found: Dict[str, None] = {}
+        kept_start, kept_end = -1, -1
+        for position, name in self.iter_matches(text):
+            # Matches ending at one position come longest first
+            start = position - len(term_words(name)) + 1
+            if start >= kept_start and position <= kept_end:
+                continue
+            kept_start, kept_end = start, position
+            found.setdefault(name, None)
+            if limit and len(found) >= limit:
+                break
+        return list(found)
+
+
+def read_ingredient_dictionary(path: str = INGREDIENT_DICTIONARY_PATH) -> List[str]:
+    """
+    Ingredient names of a dictionary file: the "ingredients" column of a product CSV, or one name per line.
+    """
+    if not path or not os.path.exists(path):
+        logging.warning(f"Ingredient dictionary {path} not found")
+        return []
+    with open(path, newline="", encoding="utf-8") as f:
+        if not path.endswith(".csv"):
+            return [line.strip() for line in f if line.strip()]
+        names = []
+        for row in csv.DictReader(f):
+            brand = (row.get("brand_name") or "").strip().lower()
+            for name in ingredientSeparatorRegex.split(annotationRegex.sub(" ", row.get("ingredients") or "")):
+                name = name.strip(" .")
+                # The catalog lists the brand and retailer notes after the ingredients
+                if name and name.lower() != brand and "yesstyle" not in name.lower():
+                    names.append(name)
+
+    # Badly split lists leave single words like "Acid" or "Copolymer", far more frequent inside longer names
+    # than on their own. Those would match nearly every chunk.
+    standalone: Counter = Counter()
+    contained: Counter = Counter()
+    for words in {term_words(name) for name in names}:
+        if len(words) > 1:
+            contained.update(set(words))
+    for name in names:
+        words = term_words(name)
+        if len(words) == 1:
+            standalone[words[0]] += 1
+    return [
+        name for name in names
+        if len(term_words(name)) != 1 or (
+            standalone[term_words(name)[0]] >= 2 and standalone[term_words(name)[0]] * 2 >= contained[term_words(name)[0]]
+        )
+    ]
+
+
+def read_graph_chemicals(url: str = INGREDIENT_GRAPH_URL) -> List[str]:
+    """
+    Names of the chemical nodes of the graph, an empty list when the graph is unreachable.
+    """
+    if not url:
+        return []
+    # Imported here: the matcher works without the graph driver
+    from driver.neo4j import Neo4jDatabase
+
+    try:
+        db = Neo4jDatabase(
+            host=url,
+            user=os.environ.get("NEO4J_USER", "neo4j"),
+            password=os.environ.get("NEO4J_PASS", "your12345"),
+        )
+        return db.chemical_names()
+    except Exception as e:
+        logging.warning(f"Chemicals of the graph {url} not loaded: {e}")
+        return []
+
+
+_ingredient_matcher: Optional[IngredientMatcher] = None
+_ingredient_matcher_lock = threading.Lock()
+
+
+def get_ingredient_matcher() -> IngredientMatcher:
+    """
+    The process wide matcher of the ingredient dictionary and the chemicals of the graph, built on first use.
+    """
+    global _ingredient_matcher
+    with _ingredient_matcher_lock:
+        if _ingredient_matcher is None:
+            matcher = IngredientMatcher(read_ingredient_dictionary())
+            from_graph = matcher.add(read_graph_chemicals())
+            print(f"Ingredient matcher built with {len(matcher)} ingredients ({from_graph} from the graph)")
+            _ingredient_matcher = matcher
+    return _ingredient_matcher
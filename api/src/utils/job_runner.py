@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from utils.job_store import JOB_LEASE_SECONDS, JobStore, get_job_store, job_outcome, job_progress_callback
+
+# Jobs run at the same time by the API process
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# A job handler receives the job params and id and returns the (JSON serializable) job result
+JobHandler = Callable[[Dict[str, Any], str], Awaitable[Any]]
+
+FINAL_STATUSES = ("done", "failed")
+
+
+def new_progress() -> Dict[str, Any]:
+    return {"stage": None, "chunks_done": 0, "chunks_failed": 0, "prompt_tokens": 0}
+
+
+class JobManager:
+    """
+    Runs long workflows (ingestion, reports) in the background with a fixed pool of workers.
+    Jobs are persisted in the job store, so the API answers with a job id right away, clients poll the
+    job or subscribe to its progress events, and jobs left unfinished by a restart are queued again at startup.
+    Several processes (uvicorn workers) can share the job store: a worker claims a job before running it and
+    renews its lease while it runs, so every job runs once. Jobs of a worker that died are claimed again once
+    their lease expired.
+    """
+
+    def __init__(
+        self, store: Optional[JobStore] = None, workers: int = JOB_WORKERS, lease_seconds: float = JOB_LEASE_SECONDS
+    ) -> None:
+        """
+        :param store: The job store, the process wide one (opened when first used) by default.
+        :param workers: Number of jobs run concurrently.
+        :param lease_seconds: Seconds a claimed job stays owned by this manager without a renewal.
+        """
+        self._store = store
+        self.workers = max(1, workers)
+        self.lease_seconds = lease_seconds
+        # Unique across the processes sharing the job store
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handlers: Dict[str, JobHandler] = {}
+        # Live progress of the jobs run by this process
+        self.progress: Dict[str, Dict[str, Any]] = {}
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def store(self) -> JobStore:
+        if self._store is None:
+            self._store = get_job_store()
+            if self._store is None:
+                raise ValueError("Background jobs need a job store, set JOB_STORE_PATH")
+        return self._store
+
+    def register(self, kind: str, handler: JobHandler) -> None:
+        self.handlers[kind] = handler
+
+    def start(self) -> None:
+        """
+        Start the workers, and queue the jobs left pending or running by a process that stopped or died.
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._queue_claimable_jobs()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._watch_expired_leases()))
+
+    async def stop(self) -> None:
+        """
+        Stop the workers. The jobs they were running go back to pending and are resumed from their checkpoints
+        by the next worker that starts.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _queue_claimable_jobs(self) -> None:
+        for job in self.store.claimable_jobs():
+            if job["kind"] in self.handlers:
+                print(f"Resuming job {job['job_id']} ({job['kind']})")
+                self._queue.put_nowait(job["job_id"])
+
+    async def _watch_expired_leases(self) -> None:
+        # A job whose worker died is queued again once its lease expired. Another worker may queue it too,
+        # only one of them claims it.
+        while True:
+            await asyncio.sleep(self.lease_seconds)
+            await asyncio.to_thread(self._queue_claimable_jobs)
+
+    async def submit(self, kind: str, params: Dict[str, Any], job_id: Optional[str] = None) -> str:
+        """
+        Queue a job. Submitting an existing job id again retries it if it failed, and is a no-op otherwise.
+        :param kind: The registered job handler.
+        :param params: JSON serializable handler parameters, everything needed to run the job after a restart.
+        :return: The job id.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unsupported job kind: {kind}")
+        job = await asyncio.to_thread(self.store.get_job, job_id) if job_id else None
+        if job is None:
+            job_id = await asyncio.to_thread(self.store.create_job, kind, params, job_id=job_id)
+        elif job["status"] == "failed":
+            await asyncio.to_thread(self.store.requeue_job, job_id)
+        else:
+            return job_id
+        self._queue.put_nowait(job_id)
+        self._publish(job_id, {"type": "status", "status": "pending"})
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        The job without its params (they can hold a whole document), with its live progress.
+        """
+        job = self.store.get_job(job_id)
+        if job is None:
+            return None
+        job.pop("params")
+        job["progress"] = self.progress.get(job_id, job["progress"])
+        return job
+
+    async def subscribe(self, job_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Progress events of a job until it is done or failed, starting with its current status.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        try:
+            job = self.status(job_id)
+            if job is None:
+                yield {"type": "error", "detail": f"Unknown job {job_id}"}
+                return
+            yield {"type": "status", **job}
+            if job["status"] in FINAL_STATUSES:
+                return
+            while True:
+                event = await queue.get()
+                yield event
+                if event["type"] == "status" and event["status"] in FINAL_STATUSES:
+                    return
+        finally:
+            self._subscribers[job_id].discard(queue)
+            if not self._subscribers[job_id]:
+                del self._subscribers[job_id]
+
+    def _publish(self, job_id: str, event: Dict[str, Any]) -> None:
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(event)
+
+    def _progress_callback(self, job_id: str) -> Callable[..., None]:
+        progress = self.progress[job_id]
+
+        def update(stage: Optional[str], chunks_done: int, chunks_failed: int, prompt_tokens: int) -> None:
+            if stage:
+                progress["stage"] = stage
+            progress["chunks_done"] += chunks_done
+            progress["chunks_failed"] += chunks_failed
+            progress["prompt_tokens"] += prompt_tokens
+            # Token counts change on every LLM call, only stages and chunks are worth a write
+            if stage or chunks_done or chunks_failed:
+                self.store.set_progress(job_id, progress)
+            self._publish(job_id, {"type": "progress", "job_id": job_id, **progress})
+
+        return update
+
+    async def _keep_lease(self, job_id: str, run: asyncio.Task) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await asyncio.to_thread(self.store.renew_lease, job_id, self.owner, self.lease_seconds):
+                logging.warning(f"Job {job_id} lost its lease to another worker, stopping it")
+                run.cancel()
+                return
+
+    async def _run(self, job_id: str) -> None:
+        # Another worker, of this process or another one, may have queued and claimed the job already
+        if not await asyncio.to_thread(self.store.claim_job, job_id, self.owner, self.lease_seconds):
+            return
+        job = await asyncio.to_thread(self.store.get_job, job_id)
+        self.progress[job_id] = new_progress()
+        self._publish(job_id, {"type": "status", "status": "running"})
+        token = job_progress_callback.set(self._progress_callback(job_id))
+        outcome = {"job_id": job_id, "error": None}
+        outcome_token = job_outcome.set(outcome)
+        run = asyncio.create_task(self.handlers[job["kind"]](job["params"], job_id))
+        lease = asyncio.create_task(self._keep_lease(job_id, run))
+        try:
+            result = await run
+            # The job is still owned: it is only completed or failed here, once the handler returned
+            lease.cancel()
+            if outcome["error"]:
+                # Workflows with checkpoints leave their job failed, and resumable, when some chunks failed
+                await asyncio.to_thread(self.store.fail_job, job_id, outcome["error"], result)
+            else:
+                await asyncio.to_thread(self.store.complete_job, job_id, result)
+        except asyncio.CancelledError:
+            if lease.done():
+                # The lease was lost, the job is run by the worker that claimed it
+                return
+            # Stopped: the job is left to the worker that resumes it
+            await asyncio.to_thread(self.store.release_job, job_id, self.owner)
+            raise
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            await asyncio.to_thread(self.store.fail_job, job_id, str(e))
+        finally:
+            lease.cancel()
+            run.cancel()
+            job_progress_callback.reset(token)
+            job_outcome.reset(outcome_token)
+            await asyncio.to_thread(self.store.set_progress, job_id, self.progress.pop(job_id))
+        job = self.status(job_id)
+        self._publish(job_id, {"type": "status", **job})
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,350 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.chunk_cache import normalize_chunk
+from utils.data_dir import data_path
+
+# SQLite file of the ingestion jobs and their per chunk checkpoints. An empty value disables checkpointing.
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", data_path("jobs.sqlite3"))
+
+# Seconds a worker owns the job it claimed without renewing its lease. A job whose worker died is claimed
+# again once its lease expired.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+JOB_STATUSES = ("pending", "running", "done", "failed")
+JOB_COLUMNS = "job_id, kind, status, stage, params, result, error, progress, owner, lease_expires, created_at, updated_at"
+
+# Progress callback of the job run by the current task, set by the job runner. Tasks created by the job inherit it.
+job_progress_callback: ContextVar[Optional[Callable[..., None]]] = ContextVar("job_progress_callback", default=None)
+# Outcome of the job run by the current task, set by the job runner: {"job_id", "error"}. The runner alone
+# completes or fails its jobs, the workflow only reports the error of its failed chunks here.
+job_outcome: ContextVar[Optional[Dict[str, Any]]] = ContextVar("job_outcome", default=None)
+
+
+def report_progress(
+    stage: Optional[str] = None, chunks_done: int = 0, chunks_failed: int = 0, prompt_tokens: int = 0
+) -> None:
+    """
+    Report the progress of the current job, a no-op outside of a job.
+    :param stage: The workflow stage the job entered.
+    :param chunks_done: Chunks completed (or resumed from a checkpoint) since the last report.
+    :param chunks_failed: Chunks failed since the last report.
+    :param prompt_tokens: Tokens sent to the LLM since the last report.
+    """
+    callback = job_progress_callback.get()
+    if callback is not None:
+        callback(stage=stage, chunks_done=chunks_done, chunks_failed=chunks_failed, prompt_tokens=prompt_tokens)
+
+
+def run_by_job_runner(job_id: Optional[str]) -> bool:
+    """
+    Whether the current task runs the job for the job runner, which completes or fails it once its handler returned.
+    """
+    outcome = job_outcome.get()
+    return job_id is not None and outcome is not None and outcome["job_id"] == job_id
+
+
+def chunk_hash(text: str) -> str:
+    # A checkpoint is only reused for the same chunk content, so a changed document is recomputed
+    return hashlib.sha256(normalize_chunk(text).encode("utf-8")).hexdigest()
+
+
+class JobStore:
+    """
+    Persistent store of ingestion jobs: their status, workflow stage and result, and the output of every
+    completed chunk. A job that is run again with the same id resumes from its checkpoints, so a restart
+    or a failed upstream call only costs the missing chunks.
+    Workers of several processes share the store: a job is run by the worker that claimed it, under a lease
+    the worker renews while the job runs.
+    """
+
+    def __init__(self, path: str = JOB_STORE_PATH) -> None:
+        """
+        :param path: SQLite database file, created on first use.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    params TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    progress TEXT,
+                    owner TEXT,
+                    lease_expires REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+            if "progress" not in columns:
+                # Job stores created before progress was tracked
+                self._connection.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+            if "owner" not in columns:
+                # Job stores created before jobs were claimed
+                self._connection.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                self._connection.execute("ALTER TABLE jobs ADD COLUMN lease_expires REAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job_chunks (
+                    job_id TEXT NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    chunk_hash TEXT NOT NULL,
+                    output TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, chunk_index)
+                )
+                """
+            )
+
+    def create_job(self, kind: str, params: Optional[Dict[str, Any]] = None, job_id: Optional[str] = None) -> str:
+        """
+        :param kind: The workflow of the job, e.g. "product_discovery".
+        :param params: JSON serializable parameters needed to run the job again.
+        :param job_id: Id chosen by the client, a new uuid by default.
+        :return: The job id.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO jobs (job_id, kind, status, stage, params, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, "pending", None, json.dumps(params or {}), now, now),
+            )
+        return job_id
+
+    def _row_to_job(self, row: Tuple) -> Dict[str, Any]:
+        job_id, kind, status, stage, params, result, error, progress, owner, lease_expires, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "status": status,
+            "stage": stage,
+            "params": json.loads(params),
+            "result": json.loads(result) if result is not None else None,
+            "error": error,
+            "progress": json.loads(progress) if progress is not None else {},
+            "owner": owner,
+            "lease_expires": lease_expires,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def list_jobs(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        query = f"SELECT {JOB_COLUMNS} FROM jobs"
+        args: Tuple = ()
+        if status:
+            query += " WHERE status = ?"
+            args = (status,)
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY created_at", args).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def claimable_jobs(self) -> List[Dict[str, Any]]:
+        """
+        The jobs a worker can claim: pending, or running with an expired lease (their worker died).
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT {JOB_COLUMNS} FROM jobs WHERE status = 'pending' "
+                "OR (status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)) ORDER BY created_at",
+                (time.time(),),
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def claim_job(self, job_id: str, owner: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """
+        Atomically take a claimable job (see claimable_jobs) and mark it running.
+        :param owner: Id of the claiming worker, unique across processes.
+        :return: Whether the job was claimed, False when it is done, failed or run by another worker.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = 'running', stage = 'started', error = NULL, owner = ?, lease_expires = ?, "
+                "updated_at = ? WHERE job_id = ? AND (status = 'pending' "
+                "OR (status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)))",
+                (owner, now + lease_seconds, now, job_id, now),
+            )
+        return cursor.rowcount == 1
+
+    def renew_lease(self, job_id: str, owner: str, lease_seconds: float = JOB_LEASE_SECONDS) -> bool:
+        """
+        :return: Whether the owner still holds the job, False once another worker claimed it.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND owner = ? AND status = 'running'",
+                (now + lease_seconds, job_id, owner),
+            )
+        return cursor.rowcount == 1
+
+    def release_job(self, job_id: str, owner: str) -> None:
+        """
+        Put a running job back to pending, e.g. at shutdown, for any worker to resume it.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'pending', owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE job_id = ? AND owner = ? AND status = 'running'",
+                (time.time(), job_id, owner),
+            )
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"UPDATE jobs SET {assignments} WHERE job_id = ?", (*fields.values(), job_id)
+            )
+
+    def set_stage(self, job_id: str, stage: str) -> None:
+        self._update(job_id, status="running", stage=stage, error=None)
+
+    def set_progress(self, job_id: str, progress: Dict[str, Any]) -> None:
+        self._update(job_id, progress=json.dumps(progress))
+
+    def requeue_job(self, job_id: str) -> None:
+        self._update(job_id, status="pending", error=None, owner=None, lease_expires=None)
+
+    def complete_job(self, job_id: str, result: Any) -> None:
+        self._update(
+            job_id, status="done", stage="done", result=json.dumps(result, default=str), owner=None, lease_expires=None
+        )
+
+    def fail_job(self, job_id: str, error: str, result: Any = None) -> None:
+        """
+        :param result: A partial result, kept next to the error.
+        """
+        fields = {"status": "failed", "error": error, "owner": None, "lease_expires": None}
+        if result is not None:
+            fields["result"] = json.dumps(result, default=str)
+        self._update(job_id, **fields)
+
+    def save_chunk(self, job_id: str, chunk_index: int, text: str, output: Any) -> None:
+        """
+        Checkpoint the output of a completed chunk.
+        :param text: The chunk, only its hash is stored.
+        """
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO job_chunks (job_id, chunk_index, chunk_hash, output, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, chunk_index, chunk_hash(text), json.dumps(output), time.time()),
+            )
+
+    def chunk_outputs(self, job_id: str) -> Dict[int, Tuple[str, Any]]:
+        """
+        :return: chunk index -> (chunk hash, output) of the completed chunks of the job.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT chunk_index, chunk_hash, output FROM job_chunks WHERE job_id = ?", (job_id,)
+            ).fetchall()
+        return {chunk_index: (hash_, json.loads(output)) for chunk_index, hash_, output in rows}
+
+
+_job_store: Optional[JobStore] = None
+
+
+def get_job_store() -> Optional[JobStore]:
+    """
+    The process wide job store, or None when JOB_STORE_PATH is empty.
+    """
+    global _job_store
+    if _job_store is None and JOB_STORE_PATH:
+        _job_store = JobStore(JOB_STORE_PATH)
+    return _job_store
+
+
+class JobCheckpoints:
+    """
+    The checkpoints of one job run, a no-op when the run has no job (or the store is disabled).
+    Used by the async workflows: the store is read and written in a worker thread, off the event loop.
+    """
+
+    def __init__(self, job_id: Optional[str], outputs: Optional[Dict[int, Tuple[str, Any]]] = None) -> None:
+        self.store = get_job_store() if job_id else None
+        self.job_id = job_id
+        self.outputs = outputs or {}
+        self.resumed = 0
+        self.failed: List[int] = []
+
+    @classmethod
+    async def load(cls, job_id: Optional[str]) -> "JobCheckpoints":
+        """
+        The checkpoints of the job, with the outputs of its completed chunks.
+        """
+        store = get_job_store() if job_id else None
+        outputs = await asyncio.to_thread(store.chunk_outputs, job_id) if store else {}
+        return cls(job_id, outputs)
+
+    def get(self, chunk_index: int, text: str) -> Optional[Any]:
+        """
+        :return: The checkpointed output of the chunk, or None when it has to be computed.
+        """
+        checkpoint = self.outputs.get(chunk_index)
+        if checkpoint is None or checkpoint[0] != chunk_hash(text):
+            return None
+        self.resumed += 1
+        report_progress(chunks_done=1)
+        return checkpoint[1]
+
+    async def save(self, chunk_index: int, text: str, output: Any) -> None:
+        if self.store:
+            await asyncio.to_thread(self.store.save_chunk, self.job_id, chunk_index, text, output)
+        report_progress(chunks_done=1)
+
+    def fail(self, chunk_index: int) -> None:
+        """
+        Record a chunk whose LLM calls failed, it is not checkpointed and the job can't be completed.
+        """
+        self.failed.append(chunk_index)
+        report_progress(chunks_failed=1)
+
+    async def stage(self, stage: str) -> None:
+        if self.store:
+            await asyncio.to_thread(self.store.set_stage, self.job_id, stage)
+        report_progress(stage=stage)
+
+    async def complete(self, result: Any) -> None:
+        """
+        Store the result of the run. With failed chunks the job stays resumable: running it again retries them.
+        A job of the job runner is left running, the failed chunks are reported to the runner.
+        """
+        if not self.store:
+            return
+        error = f"Chunks {self.failed} failed, run the job again to retry them" if self.failed else None
+        if run_by_job_runner(self.job_id):
+            job_outcome.get()["error"] = error
+        elif error:
+            await asyncio.to_thread(self.store.fail_job, self.job_id, error, result)
+        else:
+            await asyncio.to_thread(self.store.complete_job, self.job_id, result)
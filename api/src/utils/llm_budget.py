@@ -0,0 +1,38 @@
+import asyncio
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator, Optional
+
+# LLM calls allowed in flight, shared by every task started under use_llm_budget (e.g. all documents of a batch).
+# Unset, each workflow is only limited by its own chunk concurrency.
+llm_call_budget: ContextVar[Optional[asyncio.Semaphore]] = ContextVar("llm_call_budget", default=None)
+
+
+@contextmanager
+def use_llm_budget(max_calls: int) -> Iterator[asyncio.Semaphore]:
+    """
+    Share one budget of max_calls concurrent LLM calls between the tasks created inside the block.
+    """
+    budget = asyncio.Semaphore(max(1, max_calls))
+    token = llm_call_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        llm_call_budget.reset(token)
+
+
+def within_llm_budget(func: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """
+    Decorator for the coroutines calling an LLM: wait for a slot of the current budget, if any, during the call.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        budget = llm_call_budget.get()
+        if budget is None:
+            return await func(*args, **kwargs)
+        async with budget:
+            return await func(*args, **kwargs)
+
+    return wrapper
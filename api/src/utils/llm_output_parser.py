@@ -0,0 +1,286 @@
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Rest of a "Nodes:" / "Relationships:" section header, markdown decoration around it is tolerated
+headerEndRegex = re.compile(r"\b[\s*_#]*:")
+SECTIONS = ("nodes", "relationships")
+# Double quoted strings (an unterminated one runs to the end of a truncated answer), brackets and separators,
+# and bare values: unquoted names keep their spaces, a colon inside one is joined back by the parser.
+tokenRegex = re.compile(r'"(?:[^"\\]|\\.)*(?:"|$)|[\[\]{}:,]|[^\s\[\]{}:,"][^\[\]{}:,"]*', re.DOTALL)
+
+MAX_DEPTH = 32
+
+jsonDecoder = json.JSONDecoder()
+
+
+class _PartialList(list):
+    # A list cut off by the end of the answer, its last value may be truncated
+    pass
+
+
+def _decode_string(token: str) -> str:
+    if len(token) >= 2 and token.endswith('"'):
+        try:
+            return json.loads(token)
+        except ValueError:
+            return token[1:-1]
+    # Truncated answer
+    return token[1:]
+
+
+def _join_words(words: List[str]) -> str:
+    if len(words) == 1:
+        return words[0].rstrip()
+    return "".join(word.rstrip() for word in words)
+
+
+def _scalar(words: List[str]) -> Any:
+    # Bare property values, as json.loads would read them (LLMs also write Python's True/False/None)
+    value = _join_words(words)
+    lowered = value.lower()
+    if lowered == "true":
+        return True
+    if lowered == "false":
+        return False
+    if lowered in ("null", "none"):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+class _Parser:
+    """
+    Tolerant parser of the bracket lists written by LLMs: unquoted names with spaces or separators,
+    quoted commas, nested brackets, Python literals and answers cut off in the middle of an entry.
+    """
+
+    def __init__(self, text: str) -> None:
+        self.tokens = iter(tokenRegex.findall(text))
+
+    def parse_list(self, depth: int = 0, scalars: bool = False) -> List[Any]:
+        """
+        :param scalars: Read bare words as JSON scalars, for lists inside properties.
+        """
+        items: List[Any] = []
+        words: List[str] = []
+        while True:
+            token = next(self.tokens, None)
+            if token is None or token == "]":
+                if words:
+                    items.append(_scalar(words) if scalars else _join_words(words))
+                return items if token else _PartialList(items)
+            if token == ",":
+                if words:
+                    items.append(_scalar(words) if scalars else _join_words(words))
+                    words = []
+            elif token == "[" and depth < MAX_DEPTH:
+                items.append(self.parse_list(depth + 1, scalars))
+            elif token == "{" and depth < MAX_DEPTH:
+                items.append(self.parse_dict(depth + 1))
+            elif token[0] == '"':
+                items.append(_decode_string(token))
+            else:
+                words.append(token)
+
+    def parse_dict(self, depth: int = 0) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        key: Optional[str] = None
+        value: Any = None
+        has_value = False
+        words: List[str] = []
+
+        def store() -> None:
+            if key is not None and (has_value or words):
+                result[key] = value if has_value else _scalar(words)
+
+        while True:
+            token = next(self.tokens, None)
+            if token is None or token == "}":
+                store()
+                return result
+            if token == ",":
+                store()
+                key, value, has_value, words = None, None, False, []
+            elif token == ":" and key is None:
+                key = str(value) if has_value else _join_words(words) if words else ""
+                value, has_value, words = None, False, []
+            elif token == "[" and depth < MAX_DEPTH:
+                value, has_value = self.parse_list(depth + 1, scalars=True), True
+            elif token == "{" and depth < MAX_DEPTH:
+                value, has_value = self.parse_dict(depth + 1), True
+            elif token[0] == '"':
+                value, has_value = _decode_string(token), True
+            else:
+                words.append(token)
+
+    def parse_entries(self) -> List[Any]:
+        # Top level: everything outside of brackets (bullets, notes, markdown) is ignored
+        values = []
+        while True:
+            token = next(self.tokens, None)
+            if token is None:
+                return values
+            if token == "[":
+                values.append(self.parse_list(1))
+
+
+def _collect_entries(values: List[Any], entries: List[List[Any]]) -> None:
+    # Lists of lists are containers, any other non empty list is an entry. An entry cut off by the end of
+    # the answer is dropped, its last value can't be trusted.
+    for value in values:
+        if not isinstance(value, list) or not value:
+            continue
+        if isinstance(value[0], list):
+            _collect_entries(value, entries)
+        elif not isinstance(value, _PartialList):
+            entries.append(value)
+
+
+def _decode_entries(text: str, start: int) -> List[Any]:
+    try:
+        # The whole section in one call when the entries are separated by commas
+        return json.loads("[" + text[start:text.rfind("]") + 1] + "]")
+    except ValueError:
+        pass
+    # Entries separated by new lines or notes, one call per entry, until the first entry that isn't JSON
+    values = []
+    index = start
+    while index != -1:
+        try:
+            value, index = jsonDecoder.raw_decode(text, index)
+        except ValueError:
+            return values + _Parser(text[index:]).parse_entries()
+        values.append(value)
+        index = text.find("[", index)
+    return values
+
+
+def parse_entries(text: str) -> List[List[Any]]:
+    """
+    Entries of a bracket list answer, e.g. '["alice", "Person", {"age": 30}], ["bob", "Person", {}]'
+    or '[["alice", "Person", {"age": 30}]]'.
+    Valid JSON is decoded by the json module, anything else goes through the tolerant single pass parser.
+    :return: One list per entry, with its values (strings, and dicts for properties).
+    """
+    entries: List[List[Any]] = []
+    start = text.find("[")
+    if start == -1:
+        return entries
+    _collect_entries(_decode_entries(text, start), entries)
+    return entries
+
+
+def _split_entry(entry: List[Any], fields: int) -> Optional[List[Any]]:
+    # The values of an entry in any shape: properties first, extra values, nested lists...
+    values = [item for item in entry if not isinstance(item, (dict, list))]
+    if len(values) < fields:
+        return None
+    properties = next((item for item in entry if isinstance(item, dict)), {})
+    return [str(value).strip() for value in values[:fields]] + [properties]
+
+
+def entries_to_nodes(entries: Iterable[List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Node dicts of [name, label, properties] entries, entries without a name and a label are skipped.
+    """
+    nodes = []
+    for entry in entries:
+        size = len(entry)
+        if 2 <= size <= 3 and type(entry[0]) is str and type(entry[1]) is str:
+            if size == 2:
+                properties = {}
+            elif type(entry[2]) is dict:
+                properties = entry[2]
+            else:
+                properties = None
+            if properties is not None:
+                nodes.append({"name": entry[0].strip(), "label": entry[1].strip(), "properties": properties})
+                continue
+        values = _split_entry(entry, 2)
+        if values:
+            nodes.append({"name": values[0], "label": values[1], "properties": values[2]})
+    return nodes
+
+
+def entries_to_relationships(entries: Iterable[List[Any]]) -> List[Dict[str, Any]]:
+    """
+    Relationship dicts of [start, type, end, properties] entries, incomplete entries are skipped.
+    """
+    relationships = []
+    for entry in entries:
+        size = len(entry)
+        if 3 <= size <= 4 and type(entry[0]) is str and type(entry[1]) is str and type(entry[2]) is str:
+            if size == 3:
+                properties = {}
+            elif type(entry[3]) is dict:
+                properties = entry[3]
+            else:
+                properties = None
+            if properties is not None:
+                relationships.append(
+                    {"start": entry[0].strip(), "end": entry[2].strip(), "type": entry[1].strip(), "properties": properties}
+                )
+                continue
+        values = _split_entry(entry, 3)
+        if values:
+            relationships.append({"start": values[0], "end": values[2], "type": values[1], "properties": values[3]})
+    return relationships
+
+
+def parse_nodes(text: str) -> List[Dict[str, Any]]:
+    return entries_to_nodes(parse_entries(text))
+
+
+def parse_relationships(text: str) -> List[Dict[str, Any]]:
+    return entries_to_relationships(parse_entries(text))
+
+
+def _section_headers(text: str) -> List[Tuple[int, int, str]]:
+    # str.find on the lowered answer instead of a case insensitive regex scan, a large answer is only read once
+    lowered = text.lower()
+    headers = []
+    for section in SECTIONS:
+        index = lowered.find(section)
+        while index != -1:
+            header_end = headerEndRegex.match(lowered, index + len(section))
+            if header_end and (index == 0 or not lowered[index - 1].isalnum()):
+                headers.append((index, header_end.end(), section))
+            index = lowered.find(section, index + len(section))
+    headers.sort()
+    return headers
+
+
+def parse_graph_output(text: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Nodes and relationships of a "Nodes: [...] Relationships: [...]" answer.
+    :return: {"nodes": [...], "relationships": [...]}, both empty when the answer has no Nodes section.
+    """
+    result: Dict[str, List[Dict[str, Any]]] = {"nodes": [], "relationships": []}
+    headers = _section_headers(text)
+    for index, (_, section_start, section) in enumerate(headers):
+        section_end = headers[index + 1][0] if index + 1 < len(headers) else len(text)
+        entries = parse_entries(text[section_start:section_end])
+        if section == "nodes":
+            result["nodes"].extend(entries_to_nodes(entries))
+        else:
+            result["relationships"].extend(entries_to_relationships(entries))
+    return result
+
+
+def parse_graph_outputs(results: Iterable[str]) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Merged nodes and relationships of several answers (e.g. one per chunk), in order.
+    """
+    merged: Dict[str, List[Dict[str, Any]]] = {"nodes": [], "relationships": []}
+    for text in results:
+        parsed = parse_graph_output(text)
+        merged["nodes"].extend(parsed["nodes"])
+        merged["relationships"].extend(parsed["relationships"])
+    return merged
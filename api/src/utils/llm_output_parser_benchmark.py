@@ -0,0 +1,126 @@
+"""
+Micro-benchmark of the LLM output parser against the regex parsing it replaced.
+
+    python -m utils.llm_output_parser_benchmark --nodes 5000 --chunks 1 --repeat 5
+
+Best of 5 on the development machine, against the previous regex parsing without its logging:
+- JSON answers: 3.3x (500 nodes), 4.7x (5000 nodes in one answer), 4.1x (5000 nodes in 200 answers).
+- Unquoted answers: 0.9x to 1.0x, the tolerant tokenizer costs what the regex saved.
+Only the previous version with its per answer logging of the growing lists is slower by 10x or more
+(16x on 200 JSON answers). The gain of the parser is its correctness on unquoted answers, not its speed.
+"""
+import argparse
+import contextlib
+import json
+import os
+import re
+import time
+from typing import Callable, List
+
+from utils.llm_output_parser import parse_graph_outputs
+
+
+def regex_parse(result: List[str], log: bool = False):
+    """
+    The parsing of getNodesAndRelationshipsFromResult and nodes/relationshipTextToListOfDict before the parser.
+    :param log: Also print what the chunking workflows' copies printed for every answer.
+    """
+    regex = "Nodes:\s+(.*?)\s?\s?Relationships:\s?\s?(.*)"
+    internalRegex = "\[(.*?)\]"
+    jsonRegex = "\{.*\}"
+    nodes = []
+    relationships = []
+    for row in result:
+        parsing = re.match(regex, row, flags=re.S)
+        if parsing is None:
+            continue
+        nodes.extend(re.findall(internalRegex, str(parsing.group(1))))
+        relationships.extend(re.findall(internalRegex, parsing.group(2)))
+        if log:
+            print(f"Processing row: {row}")
+            print(f"Extracted rawNodes: {parsing.group(1)}")
+            print(f"Extracted rawRelationships: {parsing.group(2)}")
+            print(f"Current list of nodes: {nodes}")
+            print(f"Current list of relationships: {relationships}")
+    nodes = [node for node in nodes if len(node.split(",")) >= 2]
+    relationships = [rel for rel in relationships if len(rel.split(",")) >= 3]
+
+    def properties_of(text):
+        properties = re.search(jsonRegex, text)
+        properties = "{}" if properties is None else properties.group(0)
+        try:
+            return json.loads(properties.replace("True", "true"))
+        except Exception:
+            return {}
+
+    parsed_nodes = []
+    for node in nodes:
+        nodeList = node.split(",")
+        parsed_nodes.append({
+            "name": nodeList[0].strip().replace('"', ""),
+            "label": nodeList[1].strip().replace('"', ""),
+            "properties": properties_of(node),
+        })
+    parsed_relationships = []
+    for relation in relationships:
+        relationList = relation.split(",")
+        parsed_relationships.append({
+            "start": relationList[0].strip().replace('"', ""),
+            "end": relationList[2].strip().replace('"', ""),
+            "type": relationList[1].strip().replace('"', ""),
+            "properties": properties_of(relation),
+        })
+    return {"nodes": parsed_nodes, "relationships": parsed_relationships}
+
+
+def make_response(nodes: int, quoted: bool = True) -> str:
+    """
+    One "Nodes: [...] Relationships: [...]" answer, with a relationship per node.
+    :param quoted: JSON entries, or the unquoted names and Python literals some models write.
+    """
+    if quoted:
+        node_entries = [
+            f'["chemical {i}", "Chemical", {{"weight": "{i % 7}.5%", "function": "emollient"}}]' for i in range(nodes)
+        ]
+        relationship_entries = [f'["product", "CONTAINS", "chemical {i}", {{"verified": true}}]' for i in range(nodes)]
+    else:
+        node_entries = [f"[chemical {i}, Chemical, {{weight: {i % 7}.5, active: True}}]" for i in range(nodes)]
+        relationship_entries = [f"[product, CONTAINS, chemical {i}, {{}}]" for i in range(nodes)]
+    return "Nodes: " + ", ".join(node_entries) + "\nRelationships: " + ", ".join(relationship_entries)
+
+
+def best_time(parse: Callable, responses: List[str], repeat: int) -> float:
+    timings = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            parse(responses)
+            timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def run(nodes: int, chunks: int, repeat: int) -> None:
+    """
+    :param nodes: Nodes (and relationships) of the whole document.
+    :param chunks: Answers they are split into, 1 for one large answer.
+    """
+    for quoted in (True, False):
+        responses = [make_response(nodes // chunks, quoted) for _ in range(chunks)]
+        parser_seconds = best_time(parse_graph_outputs, responses, repeat)
+        regex_seconds = best_time(regex_parse, responses, repeat)
+        logged_seconds = best_time(lambda result: regex_parse(result, log=True), responses, repeat)
+        print(
+            f"{'json' if quoted else 'unquoted'} entries, {nodes} nodes and relationships in {chunks} answers: "
+            f"parser {parser_seconds * 1000:.1f} ms, "
+            f"regex {regex_seconds * 1000:.1f} ms ({regex_seconds / parser_seconds:.1f}x), "
+            f"regex with logging {logged_seconds * 1000:.1f} ms ({logged_seconds / parser_seconds:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the LLM output parser with the regex parsing.")
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--chunks", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.nodes, args.chunks, args.repeat)
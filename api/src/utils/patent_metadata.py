@@ -0,0 +1,156 @@
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+# Characters of the first chunk searched for the front page fields
+FRONT_PAGE_CHARS = int(os.getenv("FRONT_PAGE_CHARS", "8000"))
+# Below this confidence the document details are asked to the LLM, which only fills the fields the rules missed
+PATENT_METADATA_CONFIDENCE = float(os.getenv("PATENT_METADATA_CONFIDENCE", "0.8"))
+
+# Confidence brought by every field, a patent number read next to its label is worth more than one found in the text
+FIELD_WEIGHTS = {"labelled_patent_no": 0.4, "patent_no": 0.25, "inventor_name": 0.2, "assignee_information": 0.2, "cpcc_codes": 0.2}
+
+# US 7,123,456 B2 / US 2024/0398687 A1 / US 20240398687 A1 / EP 1 234 567 B1 / WO 2019/123456 A1
+numberPattern = (
+    r"(?P<country>US|EP|WO)\s?"
+    r"(?P<number>(?:19|20)\d{2}\s?/\s?\d{6,7}|(?:19|20)\d{8,9}|\d{1,2},\d{3},\d{3}|\d{1,2}\s?\d{3}\s?\d{3}|RE\s?\d{5})"
+    r"(?:\s?(?P<kind>[ABCEPSU]\d?))?\b"
+)
+patentNumberRegex = re.compile(r"\b" + numberPattern)
+labelledPatentNumberRegex = re.compile(
+    r"(?:DOCUMENT ID|Patent No\.?|Pub(?:lication)?\.? No\.?|Publication Number|\(1[01]\))\s*:?\s*" + numberPattern,
+    re.IGNORECASE,
+)
+# Blocks of the USPTO full text front page: "INVENTOR INFORMATION  NAME   CITY ... HSIEH; I-fan   Scotch Plains ..."
+inventorBlockRegex = re.compile(
+    r"INVENTOR INFORMATION\s+(?P<block>.*?)(?=APPLICANT INFORMATION|ASSIGNEE INFORMATION|APPLICATION NO|$)", re.DOTALL
+)
+assigneeBlockRegex = re.compile(r"ASSIGNEE INFORMATION\s+NAME\s+(?P<name>.+?)\s+CITY\b", re.DOTALL)
+# INID coded or labelled front pages: "(72) Inventors: Jane Doe, Paris (FR); ..." / "Assignee: L'Oreal, Paris (FR)"
+inventorLabelRegex = re.compile(
+    r"(?:\(72\)\s*)?\bInventors?\s*:\s*(?P<names>.+?)(?=\(\d{2}\)|\n\s*\n|\b(?:Current )?Assignee|\bApplicants?\s*:|$)",
+    re.IGNORECASE | re.DOTALL,
+)
+assigneeLabelRegex = re.compile(
+    r"(?:\(7[13]\)\s*)?\b(?:Current Assignee|Assignees?|Applicants?)\s*:\s*(?P<name>[^\n(;]+)", re.IGNORECASE
+)
+# CPC symbols, spaced or not: "A61K 8/87", "A61Q3/02", "A   61   K   8 / 87"
+cpcRegex = re.compile(r"\b(?P<section>[A-HY])\s*(?P<class>\d{2})\s*(?P<subclass>[A-Z])\s*(?P<group>\d{1,4})\s*/\s*(?P<subgroup>\d{2,6})\b")
+cpcLabelRegex = re.compile(r"\bCPC\b|\(52\)|\bInt\.?\s*Cl\b", re.IGNORECASE)
+fieldSeparatorRegex = re.compile(r"\s{2,}|\n")
+inventorSeparatorRegex = re.compile(r";|\band\b|\n")
+locationRegex = re.compile(r",.*$|\(\w{2}\)\s*$")
+
+INVENTOR_TABLE_HEADERS = {"NAME", "CITY", "STATE", "ZIP CODE", "COUNTRY"}
+MAX_INVENTORS = 30
+
+
+class PatentMetadata(NamedTuple):
+    patent_no: Optional[str]
+    inventor_name: List[str]
+    assignee_information: Optional[str]
+    cpcc_codes: List[str]
+    confidence: float
+
+    def details(self) -> Dict[str, Any]:
+        """
+        The fields found, in the PatentDetails format of the document prompt.
+        """
+        return {
+            "patent_no": self.patent_no,
+            "inventor_name": self.inventor_name or None,
+            "assignee_information": self.assignee_information,
+            "cpcc_codes": self.cpcc_codes or None,
+        }
+
+    def document(self, fallback: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        The PatentDocument of the fields found, missing fields taken from the fallback (e.g. the LLM answer).
+        """
+        details = self.details()
+        fallback_details = (fallback or {}).get("patent") or {}
+        for field, value in details.items():
+            if not value and fallback_details.get(field):
+                details[field] = fallback_details[field]
+        return {"patent": details}
+
+
+def normalize_patent_number(match: "re.Match") -> str:
+    """
+    "US 7,123,456 B2" -> "US 7123456 B2", "US 2024/0398687 A1" -> "US 20240398687 A1", "WO2019123456" -> "WO 2019/123456".
+    """
+    country = match.group("country").upper()
+    number = re.sub(r"[\s,/]", "", match.group("number")).upper()
+    if country == "WO" and len(number) == 10:
+        number = number[:4] + "/" + number[4:]
+    kind = match.group("kind")
+    return f"{country} {number} {kind.upper()}" if kind else f"{country} {number}"
+
+
+def find_patent_number(text: str) -> Optional[str]:
+    """
+    The first US, EP or WO patent (or publication) number of the text, normalized.
+    """
+    match = patentNumberRegex.search(text)
+    return normalize_patent_number(match) if match else None
+
+
+def _unique(values: List[str]) -> List[str]:
+    seen = set()
+    return [value for value in values if not (value.lower() in seen or seen.add(value.lower()))]
+
+
+def _inventors(front_page: str) -> List[str]:
+    block = inventorBlockRegex.search(front_page)
+    if block:
+        # USPTO table: the names are the "LAST; First" cells
+        cells = fieldSeparatorRegex.split(block.group("block"))
+        names = [cell.strip() for cell in cells if ";" in cell and cell.strip() not in INVENTOR_TABLE_HEADERS]
+        if names:
+            return _unique(names)[:MAX_INVENTORS]
+    label = inventorLabelRegex.search(front_page)
+    if label:
+        names = [locationRegex.sub("", name).strip(" .,") for name in inventorSeparatorRegex.split(label.group("names"))]
+        return _unique([name for name in names if 1 < len(name) < 80])[:MAX_INVENTORS]
+    return []
+
+
+def _assignee(front_page: str) -> Optional[str]:
+    match = assigneeBlockRegex.search(front_page) or assigneeLabelRegex.search(front_page)
+    if not match:
+        return None
+    name = locationRegex.sub("", match.group("name")).strip(" .,")
+    return name or None
+
+
+def _cpc_codes(front_page: str) -> List[str]:
+    # Classification symbols of the CPC (or IPC) field, anywhere on the front page without a label
+    label = cpcLabelRegex.search(front_page)
+    scope = front_page[label.start():] if label else front_page
+    codes = [
+        f"{m.group('section')}{m.group('class')}{m.group('subclass')} {m.group('group')}/{m.group('subgroup')}"
+        for m in cpcRegex.finditer(scope)
+    ]
+    return _unique(codes)
+
+
+def extract_patent_metadata(text: str, front_page_chars: int = FRONT_PAGE_CHARS) -> PatentMetadata:
+    """
+    Read the patent number, inventors, assignee and CPC codes from the front page of a patent, without the LLM.
+    Handles the USPTO full text layout (DOCUMENT ID, INVENTOR INFORMATION, ... blocks) and INID coded or
+    labelled front pages.
+    :param text: The first chunk (or the whole text) of the patent.
+    :return: The fields found and the confidence of the extraction, from 0 (nothing found) to 1.
+    """
+    front_page = text[:front_page_chars]
+    labelled = labelledPatentNumberRegex.search(front_page)
+    patent_no = normalize_patent_number(labelled) if labelled else find_patent_number(front_page)
+    inventors = _inventors(front_page)
+    assignee = _assignee(front_page)
+    cpc_codes = _cpc_codes(front_page)
+
+    confidence = FIELD_WEIGHTS["labelled_patent_no"] if labelled else FIELD_WEIGHTS["patent_no"] if patent_no else 0
+    confidence += FIELD_WEIGHTS["inventor_name"] if inventors else 0
+    confidence += FIELD_WEIGHTS["assignee_information"] if assignee else 0
+    confidence += FIELD_WEIGHTS["cpcc_codes"] if cpc_codes else 0
+    return PatentMetadata(patent_no, inventors, assignee, cpc_codes, round(min(confidence, 1.0), 2))
@@ -0,0 +1,286 @@
+import os
+import re
+from typing import Any, AsyncIterator, List, NamedTuple, Optional, Tuple, Union
+
+from utils.chunking import CHARS_PER_TOKEN, chunk_text, get_encoding
+
+# Tokens repeated between consecutive chunks of the same section, so names and weight ranges are never cut in half
+PATENT_CHUNK_OVERLAP_TOKENS = int(os.getenv("PATENT_CHUNK_OVERLAP_TOKENS", "64"))
+
+# Heading patterns in priority order, matched against a whole (short) line
+SECTION_HEADINGS = [
+    ("drawings", r"brief description of (?:the )?(?:drawings|figures)"),
+    ("claims", r"(?:what is claimed is|we claim|i claim|claims?)"),
+    ("examples", r"(?:working |comparative )?examples?(?: \w+)?"),
+    ("description", r"(?:detailed description|description)(?: of .*)?"),
+    ("background", r"background(?: of .*)?"),
+    ("summary", r"summary(?: of .*)?"),
+    ("abstract", r"abstract(?: of .*)?"),
+    ("field", r"(?:technical )?field(?: of .*)?"),
+]
+headingRegex = re.compile(
+    r"^\s*(?:[\dIVX]+[.)]\s*)?(?:" + "|".join(f"(?P<{name}>{pattern})" for name, pattern in SECTION_HEADINGS) + r")\s*:?\s*$",
+    re.IGNORECASE,
+)
+tableHeadingRegex = re.compile(r"^\s*table\s+\d+\b", re.IGNORECASE)
+# Rows of a formulation table: percentages, tab/pipe separated columns or runs of spaces
+tableRowRegex = re.compile(r"%|\t|\||\S {2,}\S")
+
+# Sections that can contain formulations (chemicals with weights). "front" is the text before the first heading.
+FORMULATION_SECTIONS = {"front", "summary", "description", "examples", "table", "claims"}
+
+MAX_HEADING_LENGTH = 80
+
+
+class Section(NamedTuple):
+    name: str
+    start: int
+    end: int
+
+
+class PatentChunk(NamedTuple):
+    text: str
+    section: str
+    start: int
+    end: int
+    token_count: int
+
+
+class SectionScanner:
+    """
+    Line by line section detection, shared by segment_patent and the streaming chunker.
+    """
+
+    def __init__(self) -> None:
+        self.current = "front"
+        # The section a table is embedded in, restored when the table ends
+        self.outer = "front"
+
+    def feed(self, line: str) -> str:
+        """
+        :param line: The next line of the patent.
+        :return: The name of the section the line belongs to.
+        """
+        stripped = line.strip()
+        if stripped and len(stripped) <= MAX_HEADING_LENGTH:
+            match = headingRegex.match(stripped)
+            if match:
+                self.current = self.outer = match.lastgroup
+                return self.current
+            if tableHeadingRegex.match(stripped):
+                self.current = "table"
+                return self.current
+        if self.current == "table" and len(stripped) > MAX_HEADING_LENGTH and not tableRowRegex.search(stripped):
+            # A prose paragraph ends the table, the text continues the section the table was embedded in
+            self.current = self.outer
+        return self.current
+
+
+def segment_patent(text: str) -> List[Section]:
+    """
+    Split a patent into sections using its headings (CLAIMS, DETAILED DESCRIPTION, EXAMPLES, ...) and formulation tables.
+    :param text: The patent text.
+    :return: Consecutive sections covering the whole text, the text before the first heading is "front".
+    """
+    scanner = SectionScanner()
+    sections = []
+    current, current_start = scanner.current, 0
+    position = 0
+    for line in text.splitlines(keepends=True):
+        name = scanner.feed(line)
+        if name != current:
+            sections.append(Section(current, current_start, position))
+            current, current_start = name, position
+        position += len(line)
+    sections.append(Section(current, current_start, len(text)))
+    return [section for section in sections if text[section.start:section.end].strip()]
+
+
+def _section_chunks(
+    text: str, section: str, offset: int, max_tokens: int, overlap_tokens: int, encoding: Optional[Any]
+) -> List[PatentChunk]:
+    chunks = []
+    for chunk in chunk_text(
+        text,
+        max_tokens,
+        overlap_tokens=min(overlap_tokens, max_tokens // 2),
+        snap_to_sentences=True,
+        encoding=encoding,
+    ):
+        if chunk.text.strip():
+            chunks.append(
+                PatentChunk(chunk.text.strip(), section, offset + chunk.start, offset + chunk.end, chunk.token_count)
+            )
+    return chunks
+
+
+class SectionPacker:
+    """
+    Packs consecutive sections into chunks, shared by chunk_patent and the streaming chunker. A table stays with
+    the section before it (the example it belongs to), and consecutive sections of the same name ("Example 1",
+    "Example 2", ...) are packed together up to the token budget. Sections larger than the budget are split on
+    sentence boundaries with overlap.
+    """
+
+    def __init__(self, max_tokens: int, overlap_tokens: int, encoding: Optional[Any] = None) -> None:
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.encoding = encoding or get_encoding()
+        # [name, start, text] of the last section, still waiting for its tables
+        self.unit: Optional[list] = None
+        # Sections (start, text) of the next chunk, all of group_name
+        self.group: List[Tuple[int, str]] = []
+        self.group_name = ""
+        self.group_tokens = 0
+
+    def add(self, name: str, start: int, text: str) -> List[PatentChunk]:
+        """
+        :param start: Offset of the section, right after the previous one.
+        :return: The chunks completed by the section.
+        """
+        if self.unit is not None and (name == "table" or not text.strip()):
+            if name == "table" and self.unit[0] not in FORMULATION_SECTIONS:
+                # The chunk must still get the composition prompt
+                self.unit[0] = "table"
+            self.unit[2] += text
+            return []
+        ready = self.close_unit()
+        if text.strip():
+            self.unit = [name, start, text]
+        return ready
+
+    def close_unit(self) -> List[PatentChunk]:
+        if self.unit is None:
+            return []
+        name, start, text = self.unit
+        self.unit = None
+        tokens = len(self.encoding.encode(text, disallowed_special=()))
+        ready = []
+        if self.group and (name != self.group_name or self.group_tokens + tokens > self.max_tokens):
+            ready.extend(self.flush_group())
+        if tokens > self.max_tokens:
+            ready.extend(_section_chunks(text, name, start, self.max_tokens, self.overlap_tokens, self.encoding))
+        else:
+            self.group.append((start, text))
+            self.group_name = name
+            self.group_tokens += tokens
+        return ready
+
+    def flush_group(self) -> List[PatentChunk]:
+        if not self.group:
+            return []
+        start = self.group[0][0]
+        text = "".join(section_text for _, section_text in self.group)
+        chunk = PatentChunk(text.strip(), self.group_name, start, start + len(text), self.group_tokens)
+        self.group, self.group_tokens = [], 0
+        return [chunk]
+
+    def finish(self) -> List[PatentChunk]:
+        return self.close_unit() + self.flush_group()
+
+
+def chunk_patent(
+    text: str,
+    max_tokens: int,
+    overlap_tokens: int = PATENT_CHUNK_OVERLAP_TOKENS,
+    encoding: Optional[Any] = None,
+) -> List[PatentChunk]:
+    """
+    Pack the sections of a patent into token budgets (see SectionPacker).
+    A chunk never mixes sections of different names, and sections larger than the budget are split on sentence
+    boundaries with overlap.
+    :param text: The patent text.
+    :param max_tokens: Token budget of every chunk.
+    :param overlap_tokens: Tokens repeated between consecutive chunks of the same section.
+    :param encoding: tiktoken encoding, cl100k_base by default.
+    :return: Chunks tagged with their section name.
+    """
+    packer = SectionPacker(max_tokens, overlap_tokens, encoding)
+    chunks = []
+    position = 0
+    for section in segment_patent(text):
+        # Blank text between the sections goes with the next one, so packed sections stay contiguous
+        chunks.extend(packer.add(section.name, position, text[position:section.end]))
+        position = section.end
+    chunks.extend(packer.finish())
+    return chunks
+
+
+async def astream_patent_chunks(
+    texts: AsyncIterator[str],
+    max_tokens: int,
+    overlap_tokens: int = PATENT_CHUNK_OVERLAP_TOKENS,
+    encoding: Optional[Any] = None,
+) -> AsyncIterator[PatentChunk]:
+    """
+    Streaming variant of chunk_patent. Sections are detected line by line and chunks are yielded as soon as
+    they are complete, holding at most about two chunks of the current section in memory.
+    :param texts: The patent as an async stream of text pieces.
+    """
+    threshold = 2 * max_tokens * CHARS_PER_TOKEN
+    scanner = SectionScanner()
+    packer = SectionPacker(max_tokens, overlap_tokens, encoding)
+    section, section_text, section_start = scanner.current, "", 0
+    pending = ""  # incomplete last line
+    # The first line consumed continues a line cut because it was too long, it can't be a heading
+    continued = False
+    position = 0
+
+    def complete_lines(final: bool) -> List[str]:
+        nonlocal pending
+        lines = pending.splitlines(keepends=True)
+        if lines and not final and not lines[-1].endswith(("\n", "\r")):
+            pending = lines.pop()
+            if len(pending) >= threshold:
+                # Text without newlines (OCR output, a single line body) is cut through the token chunker
+                # instead of being buffered whole
+                lines.append(pending)
+                pending = ""
+        else:
+            pending = ""
+        return lines
+
+    def consume(lines: List[str]) -> List[PatentChunk]:
+        nonlocal section, section_text, section_start, position, continued
+        ready = []
+        for line in lines:
+            name = section if continued else scanner.feed(line)
+            continued = not line.endswith(("\n", "\r"))
+            if name != section:
+                ready.extend(packer.add(section, section_start, section_text))
+                section, section_text, section_start = name, "", position
+            section_text += line
+            position += len(line)
+        if len(section_text) >= threshold:
+            chunks = _section_chunks(section_text, section, section_start, max_tokens, overlap_tokens, encoding)
+            if len(chunks) >= 2:
+                # Keep the last chunk of the section open, it may still grow
+                ready.extend(packer.finish())
+                ready.extend(chunks[:-1])
+                tail_start = chunks[-1].start - section_start
+                section_text = section_text[tail_start:]
+                section_start += tail_start
+        return ready
+
+    async for text in texts:
+        pending += text
+        for chunk in consume(complete_lines(final=False)):
+            yield chunk
+    for chunk in consume(complete_lines(final=True)):
+        yield chunk
+    for chunk in packer.add(section, section_start, section_text) + packer.finish():
+        yield chunk
+
+
+async def aiter_patent_chunks(
+    data: Union[str, AsyncIterator[str]], max_tokens: int, **kwargs: Any
+) -> AsyncIterator[PatentChunk]:
+    """
+    Section tagged chunks of a whole patent or of a patent text stream.
+    """
+    if isinstance(data, str):
+        for chunk in chunk_patent(data, max_tokens, **kwargs):
+            yield chunk
+        return
+    async for chunk in astream_patent_chunks(data, max_tokens, **kwargs):
+        yield chunk
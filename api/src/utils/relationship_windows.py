@@ -0,0 +1,120 @@
+import json
+import os
+from collections import defaultdict
+from typing import Callable, Container, Dict, Iterable, List, NamedTuple, Optional
+
+from utils.chunking import CHARS_PER_TOKEN
+from utils.entity_resolution import block_keys, name_similarity, name_tokens
+
+# Prompt tokens of one relationship disambiguation call (relationships and valid node names)
+RELATIONSHIP_WINDOW_TOKENS = int(os.getenv("RELATIONSHIP_WINDOW_TOKENS", "1500"))
+# Valid names listed for a relationship endpoint that is not a valid node, for the LLM to map it to one
+MAX_NAME_CANDIDATES = 3
+NAME_CANDIDATE_SIMILARITY = 0.8
+
+
+class RelationshipWindow(NamedTuple):
+    relationships: List[dict]
+    # The valid node names the relationships refer to, or may refer to
+    valid_names: List[str]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def relationship_line(relation: dict) -> str:
+    return (
+        '["'
+        + relation["start"]
+        + '", "'
+        + relation["type"]
+        + '", "'
+        + relation["end"]
+        + '", '
+        + json.dumps(relation["properties"])
+        + "]\n"
+    )
+
+
+def relationship_prompt_data(window: RelationshipWindow) -> str:
+    return "Relationships:\n" + "".join(relationship_line(relation) for relation in window.relationships) + (
+        "Valid Nodes:\n" + "\n".join(window.valid_names)
+    )
+
+
+def relationship_windows(
+    relationships: List[dict],
+    valid_names: Container[str],
+    candidate_names: Iterable[str] = (),
+    token_budget: int = RELATIONSHIP_WINDOW_TOKENS,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+) -> List[RelationshipWindow]:
+    """
+    Split the relationship disambiguation into windows of at most token_budget prompt tokens. Relationships are
+    grouped by connected component (relationships sharing a node stay in one window, unless the component alone
+    exceeds the budget), and every window only lists the valid names its relationships need: its endpoints, and
+    for an endpoint that is not a valid node, the most similar valid names. Every relationship is in exactly one
+    window, so the total prompt size grows linearly with the number of relationships.
+    :param valid_names: The valid node names, anything supporting "in" (a list, a set, the entity registry).
+    :param candidate_names: Valid names an invalid endpoint may be mapped to, the node names of the document.
+    """
+    # Blocks of the candidate names, as in the entity resolution
+    blocks: Dict[str, List[str]] = defaultdict(list)
+    for name in dict.fromkeys(candidate_names):
+        for key in block_keys(name_tokens(name)):
+            blocks[key].append(name)
+
+    def names_for(endpoint: str) -> List[str]:
+        if endpoint in valid_names:
+            return [endpoint]
+        tokens = name_tokens(endpoint)
+        candidates = {name for key in block_keys(tokens) for name in blocks.get(key, [])}
+        scored = sorted(
+            ((name_similarity(tokens, name_tokens(name)), name) for name in candidates), key=lambda item: (-item[0], item[1])
+        )
+        return [name for score, name in scored[:MAX_NAME_CANDIDATES] if score >= NAME_CANDIDATE_SIMILARITY]
+
+    # Connected components, in order of first appearance
+    parent: Dict[str, str] = {}
+
+    def find(name: str) -> str:
+        parent.setdefault(name, name)
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for relation in relationships:
+        parent[find(relation["start"])] = find(relation["end"])
+    components: Dict[str, List[dict]] = {}
+    for relation in relationships:
+        components.setdefault(find(relation["start"]), []).append(relation)
+
+    windows: List[RelationshipWindow] = []
+    current: Optional[RelationshipWindow] = None
+    current_tokens = 0
+    for component in components.values():
+        # The relationships of a node are next to each other, should the component be split
+        component = sorted(component, key=lambda relation: relation["start"])
+        costs = []
+        for relation in component:
+            names = names_for(relation["start"]) + names_for(relation["end"])
+            costs.append((relation, names, count_tokens(relationship_line(relation)) + sum(count_tokens(name) for name in names)))
+        if current is not None and current_tokens + sum(cost for _, _, cost in costs) > token_budget:
+            windows.append(current)
+            current = None
+        for relation, names, cost in costs:
+            if current is not None and current_tokens + cost > token_budget:
+                windows.append(current)
+                current = None
+            if current is None:
+                current, current_tokens = RelationshipWindow([], []), 0
+            current.relationships.append(relation)
+            for name in names:
+                if name not in current.valid_names:
+                    current.valid_names.append(name)
+            current_tokens += cost
+    if current is not None:
+        windows.append(current)
+    return windows
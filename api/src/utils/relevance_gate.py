@@ -0,0 +1,422 @@
+"""
+Relevance gate of the per-chunk product discovery prompts: a hashed TF-IDF + logistic regression classifier,
+trained on the logged outcomes of past calls, predicts whether a chunk will yield name/description or
+composition facts. Calls on chunks it is confident hold nothing are skipped.
+
+    python -m utils.relevance_gate train --recall 0.98
+    python -m utils.relevance_gate report
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils.chunk_cache import normalize_chunk
+from utils.data_dir import data_path
+
+# SQLite file where the outcome of every gated prompt is logged (the training data). An empty value disables it.
+RELEVANCE_LOG_PATH = os.getenv("RELEVANCE_LOG_PATH", data_path("relevance_log.sqlite3"))
+# Trained gate. The gate is off while the file doesn't exist.
+RELEVANCE_GATE_PATH = os.getenv("RELEVANCE_GATE_PATH", data_path("relevance_gate.json"))
+RELEVANCE_GATE = os.getenv("RELEVANCE_GATE", "true").lower() == "true"
+# Share of the chunks that yield facts the gate must let through, 1.0 only skips chunks scored below every one of them
+RELEVANCE_GATE_RECALL = float(os.getenv("RELEVANCE_GATE_RECALL", "0.98"))
+# Share of the chunks to skip that are sent anyway, so the outcome log keeps covering them for the next training
+RELEVANCE_GATE_EXPLORE = float(os.getenv("RELEVANCE_GATE_EXPLORE", "0.05"))
+
+NAME_DESCRIPTION_TASK = "name_description"
+COMPOSITION_TASK = "composition"
+
+FEATURE_DIMENSION = 2 ** 20
+TRAINING_EPOCHS = 8
+LEARNING_RATE = 0.5
+L2_PENALTY = 1e-5
+CROSS_VALIDATION_FOLDS = 5
+# A task is gated once its log holds enough examples of both outcomes
+MIN_EXAMPLES = 40
+MIN_POSITIVES = 10
+
+# Words, numbers and percent signs: "5 %" and "w/w" are strong hints of a formulation
+tokenRegex = re.compile(r"[a-z]+|\d+|%")
+
+
+def chunk_features(text: str) -> Counter:
+    """
+    Hashed unigram and bigram counts of a chunk.
+    """
+    tokens = tokenRegex.findall(text.lower())
+    # Numbers only count as a number, their value says nothing
+    tokens = ["0" if token.isdigit() else token for token in tokens]
+    counts: Counter = Counter()
+    previous = "^"
+    for token in tokens:
+        counts[zlib.crc32(token.encode()) % FEATURE_DIMENSION] += 1
+        counts[zlib.crc32(f"{previous} {token}".encode()) % FEATURE_DIMENSION] += 1
+        previous = token
+    return counts
+
+
+def _sigmoid(value: float) -> float:
+    if value < -30:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-value))
+
+
+def _explored(task: str, text: str) -> bool:
+    # Decided by the chunk, so a chunk is either always explored or never (and its cached answer stays valid)
+    digest = hashlib.sha256(f"{task}\0{normalize_chunk(text)}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32 < RELEVANCE_GATE_EXPLORE
+
+
+class TfidfVectorizer:
+    """
+    TF-IDF weighting of the hashed features, L2 normalized.
+    """
+
+    def __init__(self, idf: Optional[Dict[int, float]] = None, default_idf: float = 1.0) -> None:
+        self.idf = idf or {}
+        # Weight of the features never seen in training, they have no coefficient but count in the norm
+        self.default_idf = default_idf
+
+    @classmethod
+    def fit(cls, texts: Sequence[str]) -> "TfidfVectorizer":
+        document_frequency: Counter = Counter()
+        for text in texts:
+            document_frequency.update(chunk_features(text).keys())
+        documents = len(texts)
+        idf = {feature: math.log((1 + documents) / (1 + count)) + 1 for feature, count in document_frequency.items()}
+        return cls(idf, math.log(1 + documents) + 1)
+
+    def transform(self, text: str) -> Dict[int, float]:
+        vector = {
+            feature: (1 + math.log(count)) * self.idf.get(feature, self.default_idf)
+            for feature, count in chunk_features(text).items()
+        }
+        norm = math.sqrt(sum(value * value for value in vector.values())) or 1.0
+        return {feature: value / norm for feature, value in vector.items()}
+
+
+class LogisticModel:
+    """
+    Logistic regression over sparse vectors, trained by class balanced stochastic gradient descent.
+    """
+
+    def __init__(self, weights: Optional[Dict[int, float]] = None, bias: float = 0.0) -> None:
+        self.weights = weights or {}
+        self.bias = bias
+
+    def probability(self, vector: Dict[int, float]) -> float:
+        weights = self.weights
+        return _sigmoid(self.bias + sum(value * weights.get(feature, 0.0) for feature, value in vector.items()))
+
+    @classmethod
+    def fit(cls, vectors: Sequence[Dict[int, float]], labels: Sequence[bool], seed: int = 0) -> "LogisticModel":
+        model = cls()
+        positives = sum(labels)
+        negatives = len(labels) - positives
+        if not positives or not negatives:
+            model.bias = 10.0 if positives else -10.0
+            return model
+        # Both outcomes weigh the same whatever their share of the log
+        class_weight = {True: len(labels) / (2 * positives), False: len(labels) / (2 * negatives)}
+        order = list(range(len(vectors)))
+        rng = random.Random(seed)
+        step = 0
+        weights = model.weights
+        for _ in range(TRAINING_EPOCHS):
+            rng.shuffle(order)
+            for index in order:
+                step += 1
+                rate = LEARNING_RATE / math.sqrt(step)
+                vector, label = vectors[index], labels[index]
+                error = (model.probability(vector) - label) * class_weight[label]
+                model.bias -= rate * error
+                for feature, value in vector.items():
+                    weight = weights.get(feature, 0.0)
+                    weights[feature] = weight - rate * (error * value + L2_PENALTY * weight)
+        model.weights = {feature: weight for feature, weight in weights.items() if abs(weight) > 1e-6}
+        return model
+
+
+def recall_threshold(positive_scores: Sequence[float], recall: float) -> float:
+    """
+    The highest score threshold that still lets through the share recall of the chunks that yielded facts.
+    :param positive_scores: Out of fold scores of those chunks, sorted.
+    """
+    if not positive_scores:
+        return 0.0
+    index = int(math.floor((1 - min(max(recall, 0.0), 1.0)) * len(positive_scores) + 1e-9))
+    return positive_scores[min(index, len(positive_scores) - 1)]
+
+
+class RelevanceGate:
+    """
+    The trained classifiers of the gated prompts, and the count of calls let through and skipped.
+    """
+
+    def __init__(
+        self,
+        vectorizer: TfidfVectorizer,
+        models: Dict[str, LogisticModel],
+        positive_scores: Dict[str, List[float]],
+        recall: float = RELEVANCE_GATE_RECALL,
+    ) -> None:
+        """
+        :param positive_scores: Per task, the sorted out of fold scores of the chunks that yielded facts, from
+                                which the threshold of any recall is read without training again.
+        """
+        self.vectorizer = vectorizer
+        self.models = models
+        self.positive_scores = positive_scores
+        self.thresholds = {task: recall_threshold(positive_scores.get(task, []), recall) for task in models}
+        self.recall = recall
+        self.checked: Counter = Counter()
+        self.skipped: Counter = Counter()
+        self._lock = threading.Lock()
+        self._last: Tuple[Optional[str], Dict[int, float]] = (None, {})
+
+    def _vector(self, text: str) -> Dict[int, float]:
+        # The prompts of one chunk are gated one after the other, it is vectorized once
+        with self._lock:
+            last_text, vector = self._last
+        if last_text != text:
+            vector = self.vectorizer.transform(text)
+            with self._lock:
+                self._last = (text, vector)
+        return vector
+
+    def score(self, task: str, text: str) -> Optional[float]:
+        """
+        :return: The probability that the prompt of the task yields facts on the chunk, None for an ungated task.
+        """
+        model = self.models.get(task)
+        if model is None:
+            return None
+        return model.probability(self._vector(text))
+
+    def should_call(self, task: str, text: str) -> bool:
+        """
+        False when the prompt of the task can be skipped: the chunk scores below the threshold of the recall.
+        """
+        score = self.score(task, text)
+        if score is None:
+            return True
+        skip = score < self.thresholds[task] and not _explored(task, text)
+        with self._lock:
+            self.checked[task] += 1
+            self.skipped[task] += skip
+        return not skip
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {
+            task: {
+                "threshold": round(self.thresholds[task], 4),
+                "checked": self.checked[task],
+                "skipped": self.skipped[task],
+            }
+            for task in self.models
+        }
+
+    def to_dict(self) -> dict:
+        return {
+            "feature_dimension": FEATURE_DIMENSION,
+            "idf": self.vectorizer.idf,
+            "default_idf": self.vectorizer.default_idf,
+            "models": {task: {"weights": model.weights, "bias": model.bias} for task, model in self.models.items()},
+            "positive_scores": self.positive_scores,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, recall: float = RELEVANCE_GATE_RECALL) -> "RelevanceGate":
+        if data.get("feature_dimension") != FEATURE_DIMENSION:
+            raise ValueError("Relevance gate trained with other features, train it again")
+        vectorizer = TfidfVectorizer(
+            {int(feature): idf for feature, idf in data["idf"].items()}, data["default_idf"]
+        )
+        models = {
+            task: LogisticModel({int(feature): weight for feature, weight in model["weights"].items()}, model["bias"])
+            for task, model in data["models"].items()
+        }
+        return cls(vectorizer, models, data["positive_scores"], recall)
+
+
+class RelevanceLog:
+    """
+    Outcome of the gated prompts: for every chunk and task, whether the LLM found facts in it.
+    """
+
+    def __init__(self, path: str = RELEVANCE_LOG_PATH) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chunk_outcomes (
+                    key TEXT PRIMARY KEY,
+                    task TEXT NOT NULL,
+                    chunk TEXT NOT NULL,
+                    yielded INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def record(self, task: str, text: str, yielded: bool) -> None:
+        chunk = normalize_chunk(text)
+        key = hashlib.sha256(f"{task}\0{chunk}".encode("utf-8")).hexdigest()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO chunk_outcomes (key, task, chunk, yielded, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, task, chunk, int(yielded), time.time()),
+            )
+
+    def examples(self) -> Dict[str, List[Tuple[str, bool]]]:
+        """
+        :return: Per task, the (chunk, yielded) outcomes in logging order.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT task, chunk, yielded FROM chunk_outcomes ORDER BY created_at"
+            ).fetchall()
+        examples: Dict[str, List[Tuple[str, bool]]] = defaultdict(list)
+        for task, chunk, yielded in rows:
+            examples[task].append((chunk, bool(yielded)))
+        return dict(examples)
+
+
+_relevance_log: Optional[RelevanceLog] = None
+_relevance_gate: Optional[RelevanceGate] = None
+_relevance_gate_loaded = False
+
+
+def get_relevance_log() -> Optional[RelevanceLog]:
+    """
+    The process wide outcome log, or None when RELEVANCE_LOG_PATH is empty.
+    """
+    global _relevance_log
+    if _relevance_log is None and RELEVANCE_LOG_PATH:
+        _relevance_log = RelevanceLog(RELEVANCE_LOG_PATH)
+    return _relevance_log
+
+
+def record_outcome(task: str, text: str, yielded: bool) -> None:
+    log = get_relevance_log()
+    if log is not None:
+        log.record(task, text, yielded)
+
+
+def get_relevance_gate() -> Optional[RelevanceGate]:
+    """
+    The process wide gate, loaded from RELEVANCE_GATE_PATH on first use. None when the gate is disabled or untrained.
+    """
+    global _relevance_gate, _relevance_gate_loaded
+    if not _relevance_gate_loaded:
+        _relevance_gate_loaded = True
+        if RELEVANCE_GATE and RELEVANCE_GATE_PATH and os.path.exists(RELEVANCE_GATE_PATH):
+            with open(RELEVANCE_GATE_PATH) as f:
+                _relevance_gate = RelevanceGate.from_dict(json.load(f))
+            print(f"Relevance gate loaded for {', '.join(_relevance_gate.models)} (recall {RELEVANCE_GATE_RECALL})")
+    return _relevance_gate
+
+
+def _fold(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8")) % CROSS_VALIDATION_FOLDS
+
+
+def train_relevance_gate(
+    examples: Dict[str, List[Tuple[str, bool]]], recall: float = RELEVANCE_GATE_RECALL
+) -> Tuple[RelevanceGate, Dict[str, Dict[str, float]]]:
+    """
+    Train one classifier per task on the logged outcomes. The thresholds come from out of fold scores
+    (cross validation), so the recall and the calls saved reported are those to expect on new chunks.
+    :param examples: Per task, the (chunk, yielded) outcomes.
+    :return: The gate, and per task the examples, positives, threshold, recall and share of calls saved.
+    """
+    texts = list({text for outcomes in examples.values() for text, _ in outcomes})
+    vectorizer = TfidfVectorizer.fit(texts)
+    vectors = {text: vectorizer.transform(text) for text in texts}
+
+    models, positive_scores, report = {}, {}, {}
+    for task, outcomes in examples.items():
+        positives = sum(yielded for _, yielded in outcomes)
+        if len(outcomes) < MIN_EXAMPLES or positives < MIN_POSITIVES or positives == len(outcomes):
+            report[task] = {"examples": len(outcomes), "positives": positives, "gated": False}
+            continue
+        scores: List[Tuple[float, bool]] = []
+        for fold in range(CROSS_VALIDATION_FOLDS):
+            training = [(text, yielded) for text, yielded in outcomes if _fold(text) != fold]
+            held_out = [(text, yielded) for text, yielded in outcomes if _fold(text) == fold]
+            if not held_out:
+                continue
+            model = LogisticModel.fit([vectors[text] for text, _ in training], [yielded for _, yielded in training])
+            scores.extend((model.probability(vectors[text]), yielded) for text, yielded in held_out)
+
+        task_positive_scores = sorted(score for score, yielded in scores if yielded)
+        threshold = recall_threshold(task_positive_scores, recall)
+        skipped = [yielded for score, yielded in scores if score < threshold]
+        models[task] = LogisticModel.fit([vectors[text] for text, _ in outcomes], [yielded for _, yielded in outcomes])
+        positive_scores[task] = task_positive_scores
+        report[task] = {
+            "examples": len(outcomes),
+            "positives": positives,
+            "gated": True,
+            "threshold": round(threshold, 4),
+            "recall": round(1 - sum(skipped) / positives, 4),
+            "calls_saved": round(len(skipped) / len(scores), 4),
+        }
+    return RelevanceGate(vectorizer, models, positive_scores, recall), report
+
+
+def _train(args: argparse.Namespace) -> None:
+    examples = RelevanceLog(args.log).examples()
+    gate, report = train_relevance_gate(examples, args.recall)
+    for task, task_report in report.items():
+        print(task, task_report)
+    if not gate.models:
+        print("Not enough logged outcomes to gate any prompt")
+        return
+    with open(args.out, "w") as f:
+        json.dump(gate.to_dict(), f)
+    print(f"Relevance gate written to {args.out}")
+
+
+def _report(args: argparse.Namespace) -> None:
+    with open(args.out) as f:
+        gate = RelevanceGate.from_dict(json.load(f), args.recall)
+    examples = RelevanceLog(args.log).examples() if os.path.exists(args.log) else {}
+    for task in gate.models:
+        # On the logged chunks the model was trained on, so an optimistic estimate
+        skipped = [yielded for text, yielded in examples.get(task, []) if gate.score(task, text) < gate.thresholds[task]]
+        print(task, {
+            "threshold": round(gate.thresholds[task], 4),
+            "logged": len(examples.get(task, [])),
+            "skipped": len(skipped),
+            "positives_skipped": sum(skipped),
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train or inspect the relevance gate of the product discovery prompts.")
+    parser.add_argument("command", choices=["train", "report"])
+    parser.add_argument("--log", default=RELEVANCE_LOG_PATH or "relevance_log.sqlite3", help="Outcome log to train on.")
+    parser.add_argument("--out", default=RELEVANCE_GATE_PATH or data_path("relevance_gate.json"), help="Trained gate file.")
+    parser.add_argument("--recall", type=float, default=RELEVANCE_GATE_RECALL, help="Recall of the chunks with facts.")
+    args = parser.parse_args()
+    if args.command == "train":
+        _train(args)
+    else:
+        _report(args)
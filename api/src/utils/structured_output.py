@@ -0,0 +1,72 @@
+import json
+import logging
+from typing import Any, Dict, List, Optional, Type, TypeVar, Union
+
+from pydantic import BaseModel, ValidationError
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class ProductSummary(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+
+
+class ChemicalWeight(BaseModel):
+    chemical: str
+    weight: Optional[str] = None
+
+
+class CompositionReport(BaseModel):
+    functional_roles: Dict[str, List[ChemicalWeight]] = {}
+
+
+class PatentDetails(BaseModel):
+    patent_no: Optional[str] = None
+    inventor_name: Optional[List[str]] = None
+    assignee_information: Optional[str] = None
+    cpcc_codes: Optional[List[str]] = None
+
+
+class PatentDocument(BaseModel):
+    patent: PatentDetails = PatentDetails()
+
+
+class GraphNode(BaseModel):
+    name: str
+    label: str
+    properties: Dict[str, Any] = {}
+
+
+class GraphRelationship(BaseModel):
+    start: str
+    type: str
+    end: str
+    properties: Dict[str, Any] = {}
+
+
+class GraphExtraction(BaseModel):
+    nodes: List[GraphNode] = []
+    relationships: List[GraphRelationship] = []
+
+
+def json_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    JSON schema of a result model, as expected by the OpenAI response_format and the Ollama format field.
+    """
+    return model.schema()
+
+
+def parse_structured(model: Type[T], output: Union[str, Dict[str, Any]]) -> Optional[T]:
+    """
+    Parse an LLM answer produced in JSON mode into a result model.
+    :param model: The expected result model.
+    :param output: The raw JSON string or an already decoded object.
+    :return: The model instance, or None if the answer is not valid JSON for the model.
+    """
+    try:
+        data = json.loads(output) if isinstance(output, str) else output
+        return model.parse_obj(data)
+    except (ValueError, TypeError, ValidationError) as e:
+        logging.warning(f"Failed to parse {model.__name__} from LLM output: {e}")
+        return None
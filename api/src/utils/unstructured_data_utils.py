@@ -1,60 +1,35 @@
-import json
-import re
 import csv
 import tiktoken
 
-regex = "Nodes:\s+(.*?)\s?\s?Relationships:\s+(.*)"
-internalRegex = "\[(.*?)\]"
-jsonRegex = "\{.*\}"
+from utils.llm_output_parser import (
+    entries_to_nodes,
+    entries_to_relationships,
+    parse_entries,
+    parse_graph_outputs,
+)
 
 
 def nodesTextToListOfDict(nodes):
-    result = []
-    for node in nodes:
-        nodeList = node.split(",")
-        if len(nodeList) < 2:
-            continue
-
-        name = nodeList[0].strip().replace('"', "")
-        label = nodeList[1].strip().replace('"', "")
-        properties = re.search(jsonRegex, node)
-        if properties == None:
-            properties = "{}"
-        else:
-            properties = properties.group(0)
-        properties = properties.replace("True", "true")
-        try:
-            properties = json.loads(properties)
-        except:
-            properties = {}
-        result.append({"name": name, "label": label, "properties": properties})
-    return result
+    """
+    :param nodes: The text between the brackets of every node entry.
+    """
+    return entries_to_nodes(entry for node in nodes for entry in parse_entries("[" + node + "]"))
 
 
 def relationshipTextToListOfDict(relationships):
-    result = []
-    for relation in relationships:
-        relationList = relation.split(",")
-        if len(relation) < 3:
-            continue
-        start = relationList[0].strip().replace('"', "")
-        end = relationList[2].strip().replace('"', "")
-        type = relationList[1].strip().replace('"', "")
+    """
+    :param relationships: The text between the brackets of every relationship entry.
+    """
+    return entries_to_relationships(
+        entry for relation in relationships for entry in parse_entries("[" + relation + "]")
+    )
 
-        properties = re.search(jsonRegex, relation)
-        if properties == None:
-            properties = "{}"
-        else:
-            properties = properties.group(0)
-        properties = properties.replace("True", "true")
-        try:
-            properties = json.loads(properties)
-        except:
-            properties = {}
-        result.append(
-            {"start": start, "end": end, "type": type, "properties": properties}
-        )
-    return result
+
+def getNodesAndRelationshipsFromResult(result):
+    """
+    Nodes and relationships of the "Nodes: [...] Relationships: [...]" answers of the LLM, in order.
+    """
+    return parse_graph_outputs(result)
 
 def save_intermediate_results_to_csv(intermediate_results):
     """